@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from sqlalchemy import case, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import UserActivity, get_async_session
+
+# Загрузка переменных окружения
+load_dotenv()
+# Как часто сбрасывать накопленную активность в базу (в секундах)
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '10'))
+# Сколько пользователей накопить, чтобы сбросить активность раньше таймера
+ACTIVITY_FLUSH_SIZE = int(os.getenv('ACTIVITY_FLUSH_SIZE', '500'))
+# Дневные лимиты на пользователя: вопросов и токенов GigaChat (0 — без лимита)
+DAILY_QUESTION_LIMIT = int(os.getenv('DAILY_QUESTION_LIMIT', '0'))
+DAILY_TOKEN_LIMIT = int(os.getenv('DAILY_TOKEN_LIMIT', '0'))
+
+# Причины отказа по квоте
+QUESTIONS = 'questions'
+TOKENS = 'tokens'
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class _Pending:
+    """Прирост активности одного пользователя за сутки, ещё не записанный в базу."""
+
+    __slots__ = ('last_seen', 'questions', 'prompt_tokens', 'completion_tokens')
+
+    def __init__(self, last_seen):
+        self.last_seen = last_seen
+        self.questions = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def merge(self, other):
+        self.last_seen = max(self.last_seen, other.last_seen)
+        self.questions += other.questions
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+
+
+class ActivityBuffer:
+    """
+    Накопитель активности пользователей с отложенной записью в user_activity.
+
+    Обработчики только меняют счётчики в памяти; в базу они уходят одним
+    upsert на всех пользователей — по таймеру, при накоплении flush_size
+    пользователей и при остановке бота. Если запись не удалась, прирост
+    возвращается в буфер и уходит со следующей пачкой.
+
+    Расход за текущие сутки (UTC) тоже хранится в памяти, поэтому квоты
+    проверяются без запросов к базе; при запуске он восстанавливается из
+    user_activity. Пользователь всегда обслуживается одним процессом (шарды
+    делятся по id пользователя), так что счётчики разных процессов не пересекаются.
+    """
+
+    def __init__(
+        self,
+        flush_interval=ACTIVITY_FLUSH_INTERVAL,
+        flush_size=ACTIVITY_FLUSH_SIZE,
+        question_limit=DAILY_QUESTION_LIMIT,
+        token_limit=DAILY_TOKEN_LIMIT,
+        session_factory=get_async_session,
+        clock=_utcnow
+    ):
+        self.flush_interval = flush_interval
+        self.flush_size = max(flush_size, 1)
+        self.question_limit = question_limit
+        self.token_limit = token_limit
+        self._session_factory = session_factory
+        self._clock = clock
+        self._pending = {}  # (telegram_id, день) -> _Pending
+        self._today = clock().date()
+        self._usage = {}  # telegram_id -> [вопросов, токенов] за self._today
+        self._task = None
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+        self.flushed = 0
+        self.flush_errors = 0
+        self.rejected = {QUESTIONS: 0, TOKENS: 0}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _entry(self, telegram_id):
+        now = self._clock()
+        day = now.date()
+        if day != self._today:
+            # Новые сутки: квоты начинаются заново
+            self._today = day
+            self._usage.clear()
+        key = (telegram_id, day)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _Pending(now)
+            if len(self._pending) >= self.flush_size:
+                self._schedule_flush()
+        else:
+            pending.last_seen = now
+        return pending
+
+    def _today_usage(self, telegram_id):
+        usage = self._usage.get(telegram_id)
+        if usage is None:
+            usage = self._usage[telegram_id] = [0, 0]
+        return usage
+
+    def touch(self, telegram_id):
+        """Отмечает обращение пользователя к боту."""
+        self._entry(telegram_id)
+
+    def check_quota(self, telegram_id):
+        """Возвращает причину отказа (QUESTIONS или TOKENS), если дневной лимит исчерпан, иначе None."""
+        if self._clock().date() != self._today:
+            return None
+        questions, tokens = self._usage.get(telegram_id, (0, 0))
+        reason = None
+        if self.question_limit and questions >= self.question_limit:
+            reason = QUESTIONS
+        elif self.token_limit and tokens >= self.token_limit:
+            reason = TOKENS
+        if reason is not None:
+            self.rejected[reason] += 1
+        return reason
+
+    def record_question(self, telegram_id):
+        self._entry(telegram_id).questions += 1
+        self._today_usage(telegram_id)[0] += 1
+
+    def record_usage(self, telegram_id, usage):
+        """Учитывает поле usage ответа GigaChat; ответ может немного превысить лимит токенов."""
+        if not usage:
+            return
+        pending = self._entry(telegram_id)
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        completion_tokens = usage.get('completion_tokens') or 0
+        pending.prompt_tokens += prompt_tokens
+        pending.completion_tokens += completion_tokens
+        self._today_usage(telegram_id)[1] += prompt_tokens + completion_tokens
+
+    def _schedule_flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            # Вне цикла событий (например, в скрипте) запись подождёт таймера или остановки
+            pass
+
+    async def flush(self):
+        """Записывает накопленную активность одним upsert; возвращает число записанных строк."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            try:
+                await self._upsert(batch)
+            except Exception as e:
+                self.flush_errors += 1
+                logger.error(f"Ошибка при записи активности пользователей ({len(batch)} строк): {e}")
+                # Прирост, накопленный за время записи, складываем с неудавшейся пачкой
+                for key, pending in self._pending.items():
+                    if key in batch:
+                        batch[key].merge(pending)
+                    else:
+                        batch[key] = pending
+                self._pending = batch
+                return 0
+            self.flushed += len(batch)
+            return len(batch)
+
+    async def _upsert(self, batch):
+        rows = [
+            {
+                'telegram_id': telegram_id,
+                'day': day,
+                'last_seen': pending.last_seen,
+                'questions': pending.questions,
+                'prompt_tokens': pending.prompt_tokens,
+                'completion_tokens': pending.completion_tokens,
+            }
+            for (telegram_id, day), pending in batch.items()
+        ]
+        table = UserActivity.__table__
+        async with self._session_factory() as session:
+            dialect = session.get_bind().dialect.name
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            statement = insert(table)
+            excluded = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.telegram_id, table.c.day],
+                set_={
+                    'last_seen': case((excluded.last_seen > table.c.last_seen, excluded.last_seen), else_=table.c.last_seen),
+                    'questions': table.c.questions + excluded.questions,
+                    'prompt_tokens': table.c.prompt_tokens + excluded.prompt_tokens,
+                    'completion_tokens': table.c.completion_tokens + excluded.completion_tokens,
+                }
+            )
+            await session.execute(statement, rows)
+            await session.commit()
+
+    async def _load_usage(self):
+        # Расход за сегодня, уже записанный до перезапуска
+        today = self._clock().date()
+        async with self._session_factory() as session:
+            rows = await session.execute(
+                select(
+                    UserActivity.telegram_id,
+                    UserActivity.questions,
+                    UserActivity.prompt_tokens + UserActivity.completion_tokens
+                ).where(UserActivity.day == today)
+            )
+            usage = {telegram_id: [questions, tokens] for telegram_id, questions, tokens in rows}
+        # Счётчики, набранные до окончания загрузки, складываются с сохранёнными
+        if today == self._today:
+            for telegram_id, (questions, tokens) in self._usage.items():
+                saved = usage.setdefault(telegram_id, [0, 0])
+                saved[0] += questions
+                saved[1] += tokens
+        self._today = today
+        self._usage = usage
+        logger.info(f"Загружен расход за {today}: {len(usage)} пользователей")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        """Восстанавливает дневной расход из базы и запускает периодическую запись."""
+        if self.question_limit or self.token_limit:
+            try:
+                await self._load_usage()
+            except Exception as e:
+                logger.error(f"Ошибка при загрузке расхода пользователей: {e}")
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Останавливает таймер и записывает всё накопленное."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'flushed': self.flushed,
+            'flush_errors': self.flush_errors,
+            'rejected_questions': self.rejected[QUESTIONS],
+            'rejected_tokens': self.rejected[TOKENS],
+        }
@@ -1,53 +1,251 @@
 import argparse
+import csv
+import json
+import time
+from urllib.parse import urlsplit, urlunsplit
 from models import Resource, SessionLocal
+from registry import get_registry
 import sys
 import traceback
 
+import validators
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Маппинг английских типов на русские
+RESOURCE_TYPES = {
+    'Article': 'Статья',
+    'Video': 'Видео',
+    'Tutorial': 'Туториал'
+}
+
+# Порты по умолчанию, которые не влияют на адрес ресурса
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
 def clean_string(s):
     return ''.join(c for c in s if not (0xD800 <= ord(c) <= 0xDFFF))
 
 
+def normalize_link(link):
+    """Приводит ссылку к каноническому виду для поиска дубликатов."""
+    parts = urlsplit(link.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[len('www.'):]
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{host}:{parts.port}'
+    path = parts.path.rstrip('/')
+    return urlunsplit((scheme, netloc, path, parts.query, ''))
+
+
+def validate_resource(subject, type, title, link, allowed_subjects=None):
+    """
+    Проверяет данные ресурса по тем же правилам, что и manage.py addresource.
+
+    type принимается как на русском, так и на английском; предмет и тип должны
+    быть в справочниках. Возвращает словарь для вставки в таблицу resources
+    или бросает ValueError.
+    """
+    registry = get_registry()
+    subject = (subject or '').strip()
+    if not subject:
+        raise ValueError("Предмет не может быть пустым.")
+    if allowed_subjects is not None and subject not in allowed_subjects:
+        raise ValueError(f"Неизвестный предмет: {subject}")
+    subject_id = registry.subject_id(subject)
+
+    type = (type or '').strip()
+    type_id = registry.type_ids.get(RESOURCE_TYPES.get(type, type))
+    if type_id is None:
+        raise ValueError("Неверный тип ресурса.")
+
+    title = clean_string((title or '').strip())
+    if not title:
+        raise ValueError("Название ресурса не может быть пустым.")
+
+    link = (link or '').strip()
+    if not validators.url(link):
+        raise ValueError("Некорректный формат URL.")
+
+    return {
+        'subject_id': subject_id,
+        'type_id': type_id,
+        'title': title,
+        'link': link,
+        'normalized_link': normalize_link(link),
+    }
+
+
+def upsert_resources(session, rows):
+    """
+    Вставляет пачку ресурсов одним executemany; при совпадении нормализованной
+    ссылки обновляет существующую запись. Возвращает число обработанных строк.
+    """
+    # В одном INSERT ... ON CONFLICT строка не может обновиться дважды,
+    # поэтому дубликаты внутри пачки схлопываются (побеждает последняя)
+    rows = list({row['normalized_link']: row for row in rows}.values())
+    if not rows:
+        return 0
+    dialect = session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    statement = insert(Resource.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Resource.__table__.c.normalized_link],
+        set_={
+            'subject_id': statement.excluded.subject_id,
+            'type_id': statement.excluded.type_id,
+            'title': statement.excluded.title,
+            'link': statement.excluded.link,
+        }
+    )
+    session.execute(statement, rows)
+    return len(rows)
+
+
+def add_resource(resource, update=False, session_factory=SessionLocal):
+    """
+    Сохраняет один проверенный ресурс (результат validate_resource).
+
+    Возвращает True, если ресурс добавлен, и False, если обновлён ресурс с той же
+    нормализованной ссылкой. Без update такой ресурс не перезаписывается: бросается ValueError.
+    """
+    with session_factory() as session:
+        existing = session.scalar(select(Resource).where(Resource.normalized_link == resource['normalized_link']))
+        if existing is None:
+            session.add(Resource(**resource))
+        elif update:
+            for key, value in resource.items():
+                setattr(existing, key, value)
+        else:
+            raise ValueError(
+                f"Ресурс с такой ссылкой уже есть (id {existing.id}, «{existing.title}»). "
+                f"Чтобы перезаписать его, используйте --update."
+            )
+        session.commit()
+    return existing is None
+
+
+def read_resource_rows(source, input_format):
+    """Потоково читает строки ресурсов из CSV (с заголовком) или JSONL, возвращая (номер строки, dict)."""
+    if input_format == 'csv':
+        reader = csv.DictReader(source)
+        for row in reader:
+            yield reader.line_num, row
+    elif input_format == 'jsonl':
+        for line_number, line in enumerate(source, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Строка {line_number}: некорректный JSON ({e})") from e
+            yield line_number, row
+    else:
+        raise ValueError(f"Неподдерживаемый формат: {input_format}")
+
+
+class ImportStats:
+    __slots__ = ('read', 'written', 'invalid', 'started_at')
+
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+        self.invalid = 0
+        self.started_at = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def import_resources(
+    rows,
+    batch_size=5000,
+    allowed_subjects=None,
+    session_factory=SessionLocal,
+    on_invalid=None,
+    on_batch=None
+):
+    """
+    Импортирует ресурсы пачками: каждая пачка — один upsert и одна транзакция.
+
+    on_invalid(номер строки, ошибка) и on_batch(ImportStats) вызываются для отчёта о ходе импорта.
+    """
+    stats = ImportStats()
+    batch = []
+    with session_factory() as session:
+        def flush():
+            stats.written += upsert_resources(session, batch)
+            session.commit()
+            batch.clear()
+            if on_batch is not None:
+                on_batch(stats)
+
+        for line_number, row in rows:
+            stats.read += 1
+            try:
+                batch.append(validate_resource(
+                    row.get('subject'),
+                    row.get('type'),
+                    row.get('title'),
+                    row.get('link'),
+                    allowed_subjects=allowed_subjects
+                ))
+            except (ValueError, AttributeError) as e:
+                stats.invalid += 1
+                if on_invalid is not None:
+                    on_invalid(line_number, e)
+                continue
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    return stats
+
+
 def main():
     parser = argparse.ArgumentParser(description='Добавление ресурса в базу данных.')
     parser.add_argument('--subject', required=True, help='Предмет')
-    parser.add_argument('--type', choices=['Article', 'Video', 'Tutorial'], required=True, help='Тип ресурса')
+    parser.add_argument('--type', choices=list(RESOURCE_TYPES), required=True, help='Тип ресурса')
     parser.add_argument('--title', required=True, help='Название ресурса')
     parser.add_argument('--link', required=True, help='Ссылка на ресурс')
+    parser.add_argument('--notify', action='store_true', help='Поставить в очередь уведомление подписчикам предмета')
+    parser.add_argument('--update', action='store_true', help='Перезаписать ресурс, если ссылка уже есть в базе')
 
     args = parser.parse_args()
 
-    # Маппинг английских типов на русские
-    type_mapping_reverse = {
-        'Article': 'Статья',
-        'Video': 'Видео',
-        'Tutorial': 'Туториал'
-    }
-
-    type_russian = type_mapping_reverse.get(args.type)
-    if not type_russian:
-        print("Неверный тип ресурса.")
+    try:
+        # Проверка данных и очистка названия от некорректных символов
+        resource = validate_resource(args.subject, args.type, args.title, args.link)
+    except ValueError as e:
+        print(e)
         sys.exit(1)
 
-    # Очистка названия от некорректных символов
-    cleaned_title = clean_string(args.title)
-
-    # Создание нового ресурса
-    new_resource = Resource(
-        subject=args.subject,
-        type=type_russian,  # Сохраняем русский тип
-        title=cleaned_title,
-        link=args.link
-    )
-
     try:
-        with SessionLocal() as session:
-            session.add(new_resource)
-            session.commit()
+        added = add_resource(resource, update=args.update)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
     except Exception as e:
         print("Произошла ошибка при добавлении ресурса:")
         traceback.print_exc()
         sys.exit(1)
+    print(f"Ресурс '{resource['title']}' {'добавлен' if added else 'обновлён'}.")
+
+    if args.notify:
+        from notifications import enqueue_notification
+
+        # Рассылку выполнит запущенный бот через свой лимит отправки
+        print(f"Рассылка {enqueue_notification(resource['normalized_link'])} поставлена в очередь.")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,200 @@
+"""Drop string subject/type columns from resources in favour of lookup keys
+
+Revision ID: 0a6d4e93c1f5
+Revises: f3a8c61d2b70
+Create Date: 2026-10-17 20:30:00.000000
+
+Второй шаг (contract): выполняется после выката кода, который читает и пишет
+только subject_id/type_id. Удаляет триггер синхронизации из f3a8c61d2b70,
+ещё раз дозаполняет id по названиям (на случай строк, записанных в обход
+триггера) и удаляет строковые колонки вместе с их индексами.
+
+Миграция лежит в отдельной ветке contract и не применяется при запуске бота
+(manage.py runbot): её запускают явно командой manage.py contract, когда
+старых процессов уже не осталось.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a6d4e93c1f5'
+down_revision: Union[str, None] = 'f3a8c61d2b70'
+branch_labels: Union[str, Sequence[str], None] = ('contract',)
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+# Копии models.RESOURCE_SEARCH_VECTOR до и после миграции
+OLD_SEARCH_VECTOR = "to_tsvector('russian', title || ' ' || subject || ' ' || type)"
+SEARCH_VECTOR = "to_tsvector('russian', title)"
+
+# Копия LOOKUP_COLUMNS и триггеров синхронизации из f3a8c61d2b70: при upgrade
+# триггеры удаляются, при downgrade создаются снова
+LOOKUP_COLUMNS = (('subject', 'subject_id', 'subjects'), ('type', 'type_id', 'resource_types'))
+
+BACKFILL = sa.text(
+    'UPDATE resources SET '
+    'subject_id = (SELECT subjects.id FROM subjects WHERE subjects.name = resources.subject), '
+    'type_id = (SELECT resource_types.id FROM resource_types WHERE resource_types.name = resources.type) '
+    'WHERE id > :low AND id <= :high AND (subject_id IS NULL OR type_id IS NULL)'
+)
+
+
+def _postgresql_sync(name, id_column, table):
+    # Новое или изменённое название без изменения id — id по названию (название добавляется
+    # в справочник), и наоборот; дозаполнение id (был NULL) названия не трогает
+    return f"""
+    IF NEW.{name} IS NOT NULL AND (
+        (TG_OP = 'INSERT' AND NEW.{id_column} IS NULL)
+        OR (TG_OP = 'UPDATE' AND NEW.{name} IS DISTINCT FROM OLD.{name} AND NEW.{id_column} IS NOT DISTINCT FROM OLD.{id_column})
+    ) THEN
+        INSERT INTO {table} (name) VALUES (NEW.{name}) ON CONFLICT (name) DO NOTHING;
+        NEW.{id_column} := (SELECT id FROM {table} WHERE name = NEW.{name});
+    ELSIF NEW.{id_column} IS NOT NULL AND (
+        (TG_OP = 'INSERT' AND NEW.{name} IS NULL)
+        OR (TG_OP = 'UPDATE' AND OLD.{id_column} IS NOT NULL AND NEW.{id_column} IS DISTINCT FROM OLD.{id_column}
+            AND NEW.{name} IS NOT DISTINCT FROM OLD.{name})
+    ) THEN
+        NEW.{name} := (SELECT name FROM {table} WHERE id = NEW.{id_column});
+    END IF;"""
+
+
+def _sqlite_sync(name, id_column, table):
+    return [
+        f'CREATE TRIGGER resources_sync_{name}_insert AFTER INSERT ON resources BEGIN '
+        f'INSERT OR IGNORE INTO {table} (name) SELECT NEW.{name} WHERE NEW.{name} IS NOT NULL AND NEW.{id_column} IS NULL; '
+        f'UPDATE resources SET '
+        f'{id_column} = COALESCE({id_column}, (SELECT id FROM {table} WHERE name = NEW.{name})), '
+        f'{name} = COALESCE({name}, (SELECT name FROM {table} WHERE id = NEW.{id_column})) '
+        f'WHERE id = NEW.id; END',
+        f'CREATE TRIGGER resources_sync_{name}_name AFTER UPDATE OF {name} ON resources '
+        f'WHEN NEW.{name} IS NOT NULL AND NEW.{name} IS NOT OLD.{name} AND NEW.{id_column} IS OLD.{id_column} BEGIN '
+        f'INSERT OR IGNORE INTO {table} (name) VALUES (NEW.{name}); '
+        f'UPDATE resources SET {id_column} = (SELECT id FROM {table} WHERE name = NEW.{name}) WHERE id = NEW.id; END',
+        f'CREATE TRIGGER resources_sync_{name}_id AFTER UPDATE OF {id_column} ON resources '
+        f'WHEN NEW.{id_column} IS NOT NULL AND OLD.{id_column} IS NOT NULL AND NEW.{id_column} IS NOT OLD.{id_column} '
+        f'AND NEW.{name} IS OLD.{name} BEGIN '
+        f'UPDATE resources SET {name} = (SELECT name FROM {table} WHERE id = NEW.{id_column}) WHERE id = NEW.id; END',
+    ]
+
+
+def create_sync_triggers(connection):
+    """Триггеры, синхронизирующие названия и id в resources, пока работает старая версия бота."""
+    if connection.dialect.name == 'postgresql':
+        body = ''.join(_postgresql_sync(*columns) for columns in LOOKUP_COLUMNS)
+        connection.execute(sa.text(
+            'CREATE OR REPLACE FUNCTION resources_sync_lookup_columns() RETURNS trigger AS $$ '
+            f'BEGIN {body}\n    RETURN NEW;\nEND $$ LANGUAGE plpgsql'
+        ))
+        connection.execute(sa.text(
+            'CREATE TRIGGER resources_sync_lookup_columns BEFORE INSERT OR UPDATE ON resources '
+            'FOR EACH ROW EXECUTE FUNCTION resources_sync_lookup_columns()'
+        ))
+        return
+    for columns in LOOKUP_COLUMNS:
+        for statement in _sqlite_sync(*columns):
+            connection.execute(sa.text(statement))
+
+
+def drop_sync_triggers(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(sa.text('DROP TRIGGER IF EXISTS resources_sync_lookup_columns ON resources'))
+        connection.execute(sa.text('DROP FUNCTION IF EXISTS resources_sync_lookup_columns()'))
+        return
+    for name, _, _ in LOOKUP_COLUMNS:
+        for suffix in ('insert', 'name', 'id'):
+            connection.execute(sa.text(f'DROP TRIGGER IF EXISTS resources_sync_{name}_{suffix}'))
+
+
+def seed_missing(connection, table, column):
+    # Названия, появившиеся в resources уже после первого шага
+    connection.execute(sa.text(
+        f'INSERT INTO {table} (name) SELECT DISTINCT {column} FROM resources '
+        f'WHERE {column} IS NOT NULL AND {column} NOT IN (SELECT name FROM {table})'
+    ))
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    is_postgresql = connection.dialect.name == 'postgresql'
+    # Старых процессов уже нет, поэтому синхронизация больше не нужна; строки,
+    # которые она могла пропустить, дозаполняются ниже
+    drop_sync_triggers(connection)
+    seed_missing(connection, 'subjects', 'subject')
+    seed_missing(connection, 'resource_types', 'type')
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        # Дозаполнение затрагивает только строки с NULL, но идёт теми же пачками
+        low, high = connection.execute(
+            sa.text('SELECT MIN(id) - 1, MAX(id) FROM resources WHERE subject_id IS NULL OR type_id IS NULL')
+        ).one()
+        while low is not None and low < high:
+            connection.execute(BACKFILL, {'low': low, 'high': low + BATCH_SIZE})
+            low += BATCH_SIZE
+        op.drop_index('ix_resources_type_subject_id', table_name='resources', postgresql_concurrently=True)
+        op.drop_index('ix_resources_subject_id', table_name='resources', postgresql_concurrently=True)
+        if is_postgresql:
+            op.drop_index('ix_resources_search', table_name='resources', postgresql_concurrently=True)
+            op.create_index(
+                'ix_resources_search',
+                'resources',
+                [sa.text(SEARCH_VECTOR)],
+                postgresql_using='gin',
+                postgresql_concurrently=True
+            )
+
+    if is_postgresql:
+        # NOT NULL и внешние ключи проверяются без долгой эксклюзивной блокировки:
+        # ограничения создаются NOT VALID и проверяются отдельно, а SET NOT NULL
+        # при наличии проверенного CHECK не сканирует таблицу
+        for column, table in (('subject_id', 'subjects'), ('type_id', 'resource_types')):
+            op.execute(f'ALTER TABLE resources ADD CONSTRAINT check_{column}_not_null CHECK ({column} IS NOT NULL) NOT VALID')
+            op.execute(f'ALTER TABLE resources VALIDATE CONSTRAINT check_{column}_not_null')
+            op.execute(f'ALTER TABLE resources ALTER COLUMN {column} SET NOT NULL')
+            op.execute(f'ALTER TABLE resources DROP CONSTRAINT check_{column}_not_null')
+            op.execute(
+                f'ALTER TABLE resources ADD CONSTRAINT resources_{column}_fkey '
+                f'FOREIGN KEY ({column}) REFERENCES {table} (id) NOT VALID'
+            )
+            op.execute(f'ALTER TABLE resources VALIDATE CONSTRAINT resources_{column}_fkey')
+        op.drop_constraint('check_resource_type', 'resources', type_='check')
+        op.drop_column('resources', 'type')
+        op.drop_column('resources', 'subject')
+        return
+
+    with op.batch_alter_table('resources') as batch_op:
+        batch_op.alter_column('subject_id', existing_type=sa.SmallInteger(), nullable=False)
+        batch_op.alter_column('type_id', existing_type=sa.SmallInteger(), nullable=False)
+        batch_op.create_foreign_key('resources_subject_id_fkey', 'subjects', ['subject_id'], ['id'])
+        batch_op.create_foreign_key('resources_type_id_fkey', 'resource_types', ['type_id'], ['id'])
+        batch_op.drop_constraint('check_resource_type', type_='check')
+        batch_op.drop_column('type')
+        batch_op.drop_column('subject')
+
+
+def downgrade() -> None:
+    is_postgresql = op.get_bind().dialect.name == 'postgresql'
+    with op.batch_alter_table('resources') as batch_op:
+        batch_op.add_column(sa.Column('subject', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('type', sa.String(length=50), nullable=True))
+        batch_op.drop_constraint('resources_type_id_fkey', type_='foreignkey')
+        batch_op.drop_constraint('resources_subject_id_fkey', type_='foreignkey')
+        batch_op.alter_column('type_id', existing_type=sa.SmallInteger(), nullable=True)
+        batch_op.alter_column('subject_id', existing_type=sa.SmallInteger(), nullable=True)
+    op.execute(
+        'UPDATE resources SET '
+        'subject = (SELECT subjects.name FROM subjects WHERE subjects.id = resources.subject_id), '
+        'type = (SELECT resource_types.name FROM resource_types WHERE resource_types.id = resources.type_id)'
+    )
+    with op.batch_alter_table('resources') as batch_op:
+        batch_op.create_check_constraint('check_resource_type', "type IN ('Статья', 'Видео', 'Туториал')")
+    op.create_index('ix_resources_subject_id', 'resources', ['subject', 'id'])
+    op.create_index('ix_resources_type_subject_id', 'resources', ['type', 'subject', 'id'])
+    if is_postgresql:
+        op.drop_index('ix_resources_search', table_name='resources')
+        op.create_index('ix_resources_search', 'resources', [sa.text(OLD_SEARCH_VECTOR)], postgresql_using='gin')
+    # Снова возможна работа старой версии бота рядом с новой
+    create_sync_triggers(op.get_bind())
@@ -0,0 +1,37 @@
+"""Add user_activity for last-seen and daily usage accounting
+
+Revision ID: 1b7f3e5a9c24
+Revises: f3a8c61d2b70
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b7f3e5a9c24'
+down_revision: Union[str, None] = 'f3a8c61d2b70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_activity',
+        sa.Column('telegram_id', sa.BigInteger(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('last_seen', sa.DateTime(), nullable=False),
+        sa.Column('questions', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('prompt_tokens', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('completion_tokens', sa.Integer(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('telegram_id', 'day')
+    )
+    op.create_index('ix_user_activity_day', 'user_activity', ['day'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_activity_day', table_name='user_activity')
+    op.drop_table('user_activity')
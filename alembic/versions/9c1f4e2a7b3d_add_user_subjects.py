@@ -0,0 +1,60 @@
+"""Add user_subjects table and backfill it from users.subjects
+
+Revision ID: 9c1f4e2a7b3d
+Revises: 5ef5d5ac9789
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c1f4e2a7b3d'
+down_revision: Union[str, None] = '5ef5d5ac9789'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Размер пачки пользователей при переносе данных
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_subjects',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('subject', sa.String(length=255), primary_key=True)
+    )
+    op.create_index('ix_user_subjects_subject_user_id', 'user_subjects', ['subject', 'user_id'])
+
+    # Переносим предметы из JSON-колонки пачками, двигаясь по первичному ключу
+    users = sa.table('users', sa.column('id', sa.Integer), sa.column('subjects', sa.JSON))
+    user_subjects = sa.table('user_subjects', sa.column('user_id', sa.Integer), sa.column('subject', sa.String))
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(users.c.id, users.c.subjects)
+            .where(users.c.id > last_id)
+            .order_by(users.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        values = [
+            {'user_id': user_id, 'subject': subject}
+            for user_id, subjects in rows
+            for subject in dict.fromkeys(subjects or [])
+            if subject
+        ]
+        if values:
+            connection.execute(user_subjects.insert(), values)
+        last_id = rows[-1][0]
+
+
+def downgrade() -> None:
+    # users.subjects поддерживается ботом в актуальном состоянии, поэтому данные не теряются
+    op.drop_index('ix_user_subjects_subject_user_id', table_name='user_subjects')
+    op.drop_table('user_subjects')
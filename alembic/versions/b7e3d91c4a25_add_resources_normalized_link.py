@@ -0,0 +1,73 @@
+"""Add resources.normalized_link for deduplicated imports
+
+Revision ID: b7e3d91c4a25
+Revises: 9c1f4e2a7b3d
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3d91c4a25'
+down_revision: Union[str, None] = '9c1f4e2a7b3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_link(link):
+    # Копия add_resources.normalize_link на момент миграции
+    parts = urlsplit(link.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[len('www.'):]
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{host}:{parts.port}'
+    path = parts.path.rstrip('/')
+    return urlunsplit((scheme, netloc, path, parts.query, ''))
+
+
+def upgrade() -> None:
+    op.add_column('resources', sa.Column('normalized_link', sa.String(), nullable=True))
+
+    # Заполняем колонку пачками. У повторяющихся ссылок значение получает только
+    # самая ранняя запись, остальные остаются с NULL и не мешают уникальному индексу
+    resources = sa.table('resources', sa.column('id', sa.Integer), sa.column('link', sa.String))
+    update = sa.text('UPDATE resources SET normalized_link = :normalized_link WHERE id = :id')
+    connection = op.get_bind()
+    seen = set()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(resources.c.id, resources.c.link)
+            .where(resources.c.id > last_id)
+            .order_by(resources.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        values = []
+        for resource_id, link in rows:
+            normalized = normalize_link(link)
+            if normalized not in seen:
+                seen.add(normalized)
+                values.append({'id': resource_id, 'normalized_link': normalized})
+        if values:
+            connection.execute(update, values)
+        last_id = rows[-1][0]
+
+    op.create_index('uq_resources_normalized_link', 'resources', ['normalized_link'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('uq_resources_normalized_link', table_name='resources')
+    op.drop_column('resources', 'normalized_link')
@@ -0,0 +1,43 @@
+"""Add full-text and trigram search indexes on resources
+
+Revision ID: c4d82f6e1a97
+Revises: b7e3d91c4a25
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d82f6e1a97'
+down_revision: Union[str, None] = 'b7e3d91c4a25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Копия models.RESOURCE_SEARCH_VECTOR на момент миграции
+SEARCH_VECTOR = "to_tsvector('russian', title || ' ' || subject || ' ' || type)"
+
+
+def upgrade() -> None:
+    # Индексы нужны только поиску в Postgres; в остальных СУБД поиск идёт по каталогу в памяти
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_resources_search', 'resources', [sa.text(SEARCH_VECTOR)], postgresql_using='gin')
+    op.create_index(
+        'ix_resources_title_trgm',
+        'resources',
+        ['title'],
+        postgresql_using='gin',
+        postgresql_ops={'title': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_resources_title_trgm', table_name='resources')
+    op.drop_index('ix_resources_search', table_name='resources')
@@ -0,0 +1,42 @@
+"""Add notification_jobs for resumable new-resource notifications
+
+Revision ID: d91a6c3e5f28
+Revises: c4d82f6e1a97
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd91a6c3e5f28'
+down_revision: Union[str, None] = 'c4d82f6e1a97'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'notification_jobs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('resource_id', sa.Integer(), nullable=False),
+        sa.Column('subject', sa.String(length=255), nullable=False),
+        sa.Column('status', sa.String(length=20), server_default='pending', nullable=False),
+        sa.Column('last_user_id', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('sent', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('failed', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+        sa.CheckConstraint("status IN ('pending', 'done')", name='check_notification_job_status'),
+        sa.ForeignKeyConstraint(['resource_id'], ['resources.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_notification_jobs_status', 'notification_jobs', ['status'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_notification_jobs_status', table_name='notification_jobs')
+    op.drop_table('notification_jobs')
@@ -0,0 +1,27 @@
+"""Add (subject, id) indexes for keyset pagination of resources
+
+Revision ID: e5c7a2b9d413
+Revises: d91a6c3e5f28
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5c7a2b9d413'
+down_revision: Union[str, None] = 'd91a6c3e5f28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_resources_subject_id', 'resources', ['subject', 'id'])
+    op.create_index('ix_resources_type_subject_id', 'resources', ['type', 'subject', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_resources_type_subject_id', table_name='resources')
+    op.drop_index('ix_resources_subject_id', table_name='resources')
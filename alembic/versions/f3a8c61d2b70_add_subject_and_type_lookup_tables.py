@@ -0,0 +1,216 @@
+"""Add subjects/resource_types lookup tables and smallint keys on resources
+
+Revision ID: f3a8c61d2b70
+Revises: e5c7a2b9d413
+Create Date: 2026-10-17 20:00:00.000000
+
+Первый шаг переноса предметов и типов в справочники (expand). Старые колонки
+resources.subject и resources.type остаются и становятся необязательными, так что
+во время миграции работают и прежняя, и новая версия бота. Порядок выката:
+эта миграция (применяется при запуске бота), затем новый код, затем
+0a6d4e93c1f5 из ветки contract (удаление старых колонок, manage.py contract).
+
+Пока работают обе версии, триггер на resources синхронизирует колонки в обе
+стороны: строкам, которые пишет старый бот (только названия), он проставляет
+subject_id/type_id (добавляя новые названия в справочники), а строкам нового
+бота (только id) — названия. Так новый /resources не видит строк без id, а
+старый — строк без названий. Триггер удаляется в 0a6d4e93c1f5, которая перед
+удалением колонок ещё раз дозаполняет id на случай строк, записанных в обход него.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a8c61d2b70'
+down_revision: Union[str, None] = 'e5c7a2b9d413'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+# Копия models.LOOKUP_ID
+LOOKUP_ID = sa.SmallInteger().with_variant(sa.Integer(), 'sqlite')
+# Копия registry.DEFAULT_SUBJECTS и registry.DEFAULT_RESOURCE_TYPES на момент миграции
+DEFAULT_SUBJECTS = (
+    'Математика',
+    'Физика',
+    'Химия',
+    'Биология',
+    'История',
+    'Литература',
+    'Информатика',
+    'География',
+    'Английский язык',
+    'Русский язык'
+)
+DEFAULT_RESOURCE_TYPES = ('Статья', 'Видео', 'Туториал')
+
+# Строковая колонка, колонка id и справочник
+LOOKUP_COLUMNS = (('subject', 'subject_id', 'subjects'), ('type', 'type_id', 'resource_types'))
+
+# Заполнение id по названию для одного диапазона resources.id
+BACKFILL = sa.text(
+    'UPDATE resources SET '
+    'subject_id = (SELECT subjects.id FROM subjects WHERE subjects.name = resources.subject), '
+    'type_id = (SELECT resource_types.id FROM resource_types WHERE resource_types.name = resources.type) '
+    'WHERE id > :low AND id <= :high AND (subject_id IS NULL OR type_id IS NULL)'
+)
+
+
+def seed_lookup(connection, table, column, defaults):
+    # Значения по умолчанию идут первыми, чтобы их id совпали с registry;
+    # затем — всё, что уже встречается в resources
+    known = set(connection.execute(sa.text(f'SELECT name FROM {table}')).scalars())
+    existing = connection.execute(sa.text(f'SELECT DISTINCT {column} FROM resources WHERE {column} IS NOT NULL')).scalars()
+    names = [name for name in defaults if name not in known]
+    names += sorted(set(existing) - known - set(defaults))
+    # По одной строке, чтобы id выдавались в порядке списка
+    for name in names:
+        connection.execute(sa.text(f'INSERT INTO {table} (name) VALUES (:name)'), {'name': name})
+
+
+def _postgresql_sync(name, id_column, table):
+    # Новое или изменённое название без изменения id — id по названию (название добавляется
+    # в справочник), и наоборот; дозаполнение id (был NULL) названия не трогает
+    return f"""
+    IF NEW.{name} IS NOT NULL AND (
+        (TG_OP = 'INSERT' AND NEW.{id_column} IS NULL)
+        OR (TG_OP = 'UPDATE' AND NEW.{name} IS DISTINCT FROM OLD.{name} AND NEW.{id_column} IS NOT DISTINCT FROM OLD.{id_column})
+    ) THEN
+        INSERT INTO {table} (name) VALUES (NEW.{name}) ON CONFLICT (name) DO NOTHING;
+        NEW.{id_column} := (SELECT id FROM {table} WHERE name = NEW.{name});
+    ELSIF NEW.{id_column} IS NOT NULL AND (
+        (TG_OP = 'INSERT' AND NEW.{name} IS NULL)
+        OR (TG_OP = 'UPDATE' AND OLD.{id_column} IS NOT NULL AND NEW.{id_column} IS DISTINCT FROM OLD.{id_column}
+            AND NEW.{name} IS NOT DISTINCT FROM OLD.{name})
+    ) THEN
+        NEW.{name} := (SELECT name FROM {table} WHERE id = NEW.{id_column});
+    END IF;"""
+
+
+def _sqlite_sync(name, id_column, table):
+    return [
+        f'CREATE TRIGGER resources_sync_{name}_insert AFTER INSERT ON resources BEGIN '
+        f'INSERT OR IGNORE INTO {table} (name) SELECT NEW.{name} WHERE NEW.{name} IS NOT NULL AND NEW.{id_column} IS NULL; '
+        f'UPDATE resources SET '
+        f'{id_column} = COALESCE({id_column}, (SELECT id FROM {table} WHERE name = NEW.{name})), '
+        f'{name} = COALESCE({name}, (SELECT name FROM {table} WHERE id = NEW.{id_column})) '
+        f'WHERE id = NEW.id; END',
+        f'CREATE TRIGGER resources_sync_{name}_name AFTER UPDATE OF {name} ON resources '
+        f'WHEN NEW.{name} IS NOT NULL AND NEW.{name} IS NOT OLD.{name} AND NEW.{id_column} IS OLD.{id_column} BEGIN '
+        f'INSERT OR IGNORE INTO {table} (name) VALUES (NEW.{name}); '
+        f'UPDATE resources SET {id_column} = (SELECT id FROM {table} WHERE name = NEW.{name}) WHERE id = NEW.id; END',
+        f'CREATE TRIGGER resources_sync_{name}_id AFTER UPDATE OF {id_column} ON resources '
+        f'WHEN NEW.{id_column} IS NOT NULL AND OLD.{id_column} IS NOT NULL AND NEW.{id_column} IS NOT OLD.{id_column} '
+        f'AND NEW.{name} IS OLD.{name} BEGIN '
+        f'UPDATE resources SET {name} = (SELECT name FROM {table} WHERE id = NEW.{id_column}) WHERE id = NEW.id; END',
+    ]
+
+
+def create_sync_triggers(connection):
+    """Триггеры, синхронизирующие названия и id в resources, пока работает старая версия бота."""
+    if connection.dialect.name == 'postgresql':
+        body = ''.join(_postgresql_sync(*columns) for columns in LOOKUP_COLUMNS)
+        connection.execute(sa.text(
+            'CREATE OR REPLACE FUNCTION resources_sync_lookup_columns() RETURNS trigger AS $$ '
+            f'BEGIN {body}\n    RETURN NEW;\nEND $$ LANGUAGE plpgsql'
+        ))
+        connection.execute(sa.text(
+            'CREATE TRIGGER resources_sync_lookup_columns BEFORE INSERT OR UPDATE ON resources '
+            'FOR EACH ROW EXECUTE FUNCTION resources_sync_lookup_columns()'
+        ))
+        return
+    for columns in LOOKUP_COLUMNS:
+        for statement in _sqlite_sync(*columns):
+            connection.execute(sa.text(statement))
+
+
+def drop_sync_triggers(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(sa.text('DROP TRIGGER IF EXISTS resources_sync_lookup_columns ON resources'))
+        connection.execute(sa.text('DROP FUNCTION IF EXISTS resources_sync_lookup_columns()'))
+        return
+    for name, _, _ in LOOKUP_COLUMNS:
+        for suffix in ('insert', 'name', 'id'):
+            connection.execute(sa.text(f'DROP TRIGGER IF EXISTS resources_sync_{name}_{suffix}'))
+
+
+def backfill(connection):
+    """Заполняет subject_id/type_id диапазонами id; каждая пачка — отдельная короткая транзакция."""
+    low, high = connection.execute(sa.text('SELECT MIN(id), MAX(id) FROM resources')).one()
+    if low is None:
+        return
+    low -= 1
+    while low < high:
+        connection.execute(BACKFILL, {'low': low, 'high': low + BATCH_SIZE})
+        low += BATCH_SIZE
+
+
+def upgrade() -> None:
+    op.create_table(
+        'subjects',
+        sa.Column('id', LOOKUP_ID, autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_table(
+        'resource_types',
+        sa.Column('id', LOOKUP_ID, autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    connection = op.get_bind()
+    seed_lookup(connection, 'subjects', 'subject', DEFAULT_SUBJECTS)
+    seed_lookup(connection, 'resource_types', 'type', DEFAULT_RESOURCE_TYPES)
+
+    # Новый код пишет только id, поэтому старые колонки больше не обязательны
+    with op.batch_alter_table('resources') as batch_op:
+        batch_op.add_column(sa.Column('subject_id', sa.SmallInteger(), nullable=True))
+        batch_op.add_column(sa.Column('type_id', sa.SmallInteger(), nullable=True))
+        batch_op.alter_column('subject', existing_type=sa.String(length=255), nullable=True)
+        batch_op.alter_column('type', existing_type=sa.String(length=50), nullable=True)
+    # Триггер создаётся до дозаполнения: строки старого бота, добавленные во время
+    # и после него, получают id сразу
+    create_sync_triggers(connection)
+
+    # Вне общей транзакции миграции: пачки фиксируются по одной и не держат
+    # блокировки на всю таблицу, индексы в Postgres строятся без блокировки записи
+    with op.get_context().autocommit_block():
+        backfill(op.get_bind())
+        op.create_index(
+            'ix_resources_subject_page',
+            'resources',
+            ['subject_id', 'id'],
+            postgresql_include=['type_id'],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_resources_subject_type_page',
+            'resources',
+            ['subject_id', 'type_id', 'id'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    drop_sync_triggers(op.get_bind())
+    op.drop_index('ix_resources_subject_type_page', table_name='resources')
+    op.drop_index('ix_resources_subject_page', table_name='resources')
+    # Строки, добавленные новым кодом, получают названия обратно из справочников
+    op.execute(
+        'UPDATE resources SET '
+        'subject = (SELECT subjects.name FROM subjects WHERE subjects.id = resources.subject_id), '
+        'type = (SELECT resource_types.name FROM resource_types WHERE resource_types.id = resources.type_id) '
+        'WHERE subject IS NULL OR type IS NULL'
+    )
+    with op.batch_alter_table('resources') as batch_op:
+        batch_op.alter_column('type', existing_type=sa.String(length=50), nullable=False)
+        batch_op.alter_column('subject', existing_type=sa.String(length=255), nullable=False)
+        batch_op.drop_column('type_id')
+        batch_op.drop_column('subject_id')
+    op.drop_table('resource_types')
+    op.drop_table('subjects')
@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '86400'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '10000'))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv('ANSWER_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Путь к файлу SQLite для персистентного кэша; если не задан, кэш живёт только в памяти
+ANSWER_CACHE_DB = os.getenv('ANSWER_CACHE_DB')
+# Сколько ответов хранить в файле и как часто удалять из него истёкшие и лишние (в секундах)
+ANSWER_CACHE_DB_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_DB_MAX_ENTRIES', '100000'))
+ANSWER_CACHE_PRUNE_INTERVAL = float(os.getenv('ANSWER_CACHE_PRUNE_INTERVAL', '3600'))
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_question(text):
+    """Приводит вопрос к каноническому виду: регистр, пробелы, ё/е и финальная пунктуация."""
+    text = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    text = _WHITESPACE_RE.sub(' ', text).strip()
+    return text.rstrip(' ?!.…')
+
+
+def make_cache_key(question):
+    normalized = normalize_question(question)
+    if not normalized:
+        return None
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class _CacheEntry:
+    __slots__ = ('answer', 'usage', 'expires_at', 'size')
+
+    def __init__(self, answer, usage, expires_at):
+        self.answer = answer
+        self.usage = usage  # поле usage ответа GigaChat, которым он был получен
+        self.expires_at = expires_at
+        self.size = sys.getsizeof(answer)
+
+
+class SqliteAnswerStore:
+    """
+    Персистентное хранилище ответов в локальном файле SQLite (общее для процессов).
+
+    Таблица не растёт без границ: prune() удаляет истёкшие ответы и, сверх
+    max_entries, ответы с самым ранним сроком. Он вызывается при открытии
+    файла и по таймеру из AnswerCache.start().
+    """
+
+    def __init__(self, path, max_entries=ANSWER_CACHE_DB_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS answers ('
+            'key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL, usage TEXT)'
+        )
+        # Файлы, созданные до учёта расхода токенов по закэшированным ответам
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(answers)')}
+        if 'usage' not in columns:
+            self._conn.execute('ALTER TABLE answers ADD COLUMN usage TEXT')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_answers_expires_at ON answers (expires_at)')
+        self._conn.commit()
+        self.prune()
+
+    def get(self, key):
+        """Возвращает (ответ, usage, срок) или None, если ответа нет или он истёк."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT answer, usage, expires_at FROM answers WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None or row[2] <= time.time():
+            return None
+        answer, usage, expires_at = row
+        return answer, json.loads(usage) if usage else None, expires_at
+
+    def set(self, key, answer, usage, expires_at):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO answers (key, answer, usage, expires_at) VALUES (?, ?, ?, ?)',
+                (key, answer, json.dumps(usage) if usage else None, expires_at)
+            )
+            self._conn.commit()
+
+    def prune(self):
+        """Удаляет истёкшие ответы и самые старые сверх max_entries; возвращает число удалённых."""
+        with self._lock:
+            deleted = self._conn.execute('DELETE FROM answers WHERE expires_at <= ?', (time.time(),)).rowcount
+            if self.max_entries > 0:
+                # Срок у всех ответов одинаковый, поэтому самый ранний — у самых старых
+                deleted += self._conn.execute(
+                    'DELETE FROM answers WHERE key IN ('
+                    'SELECT key FROM answers ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                ).rowcount
+            self._conn.commit()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AnswerCache:
+    """
+    Кэш ответов GigaChat по нормализованному тексту вопроса.
+
+    В памяти хранится LRU с TTL и ограничениями по числу записей и объёму.
+    Одинаковые вопросы, пришедшие одновременно, схлопываются: в GigaChat уходит
+    один запрос, а результат получают все ожидающие.
+
+    Вместе с ответом хранится поле usage запроса, которым он был получен, и
+    отдаётся каждому получателю: закэшированный или схлопнутый ответ
+    учитывается в дневной квоте токенов так же, как если бы его запросили заново.
+    """
+
+    def __init__(
+        self,
+        ttl=ANSWER_CACHE_TTL,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        max_bytes=ANSWER_CACHE_MAX_BYTES,
+        store=None,
+        prune_interval=ANSWER_CACHE_PRUNE_INTERVAL
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self.prune_interval = prune_interval
+        self._task = None
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'inflight': len(self._inflight),
+        }
+
+    def _get_memory(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.answer, entry.usage
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _put_memory(self, key, answer, usage, expires_at):
+        if key in self._entries:
+            self._remove(key)
+        entry = _CacheEntry(answer, usage, expires_at)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        # Вытесняем самые давно использованные записи
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def get(self, question):
+        """Возвращает закэшированные (ответ, usage) или None, не обращаясь к GigaChat."""
+        key = make_cache_key(question)
+        if key is None:
+            return None
+        cached = self._get_memory(key)
+        if cached is None and self.store is not None:
+            cached = await self._load_persistent(key)
+        if cached is not None:
+            self.hits += 1
+        return cached
+
+    async def set(self, question, answer, usage=None):
+        key = make_cache_key(question)
+        if key is not None:
+            await self._store(key, answer, usage)
+
+    async def _load_persistent(self, key):
+        try:
+            row = await asyncio.to_thread(self.store.get, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка чтения персистентного кэша ответов: {e}")
+            return None
+        if row is None:
+            return None
+        answer, usage, expires_at = row
+        self._put_memory(key, answer, usage, expires_at)
+        return answer, usage
+
+    async def _store(self, key, answer, usage):
+        expires_at = time.time() + self.ttl
+        self._put_memory(key, answer, usage, expires_at)
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.set, key, answer, usage, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка записи персистентного кэша ответов: {e}")
+
+    async def _compute(self, key, compute):
+        try:
+            if self.store is not None:
+                cached = await self._load_persistent(key)
+                if cached is not None:
+                    self.hits += 1
+                    return cached
+            self.misses += 1
+            answer, usage = await compute()
+            await self._store(key, answer, usage)
+            return answer, usage
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_compute(self, question, compute):
+        """
+        Возвращает (ответ, usage) из кэша или вычисляет их корутиной compute().
+
+        Ошибки compute() не кэшируются и передаются всем ожидающим.
+        """
+        key = make_cache_key(question)
+        if key is None:
+            return await compute()
+
+        cached = self._get_memory(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # Вычисление идёт в отдельной задаче: отмена одного из ожидающих
+            # не должна прерывать запрос для остальных
+            task = asyncio.ensure_future(self._compute(key, compute))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def prune(self):
+        """Чистит персистентное хранилище вне цикла событий; возвращает число удалённых ответов."""
+        if self.store is None:
+            return 0
+        try:
+            deleted = await asyncio.to_thread(self.store.prune)
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка очистки персистентного кэша ответов: {e}")
+            return 0
+        if deleted:
+            logger.info(f"Из персистентного кэша ответов удалено записей: {deleted}")
+        return deleted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.prune_interval)
+            await self.prune()
+
+    def start(self):
+        """Запускает периодическую очистку персистентного хранилища."""
+        if self.store is not None and self.prune_interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
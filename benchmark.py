@@ -0,0 +1,571 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# Сколько мс разницы в перцентилях считаются шумом при сравнении с эталоном
+BENCHMARK_MIN_DELTA_MS = 5.0
+BOT_ID = 1000000
+# Слова для названий синтетических материалов и поисковых запросов
+TOPIC_WORDS = (
+    'производная', 'интеграл', 'функции', 'уравнения', 'матрицы', 'вектор', 'логарифмы',
+    'механика', 'оптика', 'электричество', 'реакции', 'органическая', 'клетка', 'генетика',
+    'эволюция', 'революция', 'империя', 'пушкин', 'роман', 'python', 'алгоритмы',
+    'структуры', 'данных', 'материки', 'климат', 'grammar', 'vocabulary', 'орфография',
+    'введение', 'основы', 'задачи', 'решение', 'практикум', 'лекция', 'курс', 'теория'
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyProfile:
+    """Задержка base ± jitter секунд и доля запросов error_rate, завершающихся ошибкой."""
+
+    __slots__ = ('base', 'jitter', 'error_rate', 'error_status', '_random')
+
+    def __init__(self, base=0.0, jitter=0.0, error_rate=0.0, error_status=500, seed=None):
+        self.base = base
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+
+    def delay(self):
+        return max(0.0, self.base + self._random.uniform(-self.jitter, self.jitter))
+
+    def fails(self):
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+async def _request_data(request):
+    if request.content_type == 'application/json':
+        return await request.json()
+    return dict(await request.post())
+
+
+def create_fake_telegram_app(profile, stats):
+    """Поддельный Bot API: отвечает на все методы правдоподобными объектами и считает вызовы."""
+    message_ids = iter(range(1, 1 << 62))
+
+    async def handle_method(request):
+        method = request.match_info['method']
+        data = await _request_data(request)
+        stats[f'telegram.{method}'] += 1
+        await asyncio.sleep(profile.delay())
+        if profile.fails():
+            stats['telegram.errors'] += 1
+            error = {'ok': False, 'error_code': profile.error_status, 'description': 'Injected error'}
+            if profile.error_status == 429:
+                # Как настоящий флуд-контроль: бот должен подождать и повторить запрос
+                error['parameters'] = {'retry_after': 1}
+            return web.json_response(error, status=profile.error_status)
+        if method == 'getMe':
+            result = {'id': BOT_ID, 'is_bot': True, 'first_name': 'StudyHomie', 'username': 'studyhomie_bot'}
+        elif method in ('sendMessage', 'editMessageText'):
+            result = {
+                'message_id': int(data.get('message_id') or next(message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'StudyHomie'},
+                'text': data.get('text', '')
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', handle_method)
+    return app
+
+
+def create_fake_gigachat_app(profile, stats, answer_length=400, stream_chunks=8):
+    """Поддельный GigaChat: выдача токена и chat/completions, в том числе в режиме SSE."""
+
+    async def handle_oauth(request):
+        stats['gigachat.oauth'] += 1
+        return web.json_response({'access_token': 'benchmark', 'expires_at': int((time.time() + 1800) * 1000)})
+
+    async def handle_completions(request):
+        payload = await request.json()
+        stats['gigachat.requests'] += 1
+        delay = profile.delay()
+        if profile.fails():
+            await asyncio.sleep(delay)
+            stats['gigachat.errors'] += 1
+            return web.json_response({'message': 'Injected error'}, status=profile.error_status)
+        question = payload['messages'][-1]['content']
+        answer = (f"Ответ на вопрос «{question[:50]}». " * (answer_length // 40 + 1))[:answer_length]
+        usage = {
+            'prompt_tokens': sum(len(message['content']) for message in payload['messages']) // 3 + 1,
+            'completion_tokens': len(answer) // 3 + 1
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        if not payload.get('stream'):
+            await asyncio.sleep(delay)
+            return web.json_response({
+                'choices': [{'message': {'role': 'assistant', 'content': answer}, 'index': 0, 'finish_reason': 'stop'}],
+                'usage': usage
+            })
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        step = -(-len(answer) // stream_chunks)
+        for start in range(0, len(answer), step):
+            await asyncio.sleep(delay / stream_chunks)
+            chunk = {'choices': [{'delta': {'content': answer[start:start + step]}, 'index': 0}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post('/oauth', handle_oauth)
+    app.router.add_post('/api/v1/chat/completions', handle_completions)
+    return app
+
+
+class FakeServers:
+    """
+    Поддельные Bot API и GigaChat в отдельном потоке со своим циклом событий,
+    чтобы работа заглушек не попадала в замеры обработчиков бота.
+    """
+
+    def __init__(self, telegram_profile, gigachat_profile, answer_length=400):
+        self.telegram_profile = telegram_profile
+        self.gigachat_profile = gigachat_profile
+        self.answer_length = answer_length
+        self.stats = Counter()
+        self.telegram_url = None
+        self.gigachat_url = None
+        self._loop = None
+        self._thread = None
+        self._runners = []
+
+    def start(self):
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name='benchmark-fakes', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self._loop)
+        telegram_port = self._loop.run_until_complete(
+            self._serve(create_fake_telegram_app(self.telegram_profile, self.stats))
+        )
+        gigachat_port = self._loop.run_until_complete(
+            self._serve(create_fake_gigachat_app(self.gigachat_profile, self.stats, self.answer_length))
+        )
+        self.telegram_url = f'http://127.0.0.1:{telegram_port}/bot'
+        self.gigachat_url = f'http://127.0.0.1:{gigachat_port}'
+        ready.set()
+        self._loop.run_forever()
+        for runner in self._runners:
+            self._loop.run_until_complete(runner.cleanup())
+        self._loop.close()
+
+    async def _serve(self, app):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        await web.SockSite(runner, sock).start()
+        self._runners.append(runner)
+        return sock.getsockname()[1]
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+
+def make_message_update(update_id, user_id, text):
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id),
+        'text': text
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def make_callback_update(update_id, user_id, data):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'StudyHomie'},
+                'text': 'Выберите предметы'
+            }
+        }
+    }
+
+
+def make_inline_update(update_id, user_id, query):
+    return {
+        'update_id': update_id,
+        'inline_query': {'id': str(update_id), 'from': _user(user_id), 'query': query, 'offset': ''}
+    }
+
+
+def synthetic_updates(users=50, questions_per_user=3, question_pool=20, subjects_count=10, seed=0, first_user_id=1):
+    """
+    Сценарий живого пользователя: /start, /setsubjects, пара нажатий на предметы,
+    «Готово», /resources с переключением фильтра по типу, /search, inline-поиск
+    и несколько вопросов. Сценарии
+    пользователей перемешаны, но порядок шагов каждого пользователя сохраняется.
+    """
+    rng = random.Random(seed)
+    scenarios = []
+    for user_id in range(first_user_id, first_user_id + users):
+        picked = rng.sample(range(subjects_count), k=min(3, subjects_count))
+        steps = [('message', '/start'), ('message', '/setsubjects')]
+        mask = 0
+        for bit in picked:
+            mask |= 1 << bit
+            steps.append(('callback', f'subjects:{mask}'))
+        steps.append(('callback', f'done:{mask}'))
+        steps.append(('message', '/resources'))
+        # Фильтр по типу и следующая страница из кэша
+        steps.append(('callback', f'res:{mask}:{rng.randrange(1, 4)}:'))
+        steps.append(('callback', f'res:{mask}:0:'))
+        word = rng.choice(TOPIC_WORDS)
+        steps.append(('message', f'/search {word}'))
+        # Inline-запрос набирается по буквам: каждое нажатие — отдельное обновление
+        for length in range(1, min(len(word), 4) + 1):
+            steps.append(('inline', word[:length]))
+        for _ in range(questions_per_user):
+            steps.append(('message', f'Объясни тему номер {rng.randrange(question_pool)}'))
+        scenarios.append((user_id, steps))
+
+    updates = []
+    positions = [0] * len(scenarios)
+    active = list(range(len(scenarios)))
+    while active:
+        index = rng.choice(active)
+        user_id, steps = scenarios[index]
+        kind, payload = steps[positions[index]]
+        positions[index] += 1
+        if positions[index] == len(steps):
+            active.remove(index)
+        update_id = len(updates) + 1
+        if kind == 'message':
+            updates.append(make_message_update(update_id, user_id, payload))
+        elif kind == 'inline':
+            updates.append(make_inline_update(update_id, user_id, payload))
+        else:
+            updates.append(make_callback_update(update_id, user_id, payload))
+    return updates
+
+
+def load_updates(path):
+    """Читает записанные обновления Telegram (по одному JSON на строку)."""
+    with open(path, encoding='utf-8') as source:
+        return [json.loads(line) for line in source if line.strip()]
+
+
+def percentile(sorted_values, q):
+    """Перцентиль по ближайшему рангу: значение с номером ⌈q·n/100⌉ в отсортированной выборке."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+class LatencyRecorder:
+    """Оборачивает обработчики приложения и замеряет время каждого вызова."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = Counter()
+        self.end_to_end = []
+        self.enqueued_at = {}
+        self.remaining_calls = {}  # update_id -> обработчиков, которые ещё не завершились
+        self.expected_calls = 0
+        self.completed_calls = 0
+        self.received = 0
+        self.last_completed_at = None
+
+    def wrap(self, name, callback):
+        samples = self.samples.setdefault(name, [])
+
+        async def timed(update, context):
+            started_at = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.errors[name] += 1
+                raise
+            finally:
+                finished_at = time.perf_counter()
+                samples.append(finished_at - started_at)
+                # Обновление обработано, когда завершился последний из его обработчиков
+                update_id = getattr(update, 'update_id', None)
+                remaining = self.remaining_calls.get(update_id, 1) - 1
+                self.remaining_calls[update_id] = remaining
+                enqueued_at = self.enqueued_at.get(update_id)
+                if enqueued_at is not None and remaining <= 0:
+                    self.end_to_end.append(finished_at - enqueued_at)
+                self.completed_calls += 1
+                self.last_completed_at = finished_at
+
+        return timed
+
+    def instrument(self, application):
+        from telegram import Update
+        from telegram.ext import TypeHandler
+
+        groups = {group: list(handlers) for group, handlers in application.handlers.items()}
+        for handlers in groups.values():
+            for handler in handlers:
+                handler.callback = self.wrap(handler.callback.__name__, handler.callback)
+
+        # Первым делом для каждого обновления считаем, сколько обработчиков оно вызовет:
+        # по одному на группу, как и в Application.process_update
+        async def count_expected(update, context):
+            self.received += 1
+            calls = 0
+            for handlers in groups.values():
+                if any(handler.check_update(update) not in (None, False) for handler in handlers):
+                    calls += 1
+            self.expected_calls += calls
+            self.remaining_calls[update.update_id] = calls
+
+        application.add_handler(TypeHandler(Update, count_expected), group=min(groups, default=0) - 1)
+
+    def done(self, enqueued):
+        return self.received >= enqueued and self.completed_calls >= self.expected_calls
+
+
+def configure_environment(fakes, database_url, streaming=False, workdir=None):
+    """
+    Направляет бота на поддельные серверы. Вызывается до импорта bot:
+    настройки читаются из окружения при импорте модулей.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='studyhomie-benchmark-')
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123456:benchmark',
+        'TELEGRAM_API_BASE_URL': fakes.telegram_url,
+        'GIGACHAT_AUTHORIZATION_KEY': 'benchmark',
+        'GIGACHAT_OAUTH_URL': f'{fakes.gigachat_url}/oauth',
+        'GIGACHAT_API_URL': f'{fakes.gigachat_url}/api/v1',
+        'GIGACHAT_TOKEN_STORE': os.path.join(workdir, 'gigachat-token.json'),
+        'GIGACHAT_STREAMING': 'true' if streaming else 'false',
+        'DATABASE_URL': database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        'METRICS_PORT': '0',
+    })
+    # Синтетические пользователи пишут быстрее людей: лимиты отправки Telegram по умолчанию
+    # не применяются, но их можно задать через окружение, чтобы померить и их влияние
+    for name in ('TELEGRAM_GLOBAL_RATE', 'TELEGRAM_PRIVATE_CHAT_RATE', 'TELEGRAM_GROUP_CHAT_RATE'):
+        os.environ.setdefault(name, '0')
+    # Вопросы и ответы не должны переживать прогон и влиять на следующий
+    for name in ('ANSWER_CACHE_DB', 'CONVERSATION_DB'):
+        os.environ.pop(name, None)
+    return workdir
+
+
+def seed_resources(count, seed=0):
+    """Создаёт таблицы и справочники и добавляет count синтетических ресурсов."""
+    from models import SessionLocal, init_db
+    from add_resources import normalize_link, upsert_resources
+    from registry import registry
+
+    init_db()
+    registry.load()
+    rng = random.Random(seed)
+    subjects = list(registry.subject_names)
+    types = list(registry.type_names)
+    rows = []
+    for number in range(count):
+        link = f'https://example.com/benchmark/{number}'
+        rows.append({
+            'subject_id': subjects[number % len(subjects)],
+            'type_id': rng.choice(types),
+            'title': ' '.join(rng.sample(TOPIC_WORDS, 3)).capitalize() + f' {number}',
+            'link': link,
+            'normalized_link': normalize_link(link)
+        })
+    with SessionLocal() as session:
+        for start in range(0, len(rows), 5000):
+            upsert_resources(session, rows[start:start + 5000])
+        session.commit()
+
+
+async def replay(application, updates, rate=0.0, recorder=None, timeout=300.0):
+    """
+    Подаёт обновления в очередь приложения с постоянной частотой rate в секунду
+    (0 — без пауз) и ждёт, пока все вызванные обработчики завершатся.
+    """
+    from telegram import Update
+
+    recorder = recorder or LatencyRecorder()
+    recorder.instrument(application)
+    loop = asyncio.get_running_loop()
+    async with application:
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+        try:
+            started_at = time.perf_counter()
+            loop_started_at = loop.time()
+            for number, data in enumerate(updates):
+                if rate > 0:
+                    delay = loop_started_at + number / rate - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                update = Update.de_json(data, application.bot)
+                recorder.enqueued_at[update.update_id] = time.perf_counter()
+                await application.update_queue.put(update)
+            deadline = loop.time() + timeout
+            while not recorder.done(len(updates)):
+                if loop.time() > deadline:
+                    logger.warning("Не все обновления обработаны до истечения таймаута бенчмарка")
+                    break
+                await asyncio.sleep(0.01)
+            finished_at = recorder.last_completed_at or time.perf_counter()
+        finally:
+            await application.stop()
+    if application.post_shutdown is not None:
+        await application.post_shutdown(application)
+
+    elapsed = max(finished_at - started_at, 1e-9)
+    return {
+        'updates': len(updates),
+        'completed_calls': recorder.completed_calls,
+        'expected_calls': recorder.expected_calls,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_per_s': round(len(updates) / elapsed, 2),
+        'end_to_end': summarize(recorder.end_to_end),
+        'handlers': {
+            name: {**summarize(samples), 'errors': recorder.errors[name]}
+            for name, samples in sorted(recorder.samples.items())
+            if samples
+        },
+    }
+
+
+def run_benchmark(
+    updates=None,
+    users=50,
+    questions_per_user=3,
+    rate=0.0,
+    concurrent_updates=None,
+    telegram_profile=None,
+    gigachat_profile=None,
+    database_url=None,
+    resources=500,
+    streaming=False,
+    seed=0
+):
+    """Запускает поддельные серверы, бота и прогон обновлений; возвращает отчёт."""
+    telegram_profile = telegram_profile or LatencyProfile(seed=seed)
+    gigachat_profile = gigachat_profile or LatencyProfile(base=0.2, jitter=0.05, seed=seed)
+    with FakeServers(telegram_profile, gigachat_profile) as fakes:
+        configure_environment(fakes, database_url, streaming)
+        import bot
+
+        # Журнал каждого HTTP-запроса заметно искажает замеры
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        seed_resources(resources, seed)
+        if updates is None:
+            updates = synthetic_updates(users, questions_per_user, subjects_count=len(bot.registry.subjects), seed=seed)
+        concurrent_updates = concurrent_updates or bot.BOT_CONCURRENT_UPDATES
+        application = bot.build_application(concurrent_updates)
+        result = asyncio.run(replay(application, updates, rate))
+        result['config'] = {
+            'rate': rate,
+            'concurrent_updates': concurrent_updates,
+            'resources': resources,
+            'streaming': streaming,
+            'seed': seed,
+            'telegram_latency_s': telegram_profile.base,
+            'gigachat_latency_s': gigachat_profile.base,
+            'gigachat_error_rate': gigachat_profile.error_rate,
+            'database': os.environ['DATABASE_URL'].split(':', 1)[0],
+        }
+        result['fakes'] = dict(sorted(fakes.stats.items()))
+        result['answer_cache'] = bot.answer_cache.stats()
+    return result
+
+
+def compare_with_baseline(result, baseline, tolerance=0.2, min_delta_ms=BENCHMARK_MIN_DELTA_MS):
+    """
+    Возвращает список регрессий: рост p95/p99 обработчика или падение пропускной
+    способности больше чем на tolerance. Разница меньше min_delta_ms не учитывается.
+    """
+    regressions = []
+    base_throughput = baseline.get('throughput_per_s', 0)
+    if base_throughput and result['throughput_per_s'] < base_throughput * (1 - tolerance):
+        regressions.append(
+            f"пропускная способность: {result['throughput_per_s']} < {base_throughput} обновлений/с"
+        )
+    rows = dict(baseline.get('handlers', {}), **{'*': baseline.get('end_to_end', {})})
+    current = dict(result['handlers'], **{'*': result['end_to_end']})
+    for name, base in rows.items():
+        if name not in current:
+            continue
+        for metric in ('p95_ms', 'p99_ms'):
+            before, after = base.get(metric, 0), current[name][metric]
+            if after > before * (1 + tolerance) and after - before > min_delta_ms:
+                regressions.append(f"{name} {metric}: {after} > {before}")
+        if current[name].get('errors', 0) > base.get('errors', 0):
+            regressions.append(f"{name} ошибки: {current[name]['errors']} > {base.get('errors', 0)}")
+    return regressions
+
+
+def format_report(result):
+    lines = [
+        f"Обновлений: {result['updates']} за {result['elapsed_s']} с "
+        f"({result['throughput_per_s']} обновлений/с)",
+        f"{'обработчик':<22} {'вызовов':>8} {'ошибок':>7} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'max, мс':>9}",
+    ]
+    rows = list(result['handlers'].items()) + [('сквозная задержка', result['end_to_end'])]
+    for name, row in rows:
+        lines.append(
+            f"{name:<22} {row['count']:>8} {row.get('errors', 0):>7} "
+            f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}"
+        )
+    lines.append(f"Заглушки: {result['fakes']}")
+    return '\n'.join(lines)
@@ -1,38 +1,55 @@
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from functools import lru_cache, partial
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove
+)
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     ContextTypes,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
+    TypeHandler,
     filters
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 import os
 from dotenv import load_dotenv
-from models import SessionLocal, User, Resource
+from sqlalchemy import select
+import metrics
+import models
+import tracing
+from models import User, get_async_engine, get_async_session
+from registry import registry
+from activity import ActivityBuffer
+from gigachat import AsyncGigaChatAPI, GigaChatUnavailable
+from answer_cache import AnswerCache, SqliteAnswerStore, ANSWER_CACHE_DB
+from streaming import StreamingReply, TELEGRAM_MESSAGE_LIMIT
+from scheduler import LLMScheduler, SchedulerBusy
+from rate_limiter import OutboundRateLimiter
+from catalog import ResourceCatalog
+from notifications import NotificationRunner
+from profiler import PROFILE_SECONDS, profiler
+from search import search_resources_db, SEARCH_RESULT_LIMIT, INLINE_RESULT_LIMIT
+from resource_pages import AFTER, BEFORE, PageCache, fetch_page
+from retrieval import RETRIEVAL_GROUNDING
+from conversation import ConversationStore, SqliteConversationStore, CONVERSATION_DB
 import requests
 import uuid
 from datetime import datetime
 import urllib3
 
-# Список доступных предметов
-AVAILABLE_SUBJECTS = [
-    'Математика',
-    'Физика',
-    'Химия',
-    'Биология',
-    'История',
-    'Литература',
-    'Информатика',
-    'География',
-    'Английский язык',
-    'Русский язык'
-]
-
-# Глобальный словарь для отслеживания выбранных предметов пользователями
-user_subject_selections = {}
+SUBJECTS_PROMPT = "Пожалуйста, выберите ваши предметы, нажимая на соответствующие кнопки. После выбора нажмите '✅ Готово'."
 
 # Подавление предупреждений о небезопасных соединениях
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -43,6 +60,14 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 GIGACHAT_AUTHORIZATION_KEY = os.getenv('GIGACHAT_AUTHORIZATION_KEY')
 GIGACHAT_CLIENT_ID = os.getenv('GIGACHAT_CLIENT_ID')
 DATABASE_URL = os.getenv('DATABASE_URL')
+# Адрес Bot API (например, локальный сервер Bot API); по умолчанию https://api.telegram.org/bot
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
+# Сколько обновлений обрабатывается одновременно
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '64'))
+# Потоковая выдача ответов GigaChat правками сообщения
+GIGACHAT_STREAMING = os.getenv('GIGACHAT_STREAMING', 'false').lower() in ('1', 'true', 'yes')
+# Telegram id администраторов через запятую (команда /profile)
+ADMIN_TELEGRAM_IDS = {int(value) for value in os.getenv('ADMIN_TELEGRAM_IDS', '').split(',') if value.strip()}
 
 # Настройка логирования
 logging.basicConfig(
@@ -119,6 +144,27 @@ class GigaChatAPI:
 
 # Инициализация GigaChat API
 giga_chat_api = GigaChatAPI(GIGACHAT_AUTHORIZATION_KEY)
+# Асинхронный клиент, который используют обработчики бота
+async_giga_chat_api = AsyncGigaChatAPI(GIGACHAT_AUTHORIZATION_KEY, GIGACHAT_CLIENT_ID)
+# Кэш ответов на повторяющиеся вопросы
+answer_cache = AnswerCache(store=SqliteAnswerStore(ANSWER_CACHE_DB) if ANSWER_CACHE_DB else None)
+# Ограничение и очередь обращений к GigaChat
+llm_scheduler = LLMScheduler()
+
+# История разговоров с GigaChat
+conversations = ConversationStore(store=SqliteConversationStore(CONVERSATION_DB) if CONVERSATION_DB else None)
+
+# Каталог учебных материалов в памяти процесса
+resource_catalog = ResourceCatalog()
+# Отрисованные страницы /resources
+resource_pages = PageCache()
+# Активность и дневной расход пользователей с отложенной записью в базу
+activity = ActivityBuffer()
+
+BUSY_MESSAGE = "Сейчас у меня слишком много вопросов. Пожалуйста, попробуй спросить чуть позже."
+UNAVAILABLE_MESSAGE = "GigaChat сейчас недоступен. Пожалуйста, попробуй спросить через пару минут."
+QUOTA_MESSAGE = "На сегодня лимит вопросов исчерпан. Возвращайся завтра — я буду рад помочь!"
+KEYBOARD_EXPIRED_MESSAGE = "Эта клавиатура устарела. Пожалуйста, вызови команду заново."
 
 
 # Функция для отправки основного меню
@@ -164,143 +210,460 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Вот команды, которые ты можешь использовать:\n"
         "/help - Показать это сообщение помощи\n"
         "/setsubjects - Установить интересующие тебя предметы\n"
-        "/resources - Получить учебные материалы\n\n"
+        "/resources - Получить учебные материалы\n"
+        "/search - Найти материалы по названию\n"
+        "/reset - Начать разговор с помощником заново\n\n"
         "Или просто задай свой вопрос, и я постараюсь помочь!"
     )
     await update.message.reply_text(help_text)
 
 
-# Команда /setsubjects
-async def set_subjects(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_subject_selections[user_id] = set()  # Инициализируем пустое множество для выбранных предметов
+# Выбранные предметы кодируются битовой маской: бит subject_id - 1.
+# Id в справочнике subjects только добавляются, поэтому старые кнопки остаются верными
+def encode_subjects(subjects):
+    mask = 0
+    for subject_id, subject in registry.subject_names.items():
+        if subject in subjects:
+            mask |= 1 << (subject_id - 1)
+    return mask
+
+
+def decode_subject_ids(mask):
+    return [subject_id for subject_id in registry.subject_names if mask & (1 << (subject_id - 1))]
+
+
+def decode_subjects(mask):
+    return [registry.subject_names[subject_id] for subject_id in decode_subject_ids(mask)]
+
 
+def parse_subjects_mask(value):
+    mask = int(value)
+    if not 0 <= mask < 1 << max(registry.subject_names, default=0):
+        raise ValueError(f"Некорректная маска предметов: {value}")
+    return mask
+
+
+# Клавиатура выбора предметов для каждой маски строится один раз.
+# Состояние выбора целиком хранится в callback_data: каждая кнопка несёт маску,
+# которая получится после нажатия, поэтому клик может обработать любой воркер.
+@lru_cache(maxsize=None)
+def subjects_keyboard(mask, show_marks=True):
     keyboard = []
-    for subject in AVAILABLE_SUBJECTS:
-        keyboard.append([InlineKeyboardButton(subject, callback_data=f"subject_{subject}")])
-    keyboard.append([InlineKeyboardButton("✅ Готово", callback_data="done")])
+    for subject_id, subject in registry.subject_names.items():
+        bit = 1 << (subject_id - 1)
+        if not show_marks:
+            button_text = subject
+        elif mask & bit:
+            button_text = f"✅ {subject}"
+        else:
+            button_text = f"❌ {subject}"
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"subjects:{mask ^ bit}")])
+    keyboard.append([InlineKeyboardButton("✅ Готово", callback_data=f"done:{mask}")])
+    return InlineKeyboardMarkup(keyboard)
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
 
+# Команда /setsubjects
+async def set_subjects(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
-        "Пожалуйста, выберите ваши предметы, нажимая на соответствующие кнопки. После выбора нажмите '✅ Готово'.",
-        reply_markup=reply_markup
+        SUBJECTS_PROMPT,
+        reply_markup=subjects_keyboard(0, show_marks=False)
     )
 
 
+def format_resource(res):
+    return f"**{res.subject} - {res.type}**\n[{res.title}]({res.link})\n\n"
+
+
+def format_resources(resources):
+    return ''.join(format_resource(res) for res in resources)
+
+
+# Фильтр по типу на страницах /resources передаётся в callback_data как type_id; 0 — все типы
+RESOURCES_HEADER = "Вот некоторые учебные материалы для тебя:\n\n"
+
+
+# Курсор страницы в callback_data: направление, номер бита предмета (subject_id - 1)
+# и id материала, например «>3.1520»; пустая строка — первая страница
+def encode_resource_cursor(direction, res):
+    return f"{direction}{res.subject_id - 1}.{res.id}"
+
+
+def parse_resource_cursor(value):
+    if not value:
+        return AFTER, None
+    direction = value[0]
+    if direction not in (AFTER, BEFORE):
+        raise ValueError(f"Некорректный курсор страницы: {value}")
+    subject_bit, resource_id = value[1:].split('.')
+    return direction, (int(subject_bit) + 1, int(resource_id))
+
+
+def parse_resources_callback(data):
+    """Маска предметов, фильтр по типу и курсор из callback_data «res:…»; ValueError, если данные некорректны."""
+    mask, type_index, cursor = data.split(":", 3)[1:]
+    mask, type_index = parse_subjects_mask(mask), int(type_index)
+    if type_index and type_index not in registry.type_names:
+        raise ValueError(f"Некорректный фильтр типа: {type_index}")
+    parse_resource_cursor(cursor)
+    return mask, type_index, cursor
+
+
+def render_resources_page(mask, type_index, direction, page):
+    """Текст и клавиатура страницы; материалы, не влезающие в одно сообщение, уходят на соседнюю."""
+    entries, has_prev, has_next = page.entries, page.has_prev, page.has_next
+    parts = [format_resource(res) for res in entries]
+    budget = TELEGRAM_MESSAGE_LIMIT - len(RESOURCES_HEADER)
+    fitting = 0
+    for part in (parts if direction == AFTER else reversed(parts)):
+        if budget < len(part):
+            break
+        budget -= len(part)
+        fitting += 1
+    if fitting < len(entries):
+        if direction == AFTER:
+            entries, parts, has_next = entries[:fitting], parts[:fitting], True
+        else:
+            entries, parts, has_prev = entries[len(entries) - fitting:], parts[len(parts) - fitting:], True
+
+    if entries:
+        text = RESOURCES_HEADER + ''.join(parts)
+    elif type_index:
+        text = "Нет материалов этого типа по твоим предметам."
+    else:
+        text = "Не найдено материалов по твоим предметам."
+
+    keyboard = []
+    navigation = []
+    if has_prev and entries:
+        navigation.append(InlineKeyboardButton(
+            "◀️ Назад", callback_data=f"res:{mask}:{type_index}:{encode_resource_cursor(BEFORE, entries[0])}"
+        ))
+    if has_next and entries:
+        navigation.append(InlineKeyboardButton(
+            "Вперёд ▶️", callback_data=f"res:{mask}:{type_index}:{encode_resource_cursor(AFTER, entries[-1])}"
+        ))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([
+        InlineKeyboardButton(f"• {name}" if type_id == type_index else name, callback_data=f"res:{mask}:{type_id}:")
+        for type_id, name in ((0, 'Все'), *registry.type_names.items())
+    ])
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def resources_page(mask, type_index=0, cursor=''):
+    """
+    Страница материалов по маске предметов: из кэша или одним запросом к базе по ключу (subject_id, id).
+
+    Кэш сбрасывается вместе со сменой версии каталога, то есть после изменений в таблице resources.
+    """
+    key = (mask, type_index, cursor)
+    version = resource_catalog.version if resource_catalog.loaded else None
+    if version is not None:
+        cached = resource_pages.get(key, version)
+        if cached is not None:
+            tracing.annotate(page_cache='hit')
+            return cached
+    direction, position = parse_resource_cursor(cursor)
+    async with get_async_session() as db_session:
+        with tracing.span('resources.fetch_page'):
+            page = await fetch_page(
+                db_session, decode_subject_ids(mask), type_index or None, direction, position
+            )
+    rendered = render_resources_page(mask, type_index, direction, page)
+    if version is not None:
+        resource_pages.set(key, version, rendered)
+    return rendered
+
+
 # Команда /resources
 async def get_resources(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_session = SessionLocal()
     try:
-        user = db_session.query(User).filter(User.telegram_id == update.effective_user.id).first()
-        if not user or not user.subjects:
+        async with get_async_session() as db_session:
+            user = await db_session.scalar(select(User).where(User.telegram_id == update.effective_user.id))
+        mask = encode_subjects(user.subject_names) if user else 0
+        if not mask:
             await update.message.reply_text(
                 "Ты еще не установил свои предметы. Используй команду /setsubjects, чтобы указать свои интересы."
             )
             return
-        resources = db_session.query(Resource).filter(Resource.subject.in_(user.subjects)).all()
+        text, reply_markup = await resources_page(mask)
+        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка при получении материалов: {e}")
+        await update.message.reply_text("Произошла ошибка при получении материалов. Пожалуйста, попробуй снова.")
+
+
+# Команда /search: поиск материалов по названию, предмету и типу
+async def search_resources(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = ' '.join(context.args or []).strip()
+    if not query:
+        await update.message.reply_text("Напиши, что нужно найти, например: /search производная")
+        return
+    try:
+        if resource_catalog.loaded:
+            with tracing.span('search.catalog'):
+                resources = resource_catalog.search(query, SEARCH_RESULT_LIMIT)
+        else:
+            async with get_async_session() as db_session:
+                with tracing.span('search.db'):
+                    resources = await search_resources_db(db_session, query, SEARCH_RESULT_LIMIT)
         if not resources:
-            await update.message.reply_text("Не найдено материалов по твоим предметам.")
+            await update.message.reply_text(f"По запросу «{query}» ничего не найдено.")
             return
-        message = "Вот некоторые учебные материалы для тебя:\n\n"
-        for res in resources:
-            message += f"**{res.subject} - {res.type}**\n[{res.title}]({res.link})\n\n"
+        message = f"Результаты поиска по запросу «{escape_markdown(query)}»:\n\n" + format_resources(resources)
         await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
     except Exception as e:
-        logger.error(f"Ошибка при получении материалов: {e}")
-        await update.message.reply_text("Произошла ошибка при получении материалов. Пожалуйста, попробуй снова.")
-    finally:
-        db_session.close()
+        logger.error(f"Ошибка при поиске материалов: {e}")
+        await update.message.reply_text("Произошла ошибка при поиске материалов. Пожалуйста, попробуй снова.")
+
+
+# Inline-режим: @бот <запрос> в любом чате; отвечаем из каталога в памяти на каждое нажатие клавиши
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query.query
+    resources = resource_catalog.search(query, INLINE_RESULT_LIMIT) if resource_catalog.loaded else []
+    results = [
+        InlineQueryResultArticle(
+            id=str(res.id),
+            title=res.title,
+            description=f"{res.subject} - {res.type}",
+            url=res.link,
+            input_message_content=InputTextMessageContent(f"{res.title}\n{res.link}")
+        )
+        for res in resources
+    ]
+    await update.inline_query.answer(results)
 
 
 # Обработка Callback Queries
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()  # Подтверждаем получение нажатия
-
     user_id = query.from_user.id
     data = query.data
 
+    # callback_data кнопок, отправленных до смены справочников, или подделанные клиентом
+    # разбираются до подтверждения нажатия, чтобы ответить на него подсказкой
+    mask = 0
+    try:
+        if data.startswith("subjects:") or data.startswith("done:"):
+            mask = parse_subjects_mask(data.split(":", 1)[1])
+        elif data.startswith("res:"):
+            mask, type_index, cursor = parse_resources_callback(data)
+    except ValueError as e:
+        logger.warning(f"Устаревшая клавиатура от пользователя {user_id}: {e}")
+        await query.answer(KEYBOARD_EXPIRED_MESSAGE, show_alert=True)
+        return
+    await query.answer()  # Подтверждаем получение нажатия
+
     if data == "start_app":
         # Вызываем функцию start
         await start(update, context)
-    elif data.startswith("subject_"):
-        subject = data.split("subject_")[1]
-        if subject in user_subject_selections.get(user_id, set()):
-            user_subject_selections[user_id].remove(subject)
-            # Обновляем кнопку на невыбранную
-            new_text = f"❌ {subject}"
-        else:
-            user_subject_selections.setdefault(user_id, set()).add(subject)
-            # Обновляем кнопку на выбранную
-            new_text = f"✅ {subject}"
-
-        # Перестраиваем клавиатуру с обновлённым статусом кнопок
-        keyboard = []
-        for subj in AVAILABLE_SUBJECTS:
-            if subj in user_subject_selections[user_id]:
-                button_text = f"✅ {subj}"
-            else:
-                button_text = f"❌ {subj}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"subject_{subj}")])
-        keyboard.append([InlineKeyboardButton("✅ Готово", callback_data="done")])
+    elif data.startswith("subjects:"):
+        await query.edit_message_text(SUBJECTS_PROMPT, reply_markup=subjects_keyboard(mask))
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    elif data.startswith("subject_"):
+        # Клавиатуры, отправленные до перехода на маски в callback_data
+        subject = data.split("subject_", 1)[1]
+        mask = encode_subjects([subject])
+        await query.edit_message_text(SUBJECTS_PROMPT, reply_markup=subjects_keyboard(mask))
 
-        await query.edit_message_text(
-            "Пожалуйста, выберите ваши предметы, нажимая на соответствующие кнопки. После выбора нажмите '✅ Готово'.",
-            reply_markup=reply_markup
-        )
+    elif data.startswith("res:"):
+        # Листание /resources: маска предметов, фильтр по типу и курсор страницы
+        try:
+            text, reply_markup = await resources_page(mask, type_index, cursor)
+            await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+        except BadRequest as e:
+            # Повторное нажатие на текущий фильтр не меняет сообщение
+            if 'not modified' not in str(e).lower():
+                logger.error(f"Ошибка при показе страницы материалов: {e}")
+        except Exception as e:
+            logger.error(f"Ошибка при показе страницы материалов: {e}")
+            await query.edit_message_text("Произошла ошибка при получении материалов. Пожалуйста, попробуй снова.")
 
-    elif data == "done":
-        selected_subjects = list(user_subject_selections.get(user_id, set()))
+    elif data == "done" or data.startswith("done:"):
+        selected_subjects = decode_subjects(mask)
         if not selected_subjects:
             await query.edit_message_text("Вы не выбрали ни одного предмета. Пожалуйста, попробуйте снова команду /setsubjects.")
-            user_subject_selections.pop(user_id, None)
             return
 
         # Сохраняем выбранные предметы в базу данных
-        db_session = SessionLocal()
         try:
-            user = db_session.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                user = User(
-                    telegram_id=user_id,
-                    username=query.from_user.username,
-                    subjects=selected_subjects
-                )
-                db_session.add(user)
-            else:
-                user.subjects = selected_subjects
-            db_session.commit()
+            async with get_async_session() as db_session:
+                user = await db_session.scalar(select(User).where(User.telegram_id == user_id))
+                if not user:
+                    user = User(
+                        telegram_id=user_id,
+                        username=query.from_user.username
+                    )
+                    db_session.add(user)
+                user.set_subjects(selected_subjects)
+                await db_session.commit()
             await query.edit_message_text(f"Твои предметы успешно установлены: {', '.join(selected_subjects)}")
         except Exception as e:
             logger.error(f"Ошибка при установке предметов: {e}")
             await query.edit_message_text("Произошла ошибка при установке твоих предметов. Пожалуйста, попробуй снова.")
-        finally:
-            db_session.close()
-            user_subject_selections.pop(user_id, None)
+
+
+# Материалы из каталога, близкие к вопросу, дописываются к ответу
+def format_related(related):
+    if not related:
+        return ''
+    links = ''.join(f"\n• {res.title}: {res.link}" for res, _ in related)
+    return f"\n\nПолезные материалы:{links}"
+
+
+def grounding_prompt(related):
+    if not RETRIEVAL_GROUNDING or not related:
+        return None
+    links = '\n'.join(f"- {res.title} ({res.subject}, {res.type}): {res.link}" for res, _ in related)
+    return f"Если это уместно, сошлись в ответе на подходящие материалы из списка:\n{links}"
 
 
 # Обработка вопросов к GigaChat
 async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    question = update.message.text
-    await update.message.reply_text("Дай мне подумать над этим...")
+    user_id = update.effective_user.id
+    # Квота проверяется по счётчикам в памяти, до обращения к GigaChat
+    if activity.check_quota(user_id) is not None:
+        await update.message.reply_text(QUOTA_MESSAGE)
+        return
+    activity.record_question(user_id)
+    question = conversations.fit_question(update.message.text)
+    with tracing.span('conversation.history'):
+        history = await conversations.history(user_id, question)
+    with tracing.span('catalog.related'):
+        related = resource_catalog.related(question) if resource_catalog.loaded else []
+    grounding = grounding_prompt(related)
+    placeholder = await update.message.reply_text("Дай мне подумать над этим...")
+    if GIGACHAT_STREAMING:
+        await stream_answer(placeholder, question, user_id, history, related, grounding)
+        return
+
+    def ask(scheduled_for, on_usage):
+        return llm_scheduler.run(
+            scheduled_for,
+            lambda: async_giga_chat_api.send_message(question, history, grounding, on_usage)
+        )
+
+    async def compute_shared():
+        usages = []
+        answer = await ask(None, usages.append)
+        return answer, usages[-1] if usages else None
+
     try:
-        answer = giga_chat_api.send_message(question)
-        await update.message.reply_text(answer)
+        # Ответ без контекста разговора не зависит от пользователя, поэтому кэшируется
+        with tracing.span('llm.answer', cacheable=not history):
+            if history:
+                answer = await ask(user_id, partial(activity.record_usage, user_id))
+            else:
+                # Схлопнутый запрос общий для всех ожидающих, поэтому не занимает слот первого
+                # спросившего: иначе его лимит отклонял бы всех. Каждый ожидающий учитывается в своём
+                with llm_scheduler.admit(user_id):
+                    answer, usage = await answer_cache.get_or_compute(question, compute_shared)
+                # Токены общего ответа списываются с каждого получившего его, иначе дневную
+                # квоту можно было бы обойти, задав вопрос, который уже задаёт кто-то другой
+                activity.record_usage(user_id, usage)
+        await update.message.reply_text(answer + format_related(related))
+        await conversations.append(user_id, question, answer)
+    except SchedulerBusy:
+        await update.message.reply_text(BUSY_MESSAGE)
+    except GigaChatUnavailable:
+        await update.message.reply_text(UNAVAILABLE_MESSAGE)
     except Exception as e:
         logger.error(f"Ошибка при обращении к GigaChat API: {e}")
         await update.message.reply_text("Извините, я не смог обработать ваш запрос в данный момент.")
 
 
+# Потоковая выдача ответа правками сообщения-заглушки
+async def stream_answer(placeholder, question, user_id, history, related=(), grounding=None):
+    reply = StreamingReply(placeholder)
+    cached = None if history else await answer_cache.get(question)
+    if cached is not None:
+        answer, usage = cached
+        # Закэшированный ответ учитывается в квоте токенов так же, как полученный заново
+        activity.record_usage(user_id, usage)
+        await reply.append(answer)
+        await reply.finish(format_related(related))
+        await conversations.append(user_id, question, answer)
+        return
+
+    usages = []
+
+    def on_usage(usage):
+        activity.record_usage(user_id, usage)
+        if usage:
+            usages.append(usage)
+
+    async def consume_stream():
+        async for chunk in async_giga_chat_api.stream_message(question, history, grounding, on_usage):
+            await reply.append(chunk)
+
+    try:
+        with tracing.span('llm.stream'):
+            await llm_scheduler.run(user_id, consume_stream)
+    except SchedulerBusy:
+        await reply.fail(BUSY_MESSAGE)
+        return
+    except GigaChatUnavailable:
+        await reply.fail(UNAVAILABLE_MESSAGE)
+        return
+    except Exception as e:
+        logger.error(f"Поток ответа GigaChat прерван: {e}")
+        await reply.fail("Извините, я не смог обработать ваш запрос в данный момент.")
+        return
+    await reply.finish(format_related(related))
+    # В кэш и историю попадают только полностью полученные ответы, без приложенных материалов
+    answer = reply.text.strip()
+    if answer:
+        if not history:
+            await answer_cache.set(question, answer, usages[-1] if usages else None)
+        await conversations.append(user_id, question, answer)
+
+
+# Любое обновление от пользователя обновляет его «последнее обращение» в буфере активности
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user is not None:
+        activity.touch(update.effective_user.id)
+
+
+# Команда /profile [секунды]: профиль работающего бота для администраторов
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_TELEGRAM_IDS:
+        await update.message.reply_text("Эта команда доступна только администраторам.")
+        return
+    try:
+        seconds = float(context.args[0]) if context.args else PROFILE_SECONDS
+    except ValueError:
+        await update.message.reply_text("Укажи длительность профиля в секундах, например: /profile 30")
+        return
+    await update.message.reply_text(f"Снимаю профиль на {seconds:.0f} с...")
+    try:
+        path = await profiler.run(seconds)
+    except RuntimeError as e:
+        await update.message.reply_text(str(e))
+        return
+    with open(path, 'rb') as profile_file:
+        await update.message.reply_document(
+            profile_file,
+            filename=os.path.basename(path),
+            caption="Свёрнутые стеки для flamegraph.pl или speedscope."
+        )
+
+
+# Команда /reset: начать разговор с GigaChat заново
+async def reset_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await conversations.clear(update.effective_user.id)
+    await update.message.reply_text("Хорошо, начнём разговор заново. Задай свой вопрос!")
+
+
 # Обновленная команда /help для отображения меню после помощи
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_text = (
         "Вот команды, которые ты можешь использовать:\n"
         "/help - Показать это сообщение помощи\n"
         "/setsubjects - Установить интересующие тебя предметы\n"
-        "/resources - Получить учебные материалы\n\n"
+        "/resources - Получить учебные материалы\n"
+        "/search - Найти материалы по названию\n"
+        "/reset - Начать разговор с помощником заново\n\n"
         "Или просто задай свой вопрос, и я постараюсь помочь!"
     )
     await update.message.reply_text(help_text)
@@ -312,26 +675,118 @@ async def main_menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_main_menu(update, context)
 
 
-def main():
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+# Получение токена GigaChat, загрузка каталога и запуск фоновых задач до приёма первых обновлений
+async def post_init(application):
+    metrics.watch(
+        token_manager=async_giga_chat_api.token_manager,
+        scheduler=llm_scheduler,
+        answer_cache=answer_cache,
+        rate_limiter=application.bot.rate_limiter,
+        activity=activity
+    )
+    metrics.instrument_engine(models.engine, 'sync')
+    metrics.instrument_engine(get_async_engine(), 'async')
+    tracing.instrument_engine(models.engine)
+    tracing.instrument_engine(get_async_engine())
+    tracing.tracer.start()
+    # kill -USR2 <pid> снимает профиль работающего бота
+    profiler.install_signal_handler()
+    models.checkout_wait_observer = metrics.observe_checkout_wait
+    application.bot_data['metrics_server'] = metrics.start_metrics_server()
+    await asyncio.to_thread(registry.load)
+    # Клавиатуры выбора предметов строятся по справочнику
+    subjects_keyboard.cache_clear()
+    await async_giga_chat_api.start()
+    llm_scheduler.start_reporting()
+    await resource_catalog.start()
+    answer_cache.start()
+    await activity.start()
+    # Рассылки идут через лимитер этого бота, в полосе BULK после ответов пользователям
+    notifications = application.bot_data['notifications'] = NotificationRunner(application.bot)
+    notifications.start()
+
+
+# Остановка фоновых задач и освобождение ресурсов при остановке бота
+async def post_shutdown(application):
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    await llm_scheduler.stop_reporting()
+    await resource_catalog.stop()
+    await answer_cache.stop()
+    notifications = application.bot_data.pop('notifications', None)
+    if notifications is not None:
+        await notifications.stop()
+    # Накопленная активность записывается до закрытия пула соединений
+    await activity.stop()
+    await tracing.tracer.stop()
+    await get_async_engine().dispose()
+    await async_giga_chat_api.aclose()
+    logger.info(f"Статистика кэша ответов: {answer_cache.stats()}")
+    answer_cache.close()
+    conversations.close()
+
+
+def build_application(concurrent_updates=BOT_CONCURRENT_UPDATES):
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(concurrent_updates)
+        # Все исходящие запросы обработчиков проходят через лимиты Telegram и повторы после RetryAfter
+        .rate_limiter(OutboundRateLimiter())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    application = builder.build()
 
     # Обработчики команд
+    # Отметка «последнее обращение» для любого обновления, до основных обработчиков
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('welcome', welcome))
     application.add_handler(CommandHandler('help', help_command))
     application.add_handler(CommandHandler('setsubjects', set_subjects))
     application.add_handler(CommandHandler('resources', get_resources))
     application.add_handler(CommandHandler('menu', main_menu_command))  # Дополнительная команда для меню
+    application.add_handler(CommandHandler('reset', reset_conversation))
+    application.add_handler(CommandHandler('search', search_resources))
+    # Профиль снимается секундами, поэтому не задерживаем остальные обновления
+    application.add_handler(CommandHandler('profile', profile_command, block=False))
+
+    # Поиск материалов в inline-режиме
+    application.add_handler(InlineQueryHandler(inline_search))
 
     # Обработчик Callback Queries для Inline кнопок
     application.add_handler(CallbackQueryHandler(button_handler))
 
-    # Обработчик сообщений для вопросов
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_question))
+    # Обработчик сообщений для вопросов (block=False, чтобы долгие запросы к GigaChat
+    # не задерживали обработку остальных обновлений)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_question, block=False))
+
+    # Трассы этапов обработки и гистограммы времени обработчиков для /metrics
+    tracing.instrument_handlers(application)
+    metrics.instrument_handlers(application)
+
+    return application
+
+
+def main(mode='polling', concurrent_updates=BOT_CONCURRENT_UPDATES, host=None, port=None, webhook_url=None):
+    application = build_application(concurrent_updates)
 
     # Запуск бота
-    application.run_polling()
+    if mode == 'webhook':
+        import webhook
+        asyncio.run(webhook.run_webhook(
+            application,
+            host=host or webhook.WEBHOOK_HOST,
+            port=port or webhook.WEBHOOK_PORT,
+            url=webhook_url or webhook.WEBHOOK_URL
+        ))
+    else:
+        application.run_polling()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import func
+
+from models import SessionLocal, Resource
+from registry import registry
+from search import SearchIndex, SEARCH_RESULT_LIMIT
+from retrieval import RetrievalIndex, RETRIEVAL_TOP_K
+
+# Загрузка переменных окружения
+load_dotenv()
+# Как часто проверять версию таблицы resources (в секундах)
+RESOURCE_CATALOG_REFRESH_INTERVAL = float(os.getenv('RESOURCE_CATALOG_REFRESH_INTERVAL', '30'))
+# Как часто перечитывать каталог целиком, чтобы подхватить изменённые строки
+RESOURCE_CATALOG_FULL_RELOAD_INTERVAL = float(os.getenv('RESOURCE_CATALOG_FULL_RELOAD_INTERVAL', '600'))
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogEntry:
+    __slots__ = ('id', 'subject', 'type', 'title', 'link')
+
+    def __init__(self, id, subject, type, title, link):
+        self.id = id
+        # Названия предмета и типа — общие строки из справочника, не копии на каждую запись
+        self.subject = subject
+        self.type = type
+        self.title = title
+        self.link = link
+
+
+class ResourceCatalog:
+    """
+    Снимок таблицы resources в памяти процесса с поисковыми индексами по
+    названиям: префиксным и TF-IDF.
+
+    Версия таблицы — пара (max(id), count(*)): если появились только новые строки,
+    они догружаются инкрементально, иначе каталог перечитывается целиком.
+    Обновление выполняется фоновой задачей, поэтому поиск не обращается к базе;
+    version также служит меткой для сброса кэша страниц /resources.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        refresh_interval=RESOURCE_CATALOG_REFRESH_INTERVAL,
+        full_reload_interval=RESOURCE_CATALOG_FULL_RELOAD_INTERVAL
+    ):
+        self._session_factory = session_factory
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self._search_index = SearchIndex()
+        self._retrieval_index = RetrievalIndex()
+        self.max_id = 0
+        self.count = 0
+        self.version = 0
+        self.loaded = False
+        self._loaded_at = 0.0
+        self._task = None
+
+    def __len__(self):
+        return self.count
+
+    def _load_rows(self, session, after_id=0):
+        rows = (
+            session.query(Resource.id, Resource.subject_id, Resource.type_id, Resource.title, Resource.link)
+            .filter(Resource.id > after_id)
+            .order_by(Resource.id)
+            .all()
+        )
+        subject_name, type_name = registry.subject_name, registry.type_name
+        return [
+            CatalogEntry(resource_id, subject_name(subject_id), type_name(type_id), title, link)
+            for resource_id, subject_id, type_id, title, link in rows
+        ]
+
+    def refresh(self, force=False):
+        """Синхронно сверяет версию таблицы и при необходимости обновляет каталог."""
+        with self._session_factory() as session:
+            max_id, count = session.query(func.coalesce(func.max(Resource.id), 0), func.count(Resource.id)).one()
+            full_reload_due = time.monotonic() - self._loaded_at >= self.full_reload_interval
+            if self.loaded and not force and not full_reload_due and (max_id, count) == (self.max_id, self.count):
+                return False
+
+            new_entries = None
+            if self.loaded and not force and not full_reload_due and max_id > self.max_id:
+                new_entries = self._load_rows(session, after_id=self.max_id)
+                if self.count + len(new_entries) != count:
+                    new_entries = None
+            if new_entries is None:
+                # Строки удалялись или менялись — перечитываем каталог целиком
+                entries = self._load_rows(session)
+
+        if new_entries is not None:
+            # Индексы, которыми сейчас пользуется поиск, не меняются: новые строки
+            # добавляются в их копии, и копии подменяют их целиком
+            search_index = self._search_index.copy()
+            retrieval_index = self._retrieval_index.copy()
+            self._swap(search_index, retrieval_index, new_entries, count)
+            logger.info(f"Каталог материалов дополнен: +{len(new_entries)} (всего {count})")
+            return True
+
+        # Полная перезагрузка строит индексы заново
+        self._swap(SearchIndex(), RetrievalIndex(), entries, len(entries))
+        self.loaded = True
+        self._loaded_at = time.monotonic()
+        logger.info(f"Каталог материалов загружен: {self.count} записей")
+        return True
+
+    def _swap(self, search_index, retrieval_index, entries, count):
+        # Индексы заполняются до подмены, чтобы читатели в цикле событий
+        # никогда не видели наполовину заполненный каталог
+        search_index.add(entries)
+        retrieval_index.add(entries)
+        self._search_index = search_index
+        self._retrieval_index = retrieval_index
+        # Дозагрузка всегда приносит хотя бы одну строку, поэтому пустой список — пустой каталог
+        self.max_id = entries[-1].id if entries else 0
+        self.count = count
+        self.version += 1
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        """Ищет материалы по словам и началам слов названия, предмета и типа."""
+        return self._search_index.search(query, limit)
+
+    def related(self, text, k=RETRIEVAL_TOP_K):
+        """Возвращает до k пар (материал, сходство), близких к тексту вопроса по TF-IDF."""
+        return self._retrieval_index.search(text, k)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении каталога материалов: {e}")
+
+    async def start(self):
+        """Загружает каталог и запускает фоновую проверку версии."""
+        try:
+            await asyncio.to_thread(self.refresh, True)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке каталога материалов: {e}")
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+CONVERSATION_MAX_USERS = int(os.getenv('CONVERSATION_MAX_USERS', '10000'))
+# Через сколько секунд бездействия разговор забывается
+CONVERSATION_TTL = float(os.getenv('CONVERSATION_TTL', '3600'))
+CONVERSATION_MAX_TURNS = int(os.getenv('CONVERSATION_MAX_TURNS', '20'))
+# Бюджет токенов на историю и текущий вопрос вместе
+CONVERSATION_TOKEN_BUDGET = int(os.getenv('CONVERSATION_TOKEN_BUDGET', '2000'))
+# Путь к файлу SQLite для сохранения истории между перезапусками; если не задан, история только в памяти
+CONVERSATION_DB = os.getenv('CONVERSATION_DB')
+
+# Грубая оценка: для русского текста в среднем около трёх символов на токен
+CHARS_PER_TOKEN = 3
+TRUNCATION_MARK = '…'
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_to_tokens(text, tokens):
+    limit = max(tokens, 1) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:limit - len(TRUNCATION_MARK)] + TRUNCATION_MARK
+
+
+class _Conversation:
+    __slots__ = ('turns', 'tokens', 'last_seen')
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)  # (role, content, tokens)
+        self.tokens = 0
+        self.last_seen = time.monotonic()
+
+    def add(self, role, content):
+        if len(self.turns) == self.turns.maxlen:
+            self.tokens -= self.turns[0][2]
+        tokens = estimate_tokens(content)
+        self.turns.append((role, content, tokens))
+        self.tokens += tokens
+
+    def pop_oldest(self):
+        role, content, tokens = self.turns.popleft()
+        self.tokens -= tokens
+
+
+class SqliteConversationStore:
+    """Персистентное хранилище реплик в локальном файле SQLite."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS turns ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, '
+            'role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_turns_user_id ON turns (user_id, id)')
+        self._conn.commit()
+
+    def load(self, user_id, limit, since):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT role, content FROM turns WHERE user_id = ? AND created_at >= ? '
+                'ORDER BY id DESC LIMIT ?',
+                (user_id, since, limit)
+            ).fetchall()
+        return rows[::-1]
+
+    def append(self, user_id, turns, keep):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT INTO turns (user_id, role, content, created_at) VALUES (?, ?, ?, ?)',
+                [(user_id, role, content, now) for role, content in turns]
+            )
+            # Храним не больше keep последних реплик пользователя
+            self._conn.execute(
+                'DELETE FROM turns WHERE user_id = ? AND id NOT IN '
+                '(SELECT id FROM turns WHERE user_id = ? ORDER BY id DESC LIMIT ?)',
+                (user_id, user_id, keep)
+            )
+            self._conn.commit()
+
+    def clear(self, user_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM turns WHERE user_id = ?', (user_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ConversationStore:
+    """
+    История разговора с GigaChat для каждого пользователя.
+
+    Разговоры хранятся в LRU ограниченного размера и забываются после ttl секунд
+    бездействия. При сборке запроса старые реплики отбрасываются так, чтобы
+    история вместе с вопросом укладывалась в token_budget.
+    """
+
+    def __init__(
+        self,
+        max_users=CONVERSATION_MAX_USERS,
+        ttl=CONVERSATION_TTL,
+        max_turns=CONVERSATION_MAX_TURNS,
+        token_budget=CONVERSATION_TOKEN_BUDGET,
+        store=None
+    ):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.store = store
+        self._conversations = OrderedDict()
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _evict_expired(self):
+        # Самые давно активные разговоры стоят в начале OrderedDict
+        deadline = time.monotonic() - self.ttl
+        while self._conversations:
+            user_id, conversation = next(iter(self._conversations.items()))
+            if conversation.last_seen > deadline:
+                break
+            del self._conversations[user_id]
+
+    async def _get(self, user_id):
+        self._evict_expired()
+        conversation = self._conversations.get(user_id)
+        if conversation is None and self.store is not None:
+            try:
+                rows = await asyncio.to_thread(self.store.load, user_id, self.max_turns, time.time() - self.ttl)
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка чтения истории разговора: {e}")
+                rows = []
+            if rows:
+                conversation = _Conversation(self.max_turns)
+                for role, content in rows:
+                    conversation.add(role, content)
+                self._remember(user_id, conversation)
+        if conversation is not None:
+            conversation.last_seen = time.monotonic()
+            self._conversations.move_to_end(user_id)
+        return conversation
+
+    def _remember(self, user_id, conversation):
+        self._conversations[user_id] = conversation
+        self._conversations.move_to_end(user_id)
+        while len(self._conversations) > self.max_users:
+            self._conversations.popitem(last=False)
+
+    def fit_question(self, question):
+        """Обрезает слишком длинный вопрос, чтобы он сам по себе укладывался в бюджет."""
+        return truncate_to_tokens(question, self.token_budget)
+
+    async def history(self, user_id, question):
+        """Возвращает предыдущие реплики, которые помещаются в бюджет вместе с вопросом."""
+        conversation = await self._get(user_id)
+        if conversation is None:
+            return []
+        budget = self.token_budget - estimate_tokens(question)
+        # Лишние старые реплики удаляем насовсем: в следующие запросы они тоже не попадут
+        while conversation.turns and conversation.tokens > budget:
+            conversation.pop_oldest()
+        # История должна начинаться с вопроса пользователя
+        while conversation.turns and conversation.turns[0][0] != 'user':
+            conversation.pop_oldest()
+        return [{'role': role, 'content': content} for role, content, _ in conversation.turns]
+
+    async def append(self, user_id, question, answer):
+        conversation = await self._get(user_id)
+        if conversation is None:
+            conversation = _Conversation(self.max_turns)
+            self._remember(user_id, conversation)
+        turns = [('user', question), ('assistant', answer)]
+        for role, content in turns:
+            conversation.add(role, content)
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.append, user_id, turns, self.max_turns)
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка записи истории разговора: {e}")
+
+    async def clear(self, user_id):
+        self._conversations.pop(user_id, None)
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.clear, user_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка очистки истории разговора: {e}")
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
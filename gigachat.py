@@ -0,0 +1,412 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+import httpx
+from dotenv import load_dotenv
+
+import metrics
+import tracing
+from resilience import CircuitBreaker, LatencyWindow, backoff_delay
+from token_manager import TokenManager
+
+# Загрузка переменных окружения
+load_dotenv()
+GIGACHAT_CLIENT_ID = os.getenv('GIGACHAT_CLIENT_ID')
+GIGACHAT_OAUTH_URL = os.getenv('GIGACHAT_OAUTH_URL', 'https://ngw.devices.sberbank.ru:9443/api/v2/oauth')
+GIGACHAT_API_URL = os.getenv('GIGACHAT_API_URL', 'https://gigachat.devices.sberbank.ru/api/v1')
+
+# Таймауты (в секундах) и ограничения пула соединений
+GIGACHAT_CONNECT_TIMEOUT = float(os.getenv('GIGACHAT_CONNECT_TIMEOUT', '5'))
+GIGACHAT_READ_TIMEOUT = float(os.getenv('GIGACHAT_READ_TIMEOUT', '30'))
+GIGACHAT_TOTAL_TIMEOUT = float(os.getenv('GIGACHAT_TOTAL_TIMEOUT', '60'))
+GIGACHAT_MAX_CONCURRENCY = int(os.getenv('GIGACHAT_MAX_CONCURRENCY', '200'))
+GIGACHAT_MAX_CONNECTIONS = int(os.getenv('GIGACHAT_MAX_CONNECTIONS', '100'))
+GIGACHAT_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('GIGACHAT_MAX_KEEPALIVE_CONNECTIONS', '20'))
+
+# Повторы после сетевых ошибок, 429 и 5xx: число повторов и границы паузы с джиттером (в секундах)
+GIGACHAT_MAX_RETRIES = int(os.getenv('GIGACHAT_MAX_RETRIES', '2'))
+GIGACHAT_RETRY_BASE_DELAY = float(os.getenv('GIGACHAT_RETRY_BASE_DELAY', '0.25'))
+GIGACHAT_RETRY_MAX_DELAY = float(os.getenv('GIGACHAT_RETRY_MAX_DELAY', '2'))
+# Размыкатель цепи: окно последних вызовов (0 отключает), пороги доли ошибок и доли
+# вызовов дольше GIGACHAT_BREAKER_SLOW_CALL секунд (0 — задержка не учитывается)
+GIGACHAT_BREAKER_WINDOW = int(os.getenv('GIGACHAT_BREAKER_WINDOW', '20'))
+GIGACHAT_BREAKER_MIN_CALLS = int(os.getenv('GIGACHAT_BREAKER_MIN_CALLS', '10'))
+GIGACHAT_BREAKER_FAILURE_RATE = float(os.getenv('GIGACHAT_BREAKER_FAILURE_RATE', '0.5'))
+GIGACHAT_BREAKER_SLOW_CALL = float(os.getenv('GIGACHAT_BREAKER_SLOW_CALL', '20'))
+GIGACHAT_BREAKER_SLOW_RATE = float(os.getenv('GIGACHAT_BREAKER_SLOW_RATE', '0.8'))
+GIGACHAT_BREAKER_OPEN_SECONDS = float(os.getenv('GIGACHAT_BREAKER_OPEN_SECONDS', '30'))
+# Хеджирование: если ответа нет дольше этого перцентиля задержек (0 отключает),
+# отправляется второй запрос и берётся ответ, пришедший первым
+GIGACHAT_HEDGE_PERCENTILE = float(os.getenv('GIGACHAT_HEDGE_PERCENTILE', '0'))
+GIGACHAT_HEDGE_MIN_DELAY = float(os.getenv('GIGACHAT_HEDGE_MIN_DELAY', '1'))
+GIGACHAT_HEDGE_MIN_SAMPLES = int(os.getenv('GIGACHAT_HEDGE_MIN_SAMPLES', '20'))
+
+SYSTEM_PROMPT = "Ты умный помощник в учебе."
+
+logger = logging.getLogger(__name__)
+
+
+class GigaChatError(Exception):
+    """Ошибка при обращении к GigaChat API."""
+
+
+class GigaChatUnavailable(GigaChatError):
+    """Размыкатель цепи разомкнут: GigaChat недавно отвечал с ошибками или слишком медленно."""
+
+
+def is_retryable(error):
+    # Повтор безопасен: запрос к модели не меняет состояние на стороне GigaChat
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class AsyncGigaChatAPI:
+    """
+    Асинхронный клиент GigaChat поверх общего пула keep-alive соединений httpx.
+
+    В отличие от GigaChatAPI не блокирует цикл событий: запросы выполняются
+    с таймаутами на подключение, чтение и весь вызов целиком, а количество
+    одновременных запросов в процессе ограничено семафором.
+
+    Вызовы защищены размыкателем цепи (при деградации GigaChat запросы сразу
+    завершаются GigaChatUnavailable), повторяются с джиттером после сетевых
+    ошибок, 429 и 5xx и, если включено хеджирование, дублируются, когда ответ
+    задерживается дольше заданного перцентиля.
+    """
+
+    def __init__(
+        self,
+        authorization_key,
+        client_id=GIGACHAT_CLIENT_ID,
+        connect_timeout=GIGACHAT_CONNECT_TIMEOUT,
+        read_timeout=GIGACHAT_READ_TIMEOUT,
+        total_timeout=GIGACHAT_TOTAL_TIMEOUT,
+        max_concurrency=GIGACHAT_MAX_CONCURRENCY,
+        max_connections=GIGACHAT_MAX_CONNECTIONS,
+        max_keepalive_connections=GIGACHAT_MAX_KEEPALIVE_CONNECTIONS,
+        token_store=None,
+        max_retries=GIGACHAT_MAX_RETRIES,
+        retry_base_delay=GIGACHAT_RETRY_BASE_DELAY,
+        retry_max_delay=GIGACHAT_RETRY_MAX_DELAY,
+        breaker=None,
+        hedge_percentile=GIGACHAT_HEDGE_PERCENTILE,
+        hedge_min_delay=GIGACHAT_HEDGE_MIN_DELAY,
+        hedge_min_samples=GIGACHAT_HEDGE_MIN_SAMPLES
+    ):
+        self.authorization_key = authorization_key
+        self.client_id = client_id
+        self.total_timeout = total_timeout
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.token_manager = TokenManager(self.request_access_token, store=token_store)
+        self._client = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.breaker = breaker or CircuitBreaker(
+            window=GIGACHAT_BREAKER_WINDOW,
+            min_calls=GIGACHAT_BREAKER_MIN_CALLS,
+            failure_rate=GIGACHAT_BREAKER_FAILURE_RATE,
+            slow_call=GIGACHAT_BREAKER_SLOW_CALL,
+            slow_rate=GIGACHAT_BREAKER_SLOW_RATE,
+            open_duration=GIGACHAT_BREAKER_OPEN_SECONDS,
+            on_change=metrics.set_breaker_state
+        )
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = LatencyWindow()
+
+    def _get_client(self):
+        # Клиент создаётся лениво, чтобы привязаться к уже запущенному циклу событий
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                verify=False  # verify=False временно, как и в GigaChatAPI
+            )
+        return self._client
+
+    async def start(self):
+        # Получаем токен заранее и дальше обновляем его в фоне,
+        # чтобы ни один запрос пользователя не ждал oauth
+        try:
+            await self.token_manager.refresh()
+        except GigaChatError:
+            pass
+        self.token_manager.start()
+
+    async def aclose(self):
+        await self.token_manager.stop()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_access_token(self):
+        with tracing.span('gigachat.token'):
+            return await self.token_manager.get_token()
+
+    async def request_access_token(self):
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': 'application/json',
+            'Authorization': f'Basic {self.authorization_key}',
+            'RqUID': str(uuid.uuid4())
+        }
+        data = {
+            'scope': 'GIGACHAT_API_PERS'
+        }
+        started_at = time.perf_counter()
+        status = 'error'
+        try:
+            with tracing.span('gigachat.oauth') as span:
+                response = await self._get_client().post(GIGACHAT_OAUTH_URL, headers=headers, data=data)
+                status = response.status_code
+                if span is not None:
+                    span.set(status=status)
+                response.raise_for_status()
+                token_info = response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"Ошибка при получении Access Token: {e}")
+            raise GigaChatError(str(e)) from e
+        finally:
+            metrics.observe_gigachat('oauth', status, time.perf_counter() - started_at)
+        logger.info("Access token получен успешно.")
+        # expires_at приходит в миллисекундах
+        return token_info['access_token'], token_info['expires_at'] / 1000
+
+    def build_payload(self, user_message, history=None, grounding=None):
+        system_prompt = f"{SYSTEM_PROMPT}\n\n{grounding}" if grounding else SYSTEM_PROMPT
+        return {
+            "model": "GigaChat",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                *(history or []),
+                {"role": "user", "content": user_message}
+            ],
+            "max_tokens": 500,
+            "temperature": 0.7
+        }
+
+    async def _build_headers(self):
+        return {
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {await self.get_access_token()}',
+            'Content-Type': 'application/json',
+            'X-Client-ID': self.client_id or '',
+            'X-Request-ID': str(uuid.uuid4()),
+            'X-Session-ID': str(uuid.uuid4())
+        }
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            metrics.record_breaker_rejection()
+            raise GigaChatUnavailable("circuit breaker is open")
+
+    async def _retry_pause(self, operation, attempt, error):
+        delay = backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+        metrics.record_retry(operation)
+        logger.warning(f"Ошибка GigaChat API ({error}), повтор {attempt + 1} из {self.max_retries} через {delay:.2f} с")
+        await asyncio.sleep(delay)
+
+    async def _complete(self, payload):
+        headers = await self._build_headers()
+        started_at = time.perf_counter()
+        status = 'error'
+        try:
+            with tracing.span('gigachat.complete') as span:
+                response = await self._get_client().post(
+                    f'{GIGACHAT_API_URL}/chat/completions',
+                    headers=headers,
+                    json=payload
+                )
+                status = response.status_code
+                if span is not None:
+                    span.set(status=status)
+                response.raise_for_status()
+                response_data = response.json()
+        except asyncio.CancelledError:
+            # Отменённый вызов (проигравший хедж или общий таймаут) в размыкатель не попадает
+            status = 'cancelled'
+            raise
+        except httpx.HTTPError as e:
+            self.breaker.record(is_retryable(e), time.perf_counter() - started_at)
+            raise
+        finally:
+            metrics.observe_gigachat('complete', status, time.perf_counter() - started_at)
+        elapsed = time.perf_counter() - started_at
+        self.breaker.record(False, elapsed)
+        self.latencies.observe(elapsed)
+        metrics.record_token_usage(response_data.get('usage'))
+        return response_data
+
+    def _hedge_delay(self):
+        if not self.hedge_percentile or len(self.latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latencies.percentile(self.hedge_percentile))
+
+    async def _complete_hedged(self, payload):
+        """Выполняет запрос; если он не уложился в перцентиль задержек, дублирует его и берёт первый ответ."""
+        delay = self._hedge_delay()
+        first = asyncio.ensure_future(self._complete(payload))
+        if delay is None:
+            return await first
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            # Пока GigaChat нездоров, нагрузку не удваиваем
+            if not done and self.breaker.allow():
+                metrics.record_hedge('fired')
+                tasks.add(asyncio.ensure_future(self._complete(payload)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                # Ошибку забираем у каждой завершённой задачи, даже если другая успела
+                # ответить, иначе asyncio пишет «Task exception was never retrieved»
+                errors = {task: task.exception() for task in done}
+                winner = next((task for task in done if errors[task] is None), None)
+                if winner is not None:
+                    if winner is not first:
+                        metrics.record_hedge('won')
+                    return winner.result()
+                error = errors[first] if first in errors else next(iter(errors.values()))
+            raise error
+        finally:
+            # Проигравший запрос отменяется и дожидается завершения: его ошибка
+            # (если он успел упасть) забирается здесь, исход уже записан в размыкатель
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _complete_with_retries(self, payload):
+        for attempt in range(self.max_retries + 1):
+            self._check_breaker()
+            try:
+                return await self._complete_hedged(payload)
+            except httpx.HTTPError as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                await self._retry_pause('complete', attempt, e)
+
+    async def send_message(self, user_message, history=None, grounding=None, on_usage=None):
+        """
+        Отправляет вопрос (с предыдущими репликами history) в GigaChat и возвращает текст ответа.
+
+        grounding дописывается к системному промпту, например список материалов для ссылок.
+        on_usage(usage) получает поле usage ответа для учёта расхода токенов пользователем.
+        Ограничение total_timeout действует на все повторы и хеджированные запросы вместе.
+        """
+        async with self._semaphore:
+            try:
+                response_data = await asyncio.wait_for(
+                    self._complete_with_retries(self.build_payload(user_message, history, grounding)),
+                    timeout=self.total_timeout
+                )
+                if on_usage is not None:
+                    on_usage(response_data.get('usage'))
+                # Извлекаем ответ модели
+                return response_data['choices'][0]['message']['content'].strip()
+            except asyncio.TimeoutError as e:
+                logger.error(f"Превышено время ожидания ответа GigaChat API ({self.total_timeout} с)")
+                self.breaker.record(True, self.total_timeout)
+                raise GigaChatError("timeout") from e
+            except httpx.HTTPError as e:
+                logger.error(f"Ошибка при обращении к GigaChat API: {e}")
+                raise GigaChatError(str(e)) from e
+            except (KeyError, IndexError, ValueError) as e:
+                logger.error(f"Некорректный ответ GigaChat API: {e}")
+                raise GigaChatError(str(e)) from e
+
+    async def stream_message(self, user_message, history=None, grounding=None, on_usage=None):
+        """
+        Отправляет вопрос в GigaChat в режиме SSE и по мере генерации отдаёт фрагменты ответа.
+
+        Ограничение total_timeout действует на весь поток целиком,
+        read_timeout — на паузу между соседними фрагментами. Повтор возможен,
+        только пока не отдан ни один фрагмент; хеджирование к потоку не применяется.
+        """
+        payload = self.build_payload(user_message, history, grounding)
+        payload['stream'] = True
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            deadline = loop.time() + self.total_timeout
+            for attempt in range(self.max_retries + 1):
+                self._check_breaker()
+                started_at = time.perf_counter()
+                status = 'error'
+                streamed = False
+                # Спан не делается текущим: между фрагментами управление у вызывающего кода
+                stream_span = tracing.start_span('gigachat.stream', attempt=attempt)
+                try:
+                    headers = await self._build_headers()
+                    headers['Accept'] = 'text/event-stream'
+                    async with self._get_client().stream(
+                        'POST',
+                        f'{GIGACHAT_API_URL}/chat/completions',
+                        headers=headers,
+                        json=payload
+                    ) as response:
+                        status = response.status_code
+                        response.raise_for_status()
+                        # Для размыкателя задержка потока — время до начала ответа
+                        self.breaker.record(False, time.perf_counter() - started_at)
+                        lines = response.aiter_lines()
+                        while True:
+                            # Срок проверяется и пока фрагмента нет: зависший поток тоже прерывается
+                            try:
+                                line = await asyncio.wait_for(anext(lines), deadline - loop.time())
+                            except StopAsyncIteration:
+                                break
+                            if not line.startswith('data:'):
+                                continue
+                            data = line[len('data:'):].strip()
+                            if data == '[DONE]':
+                                return
+                            chunk = json.loads(data)
+                            # Расход токенов приходит в последнем фрагменте потока
+                            metrics.record_token_usage(chunk.get('usage'))
+                            if on_usage is not None:
+                                on_usage(chunk.get('usage'))
+                            content = chunk['choices'][0].get('delta', {}).get('content')
+                            if content:
+                                if not streamed and stream_span is not None:
+                                    stream_span.set(first_chunk_ms=round((time.perf_counter() - started_at) * 1000, 3))
+                                streamed = True
+                                yield content
+                    return
+                except (asyncio.CancelledError, GeneratorExit):
+                    status = 'cancelled'
+                    raise
+                except asyncio.TimeoutError as e:
+                    logger.error(f"Превышено время ожидания ответа GigaChat API ({self.total_timeout} с)")
+                    status = 'timeout'
+                    # Зависший поток — отказ GigaChat, даже если начало ответа уже записано как успех
+                    self.breaker.record(True, time.perf_counter() - started_at)
+                    raise GigaChatError("timeout") from e
+                except httpx.HTTPError as e:
+                    if status == 'error' or isinstance(e, (httpx.HTTPStatusError, httpx.TimeoutException)):
+                        # Ответ так и не начался или оборвался по таймауту чтения — записываем в размыкатель
+                        self.breaker.record(is_retryable(e), time.perf_counter() - started_at)
+                    if not streamed and attempt < self.max_retries and is_retryable(e) and loop.time() < deadline:
+                        await self._retry_pause('stream', attempt, e)
+                        continue
+                    logger.error(f"Ошибка при потоковом обращении к GigaChat API: {e}")
+                    raise GigaChatError(str(e)) from e
+                except (KeyError, IndexError, ValueError) as e:
+                    logger.error(f"Некорректный фрагмент потока GigaChat API: {e}")
+                    raise GigaChatError(str(e)) from e
+                finally:
+                    metrics.observe_gigachat('stream', status, time.perf_counter() - started_at)
+                    if stream_span is not None:
+                        stream_span.set(status=status)
+                        stream_span.end()
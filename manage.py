@@ -1,33 +1,93 @@
-import click
+import builtins
+import os
 import sys
-import subprocess
-from models import init_db, Base, engine
-from alembic.config import Config
-from alembic import command
-from dotenv import load_dotenv
-import validators
-
-# Загрузка переменных окружения
-load_dotenv()
-
-# Определение доступных предметов
-AVAILABLE_SUBJECTS = [
-    'Математика',
-    'Физика',
-    'Химия',
-    'Биология',
-    'История',
-    'Литература',
-    'Информатика',
-    'География',
-    'Английский язык',
-    'Русский язык'
-]
+import time
+
+import click
+
+# Тяжёлые модули (models, alembic, validators, bot) импортируются внутри команд,
+# чтобы каждая команда загружала только то, что ей нужно
+STARTED_AT = time.perf_counter()
+
+class ImportProfiler:
+    """Замеряет время импорта модулей, загруженных после установки профилировщика."""
+
+    def __init__(self):
+        self.records = []  # (имя модуля, общее время, собственное время, глубина)
+        self._stack = []
+        self._original_import = None
+
+    def install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Относительные и уже загруженные модули не замеряем отдельно:
+        # их время входит в собственное время родителя
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        depth = len(self._stack)
+        self._stack.append(0.0)
+        started_at = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.records.append((name, elapsed, elapsed - children, depth))
+
+    def report(self, limit=20):
+        self.uninstall()
+        total = sum(elapsed for _, elapsed, _, depth in self.records if depth == 0)
+        click.echo("\nПрофиль запуска (время в мс):", err=True)
+        click.echo(f"{'всего':>9} {'собств.':>9}  модуль", err=True)
+        for name, elapsed, self_time, depth in sorted(self.records, key=lambda r: r[1], reverse=True)[:limit]:
+            click.echo(f"{elapsed * 1000:9.1f} {self_time * 1000:9.1f}  {'  ' * depth}{name}", err=True)
+        click.echo(f"Импорт модулей команды: {total * 1000:.1f} мс", err=True)
+        click.echo(f"Общее время работы: {(time.perf_counter() - STARTED_AT) * 1000:.1f} мс", err=True)
+
+
+def alembic_config():
+    from alembic.config import Config
+    return Config("alembic.ini")
+
+
+# Ветка миграций, удаляющих то, что ещё читает прежняя версия бота (шаг contract);
+# она применяется только командой contract, а не при запуске бота
+CONTRACT_BRANCH = 'contract'
+
+
+def schema_heads(alembic_cfg):
+    """Головные ревизии всех веток, кроме contract."""
+    from alembic.script import ScriptDirectory
+
+    script = ScriptDirectory.from_config(alembic_cfg)
+    return [head for head in script.get_heads() if CONTRACT_BRANCH not in script.get_revision(head).branch_labels]
+
+
+def upgrade_schema(alembic_cfg):
+    from alembic import command
+
+    for head in schema_heads(alembic_cfg):
+        command.upgrade(alembic_cfg, head)
+
 
 @click.group()
-def cli():
+@click.option('--profile-startup', is_flag=True, help='Показать время импорта модулей после выполнения команды.')
+@click.pass_context
+def cli(ctx, profile_startup):
     """Утилита для управления проектом StudyHomie."""
-    pass
+    if profile_startup:
+        profiler = ImportProfiler()
+        profiler.install()
+        ctx.call_on_close(profiler.report)
 
 
 @cli.command()
@@ -37,6 +97,7 @@ def initdb():
     """
     click.echo("Инициализация базы данных...")
     try:
+        from models import init_db
         init_db()
         click.echo("Таблицы успешно созданы!")
     except Exception as e:
@@ -51,27 +112,35 @@ def migrate(message):
     """
     click.echo("Создание новой миграции...")
     try:
+        from alembic import command
+        alembic_cfg = alembic_config()
+
         # Создание миграции
-        subprocess.run(["alembic", "revision", "--autogenerate", "-m", message], check=True)
+        command.revision(alembic_cfg, message=message, autogenerate=True, head=schema_heads(alembic_cfg)[0])
         click.echo("Миграция создана успешно.")
 
         # Применение миграции
         click.echo("Применение миграций...")
-        subprocess.run(["alembic", "upgrade", "head"], check=True)
+        upgrade_schema(alembic_cfg)
         click.echo("Миграции успешно применены.")
-    except subprocess.CalledProcessError as e:
+    except Exception as e:
         click.echo(f"Ошибка при выполнении миграций: {e}")
 
 
 @cli.command()
-def runbot():
+@click.option('--mode', type=click.Choice(['polling', 'webhook']), default='polling', show_default=True, help='Способ получения обновлений.')
+@click.option('--concurrent-updates', type=click.IntRange(1), default=None, help='Сколько обновлений обрабатывать одновременно.')
+@click.option('--host', default=None, help='Адрес webhook-сервера (WEBHOOK_HOST).')
+@click.option('--port', type=int, default=None, help='Порт webhook-сервера (WEBHOOK_PORT).')
+@click.option('--webhook-url', default=None, help='Публичный адрес для setWebhook (WEBHOOK_URL).')
+@click.option('--workers', type=click.IntRange(1), default=1, show_default=True, help='Число процессов-обработчиков (шардов по id пользователя).')
+def runbot(mode, concurrent_updates, host, port, webhook_url, workers):
     """
-    Запускает Telegram-бота после применения миграций.
+    Запускает Telegram-бота после применения миграций (кроме ветки contract).
     """
     click.echo("Применение миграций перед запуском бота...")
     try:
-        alembic_cfg = Config("alembic.ini")
-        command.upgrade(alembic_cfg, "head")
+        upgrade_schema(alembic_config())
         click.echo("Миграции успешно применены.")
     except Exception as e:
         click.echo(f"Ошибка при применении миграций: {e}")
@@ -79,9 +148,28 @@ def runbot():
 
     click.echo("Запуск Telegram-бота...")
     try:
-        subprocess.run([sys.executable, "bot.py"], check=True)
-    except subprocess.CalledProcessError as e:
+        if workers > 1:
+            import sharding
+            sharding.run_sharded(
+                workers,
+                mode=mode,
+                concurrent_updates=concurrent_updates or sharding.SHARD_WORKER_CONCURRENT_UPDATES,
+                host=host,
+                port=port,
+                webhook_url=webhook_url
+            )
+            return
+        import bot
+        bot.main(
+            mode=mode,
+            concurrent_updates=concurrent_updates or bot.BOT_CONCURRENT_UPDATES,
+            host=host,
+            port=port,
+            webhook_url=webhook_url
+        )
+    except Exception as e:
         click.echo(f"Ошибка при запуске бота: {e}")
+        sys.exit(1)
 
 
 @cli.command()
@@ -95,6 +183,8 @@ def resetdb():
     if confirm.lower() == 'yes':
         click.echo("Сброс базы данных...")
         try:
+            from models import init_db, Base, engine
+
             # Удаление всех таблиц
             Base.metadata.drop_all(engine)
             click.echo("Все таблицы удалены.")
@@ -115,12 +205,31 @@ def status():
     """
     click.echo("Проверка статуса миграций...")
     try:
-        alembic_cfg = Config("alembic.ini")
-        command.current(alembic_cfg)
+        from alembic import command
+        command.current(alembic_config())
     except Exception as e:
         click.echo(f"Ошибка при получении статуса миграций: {e}")
 
 
+@cli.command()
+def contract():
+    """
+    Применяет миграции ветки contract: удаляет колонки, которые читала прежняя версия бота.
+
+    Запускать после того, как все процессы бота перезапущены с новым кодом.
+    """
+    click.echo("Применение миграций ветки contract...")
+    try:
+        from alembic import command
+        alembic_cfg = alembic_config()
+        upgrade_schema(alembic_cfg)
+        command.upgrade(alembic_cfg, f"{CONTRACT_BRANCH}@head")
+        click.echo("Миграции ветки contract применены.")
+    except Exception as e:
+        click.echo(f"Ошибка при применении миграций: {e}")
+        sys.exit(1)
+
+
 @cli.command()
 def downgrade():
     """
@@ -128,88 +237,237 @@ def downgrade():
     """
     click.echo("Откат последней миграции...")
     try:
-        alembic_cfg = Config("alembic.ini")
-        command.downgrade(alembic_cfg, "-1")
+        from alembic import command
+        command.downgrade(alembic_config(), "-1")
         click.echo("Последняя миграция откатена.")
     except Exception as e:
         click.echo(f"Ошибка при откате миграции: {e}")
 
 
 @cli.command()
-@click.option(
-    '--subject',
-    type=click.IntRange(1, len(AVAILABLE_SUBJECTS)),
-    prompt='Выберите предмет:\n' + '\n'.join([f'{i + 1}. {s}' for i, s in enumerate(AVAILABLE_SUBJECTS)]),
-    help='Номер предмета'
-)
-@click.option(
-    '--type',
-    type=click.IntRange(1, 3),
-    prompt='Тип ресурса (1. Статья, 2. Видео, 3. Туториал)',
-    help='Тип ресурса'
-)
-@click.option('--title', prompt='Название статьи, видео или туториала', help='Название статьи, видео или туториала')
-@click.option('--link', prompt='Ссылка на ресурс', help='Ссылка на ресурс')
-def addresource(subject, type, title, link):
+@click.option('--subject', type=click.IntRange(1), default=None, help='Номер предмета')
+@click.option('--type', type=click.IntRange(1), default=None, help='Тип ресурса')
+@click.option('--title', default=None, help='Название статьи, видео или туториала')
+@click.option('--link', default=None, help='Ссылка на ресурс')
+@click.option('--notify', is_flag=True, help='Поставить в очередь уведомление подписчикам предмета.')
+@click.option('--update', is_flag=True, help='Перезаписать ресурс, если ссылка уже есть в базе.')
+def addresource(subject, type, title, link, notify, update):
     """
     Добавляет новый учебный ресурс в базу данных.
+
+    Ресурс с уже существующей (нормализованной) ссылкой перезаписывается только с --update.
     """
     click.echo("Добавление нового учебного ресурса.")
     try:
-        # Маппинг чисел на типы ресурсов
-        type_mapping_display = {1: 'Статья', 2: 'Видео', 3: 'Туториал'}
-        type_mapping_internal = {1: 'Article', 2: 'Video', 3: 'Tutorial'}
+        from add_resources import validate_resource
+        from registry import get_registry
 
-        type_selected_display = type_mapping_display.get(type)
-        type_selected_internal = type_mapping_internal.get(type)
+        # Списки предметов и типов берутся из справочников, поэтому спрашиваем их здесь, а не в опциях
+        registry = get_registry()
+        if subject is None:
+            subject = click.prompt(
+                'Выберите предмет:\n' + '\n'.join([f'{i + 1}. {s}' for i, s in enumerate(registry.subjects)]),
+                type=click.IntRange(1, len(registry.subjects))
+            )
+        if type is None:
+            type = click.prompt(
+                'Тип ресурса (' + ', '.join([f'{i + 1}. {t}' for i, t in enumerate(registry.resource_types)]) + ')',
+                type=click.IntRange(1, len(registry.resource_types))
+            )
+        if title is None:
+            title = click.prompt('Название статьи, видео или туториала')
+        if link is None:
+            link = click.prompt('Ссылка на ресурс')
 
-        if not type_selected_display or not type_selected_internal:
+        # Маппинг номеров на предмет и тип ресурса
+        if subject > len(registry.subjects):
+            raise ValueError("Неверный выбор предмета.")
+        if type > len(registry.resource_types):
             raise ValueError("Неверный выбор типа ресурса.")
-
-        # Маппинг числа на предмет
-        subject_selected = AVAILABLE_SUBJECTS[subject - 1]
+        subject_selected = registry.subjects[subject - 1]
+        type_selected_display = registry.resource_types[type - 1]
 
         # Валидация и обработка переданных параметров
-        subject_selected = subject_selected.strip()
-        if not subject_selected:
-            raise ValueError("Предмет не может быть пустым.")
-
-        title = title.strip()
-        if not title:
-            raise ValueError("Название ресурса не может быть пустым.")
-
-        if not validators.url(link):
-            raise ValueError("Некорректный формат URL.")
+        resource = validate_resource(subject_selected, type_selected_display, title, link)
 
         # Подтверждение введённых данных
         click.echo("\nВы добавляете ресурс со следующими данными:")
         click.echo(f"Предмет: {subject_selected}")
         click.echo(f"Тип: {type_selected_display}")
-        click.echo(f"Название: {title}")
-        click.echo(f"Ссылка: {link}")
+        click.echo(f"Название: {resource['title']}")
+        click.echo(f"Ссылка: {resource['link']}")
 
         confirm = click.confirm("Вы уверены, что хотите добавить этот ресурс?", default=True)
         if not confirm:
             click.echo("Добавление ресурса отменено.")
             sys.exit(0)
 
-        # Вызов скрипта add_resources.py с аргументами
-        subprocess.run([
-            sys.executable,
-            "add_resources.py",
-            "--subject", subject_selected,
-            "--type", type_selected_internal,  # Передаём английский тип
-            "--title", title,
-            "--link", link
-        ], check=True)
-        click.echo(f"Ресурс '{title}' успешно добавлен.")
-    except subprocess.CalledProcessError as e:
-        click.echo(f"Ошибка при добавлении ресурса: {e}")
+        # Запись в базу в том же процессе
+        from add_resources import add_resource
+        if add_resource(resource, update=update):
+            click.echo(f"Ресурс '{resource['title']}' успешно добавлен.")
+        else:
+            click.echo(f"Ресурс с этой ссылкой уже был в базе и обновлён: '{resource['title']}'.")
+        if notify:
+            from notifications import enqueue_notification
+            job_id = enqueue_notification(resource['normalized_link'])
+            click.echo(f"Рассылка {job_id} поставлена в очередь, её выполнит запущенный бот.")
     except ValueError as ve:
         click.echo(f"Ошибка ввода: {ve}")
     except Exception as e:
         click.echo(f"Произошла непредвиденная ошибка: {e}")
 
 
+def run_notifications(job_ids=None, batch_size=None):
+    import asyncio
+    from notifications import NOTIFY_BATCH_SIZE, run_pending
+
+    def report_progress(stats):
+        eta = f"{stats.eta:.0f} с" if stats.eta is not None else "—"
+        click.echo(
+            f"Рассылка {stats.job_id}: {stats.processed} из {stats.total} "
+            f"({stats.messages_per_second:.1f} сообщений/с, осталось ~{eta})"
+        )
+
+    results = asyncio.run(run_pending(job_ids, batch_size or NOTIFY_BATCH_SIZE, report_progress))
+    for stats in results:
+        click.echo(
+            f"Рассылка {stats.job_id} завершена: отправлено {stats.sent}, не доставлено {stats.failed} "
+            f"за {stats.elapsed:.1f} с."
+        )
+
+
+@cli.command()
+@click.option('--job', 'job_ids', type=int, multiple=True, help='Id рассылки для --standalone (по умолчанию все незавершённые).')
+@click.option('--resource-id', type=int, default=None, help='Создать рассылку о существующем ресурсе.')
+@click.option('--batch-size', type=click.IntRange(1), default=None, help='Подписчиков между сохранениями прогресса.')
+@click.option('--standalone', is_flag=True, help='Разослать из этого процесса (только при остановленном боте).')
+def notify(job_ids, resource_id, batch_size, standalone):
+    """
+    Ставит в очередь рассылку подписчикам о новом материале.
+
+    Рассылки выполняет запущенный бот через свой лимит отправки. С --standalone
+    незавершённые рассылки продолжаются в этом процессе с собственным лимитом —
+    только когда бот остановлен, иначе общий лимит Telegram будет превышен.
+    """
+    try:
+        if resource_id is not None:
+            from notifications import enqueue_notification
+            job_id = enqueue_notification(resource_id=resource_id)
+            job_ids = (*job_ids, job_id)
+            click.echo(f"Рассылка {job_id} поставлена в очередь.")
+        if not standalone:
+            click.echo("Рассылки выполнит запущенный бот; если он остановлен, используйте --standalone.")
+            return
+        run_notifications(list(job_ids) or None, batch_size)
+    except Exception as e:
+        click.echo(f"Ошибка при рассылке уведомлений: {e}")
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option(
+    '--format', 'input_format',
+    type=click.Choice(['csv', 'jsonl']),
+    default=None,
+    help='Формат файла (по умолчанию определяется по расширению).'
+)
+@click.option('--batch-size', type=click.IntRange(1), default=5000, show_default=True, help='Строк в одной транзакции.')
+def importresources(source, input_format, batch_size):
+    """
+    Массово импортирует учебные ресурсы из CSV или JSONL (поля subject, type, title, link).
+
+    Строки проверяются так же, как в addresource; ресурс с уже существующей
+    ссылкой обновляется, а не дублируется.
+    """
+    from add_resources import read_resource_rows, import_resources
+
+    if input_format is None:
+        extension = os.path.splitext(source.name)[1].lower()
+        input_format = 'jsonl' if extension in ('.jsonl', '.ndjson') else 'csv'
+    click.echo(f"Импорт ресурсов из {source.name} ({input_format})...")
+
+    def report_invalid(line_number, error):
+        click.echo(f"Строка {line_number} пропущена: {error}", err=True)
+
+    def report_batch(stats):
+        click.echo(f"Обработано {stats.read} строк, записано {stats.written} ({stats.rows_per_second:.0f} строк/с)")
+
+    try:
+        stats = import_resources(
+            read_resource_rows(source, input_format),
+            batch_size=batch_size,
+            on_invalid=report_invalid,
+            on_batch=report_batch
+        )
+    except Exception as e:
+        click.echo(f"Ошибка при импорте ресурсов: {e}")
+        sys.exit(1)
+    click.echo(
+        f"Импорт завершён: прочитано {stats.read}, записано {stats.written}, "
+        f"пропущено {stats.invalid} за {stats.elapsed:.1f} с ({stats.rows_per_second:.0f} строк/с)."
+    )
+
+
+@cli.command()
+@click.option('--users', type=click.IntRange(1), default=50, show_default=True, help='Число синтетических пользователей.')
+@click.option('--questions-per-user', type=click.IntRange(0), default=3, show_default=True, help='Вопросов к GigaChat от каждого пользователя.')
+@click.option('--updates', 'updates_path', type=click.Path(exists=True, dir_okay=False), default=None, help='JSONL с записанными обновлениями вместо синтетических.')
+@click.option('--rate', type=click.FloatRange(0), default=0.0, show_default=True, help='Обновлений в секунду (0 — без пауз).')
+@click.option('--concurrent-updates', type=click.IntRange(1), default=None, help='Сколько обновлений обрабатывать одновременно.')
+@click.option('--telegram-latency', type=click.FloatRange(0), default=0.0, show_default=True, help='Задержка поддельного Bot API, с.')
+@click.option('--telegram-flood-rate', type=click.FloatRange(0, 1), default=0.0, show_default=True, help='Доля запросов к Bot API, отклоняемых с 429 RetryAfter.')
+@click.option('--gigachat-latency', type=click.FloatRange(0), default=0.2, show_default=True, help='Средняя задержка поддельного GigaChat, с.')
+@click.option('--gigachat-jitter', type=click.FloatRange(0), default=0.05, show_default=True, help='Разброс задержки GigaChat, с.')
+@click.option('--gigachat-error-rate', type=click.FloatRange(0, 1), default=0.0, show_default=True, help='Доля запросов к GigaChat, завершающихся ошибкой 500.')
+@click.option('--streaming', is_flag=True, help='Потоковая выдача ответов GigaChat.')
+@click.option('--database-url', default=None, help='База для прогона (по умолчанию временный файл SQLite).')
+@click.option('--resources', type=click.IntRange(0), default=500, show_default=True, help='Сколько синтетических ресурсов добавить в базу.')
+@click.option('--seed', type=int, default=0, show_default=True, help='Зерно генератора сценариев и задержек.')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), default=None, help='Сохранить отчёт в JSON (например, как эталон).')
+@click.option('--baseline', type=click.File('r', encoding='utf-8'), default=None, help='Эталонный отчёт для сравнения.')
+@click.option('--tolerance', type=click.FloatRange(0), default=0.2, show_default=True, help='Допустимое ухудшение относительно эталона.')
+def benchmark(
+    users, questions_per_user, updates_path, rate, concurrent_updates, telegram_latency, telegram_flood_rate,
+    gigachat_latency, gigachat_jitter, gigachat_error_rate, streaming, database_url, resources, seed, output, baseline, tolerance
+):
+    """
+    Нагрузочный прогон обработчиков бота на поддельных Bot API и GigaChat.
+
+    Выводит пропускную способность и p50/p95/p99 по каждому обработчику. С --baseline
+    завершается с кодом 1, если результаты хуже эталона больше чем на --tolerance.
+    """
+    import json
+    import benchmark as bench
+
+    result = bench.run_benchmark(
+        updates=bench.load_updates(updates_path) if updates_path else None,
+        users=users,
+        questions_per_user=questions_per_user,
+        rate=rate,
+        concurrent_updates=concurrent_updates,
+        telegram_profile=bench.LatencyProfile(telegram_latency, error_rate=telegram_flood_rate, error_status=429, seed=seed),
+        gigachat_profile=bench.LatencyProfile(gigachat_latency, gigachat_jitter, gigachat_error_rate, seed=seed),
+        database_url=database_url,
+        resources=resources,
+        streaming=streaming,
+        seed=seed
+    )
+    click.echo(bench.format_report(result))
+    if output:
+        with open(output, 'w', encoding='utf-8') as target:
+            json.dump(result, target, ensure_ascii=False, indent=2)
+        click.echo(f"Отчёт сохранён в {output}")
+    if baseline:
+        regressions = bench.compare_with_baseline(result, json.load(baseline), tolerance)
+        if regressions:
+            click.echo("Обнаружены регрессии относительно эталона:", err=True)
+            for regression in regressions:
+                click.echo(f"  {regression}", err=True)
+            sys.exit(1)
+        click.echo("Регрессий относительно эталона нет.")
+
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -0,0 +1,261 @@
+import functools
+import logging
+import os
+import time
+import weakref
+
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+
+# Загрузка переменных окружения
+load_dotenv()
+# Эндпоинт /metrics слушает только локальный адрес; порт 0 отключает его
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+
+GIGACHAT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60)
+BREAKER_STATES = ('closed', 'open', 'half_open')
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+logger = logging.getLogger(__name__)
+
+# Движки, к которым уже подключены обработчики событий
+_instrumented_engines = weakref.WeakSet()
+
+HANDLER_LATENCY = Histogram(
+    'studyhomie_handler_duration_seconds',
+    'Время работы обработчика обновления Telegram',
+    ['handler']
+)
+HANDLER_ERRORS = Counter(
+    'studyhomie_handler_errors_total',
+    'Необработанные исключения в обработчиках',
+    ['handler']
+)
+UPDATES_IN_PROGRESS = Gauge(
+    'studyhomie_updates_in_progress',
+    'Обновления, которые сейчас обрабатываются'
+)
+GIGACHAT_LATENCY = Histogram(
+    'studyhomie_gigachat_request_duration_seconds',
+    'Время запроса к GigaChat API',
+    ['operation'],
+    buckets=GIGACHAT_BUCKETS
+)
+GIGACHAT_RESPONSES = Counter(
+    'studyhomie_gigachat_responses_total',
+    'Ответы GigaChat API по HTTP-статусу (error — сетевая ошибка, cancelled — таймаут или отмена)',
+    ['operation', 'status']
+)
+GIGACHAT_TOKENS = Counter(
+    'studyhomie_gigachat_tokens_total',
+    'Токены из поля usage ответов GigaChat',
+    ['kind']
+)
+GIGACHAT_RETRIES = Counter(
+    'studyhomie_gigachat_retries_total',
+    'Повторы запросов к GigaChat после сетевых ошибок, 429 и 5xx',
+    ['operation']
+)
+GIGACHAT_HEDGES = Counter(
+    'studyhomie_gigachat_hedges_total',
+    'Хеджированные запросы к GigaChat (fired — отправлены, won — ответили первыми)',
+    ['outcome']
+)
+GIGACHAT_BREAKER_STATE = Gauge(
+    'studyhomie_gigachat_breaker_state',
+    'Состояние размыкателя цепи GigaChat (1 у текущего состояния)',
+    ['state']
+)
+GIGACHAT_BREAKER_REJECTED = Counter(
+    'studyhomie_gigachat_breaker_rejected_total',
+    'Запросы к GigaChat, отклонённые разомкнутым размыкателем цепи'
+)
+DB_QUERY_LATENCY = Histogram(
+    'studyhomie_db_query_duration_seconds',
+    'Время выполнения SQL-запроса',
+    ['engine'],
+    buckets=DB_BUCKETS
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'studyhomie_db_pool_checkout_wait_seconds',
+    'Ожидание соединения из пула асинхронного движка',
+    buckets=DB_BUCKETS
+)
+# До первой смены состояния размыкатель замкнут
+GIGACHAT_BREAKER_STATE.labels('closed').set(1)
+
+
+class StateCollector:
+    """
+    Снимает показания счётчиков, которые и так ведут TokenManager, LLMScheduler,
+    AnswerCache, OutboundRateLimiter и ActivityBuffer, в момент запроса /metrics, ничего не добавляя на горячий путь.
+    """
+
+    def __init__(self):
+        self.token_manager = None
+        self.scheduler = None
+        self.answer_cache = None
+        self.rate_limiter = None
+        self.activity = None
+
+    def collect(self):
+        if self.token_manager is not None:
+            yield CounterMetricFamily(
+                'studyhomie_gigachat_token_refreshes',
+                'Получения нового Access Token GigaChat',
+                value=self.token_manager.refresh_count
+            )
+        if self.scheduler is not None:
+            stats = self.scheduler.stats()
+            yield GaugeMetricFamily('studyhomie_llm_queued', 'Запросы к GigaChat в очереди', value=stats['queue_depth'])
+            yield GaugeMetricFamily('studyhomie_llm_in_flight', 'Выполняющиеся запросы к GigaChat', value=stats['running'])
+            requests = CounterMetricFamily('studyhomie_llm_requests', 'Запросы к планировщику GigaChat', labels=['outcome'])
+            for outcome in ('admitted', 'shed', 'completed'):
+                requests.add_metric([outcome], stats[outcome])
+            yield requests
+        if self.answer_cache is not None:
+            stats = self.answer_cache.stats()
+            lookups = CounterMetricFamily('studyhomie_answer_cache_lookups', 'Обращения к кэшу ответов', labels=['result'])
+            for result in ('hits', 'misses', 'coalesced'):
+                lookups.add_metric([result], stats[result])
+            yield lookups
+            yield GaugeMetricFamily('studyhomie_answer_cache_entries', 'Записей в кэше ответов', value=stats['entries'])
+        if self.rate_limiter is not None:
+            stats = self.rate_limiter.stats()
+            yield GaugeMetricFamily(
+                'studyhomie_telegram_send_queued',
+                'Исходящие запросы к Bot API, ждущие лимита или повтора',
+                value=stats['queue_depth']
+            )
+            requests = CounterMetricFamily('studyhomie_telegram_requests', 'Исходящие запросы к Bot API', labels=['outcome'])
+            for outcome in ('sent', 'retries', 'failed'):
+                requests.add_metric([outcome], stats[outcome])
+            yield requests
+        if self.activity is not None:
+            stats = self.activity.stats()
+            yield GaugeMetricFamily(
+                'studyhomie_activity_pending',
+                'Пользователи с активностью, ещё не записанной в базу',
+                value=stats['pending']
+            )
+            yield CounterMetricFamily('studyhomie_activity_flushed_rows', 'Строк активности, записанных в базу', value=stats['flushed'])
+            yield CounterMetricFamily('studyhomie_activity_flush_errors', 'Неудачные записи активности', value=stats['flush_errors'])
+            rejected = CounterMetricFamily('studyhomie_quota_rejections', 'Вопросы, отклонённые дневной квотой', labels=['reason'])
+            for reason in ('questions', 'tokens'):
+                rejected.add_metric([reason], stats[f'rejected_{reason}'])
+            yield rejected
+
+
+state_collector = StateCollector()
+REGISTRY.register(state_collector)
+
+
+def watch(token_manager=None, scheduler=None, answer_cache=None, rate_limiter=None, activity=None):
+    """Подключает объекты, чьи счётчики отдаются на /metrics."""
+    if token_manager is not None:
+        state_collector.token_manager = token_manager
+    if scheduler is not None:
+        state_collector.scheduler = scheduler
+    if answer_cache is not None:
+        state_collector.answer_cache = answer_cache
+    if rate_limiter is not None:
+        state_collector.rate_limiter = rate_limiter
+    if activity is not None:
+        state_collector.activity = activity
+
+
+def timed_handler(callback):
+    """Оборачивает обработчик PTB замером времени; метки вычисляются один раз."""
+    name = callback.__name__
+    latency = HANDLER_LATENCY.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        UPDATES_IN_PROGRESS.inc()
+        started_at = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started_at)
+            UPDATES_IN_PROGRESS.dec()
+
+    return wrapper
+
+
+def instrument_handlers(application):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timed_handler(handler.callback)
+
+
+def observe_gigachat(operation, status, elapsed):
+    GIGACHAT_LATENCY.labels(operation).observe(elapsed)
+    GIGACHAT_RESPONSES.labels(operation, str(status)).inc()
+
+
+def record_token_usage(usage):
+    if not usage:
+        return
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        if usage.get(kind):
+            GIGACHAT_TOKENS.labels(kind[:-len('_tokens')]).inc(usage[kind])
+
+
+def record_retry(operation):
+    GIGACHAT_RETRIES.labels(operation).inc()
+
+
+def record_hedge(outcome):
+    GIGACHAT_HEDGES.labels(outcome).inc()
+
+
+def set_breaker_state(state):
+    for name in BREAKER_STATES:
+        GIGACHAT_BREAKER_STATE.labels(name).set(1 if name == state else 0)
+
+
+def record_breaker_rejection():
+    GIGACHAT_BREAKER_REJECTED.inc()
+
+
+def instrument_engine(engine, name):
+    """Замеряет время SQL-запросов движка (синхронного или AsyncEngine)."""
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    if sync_engine in _instrumented_engines:
+        return
+    _instrumented_engines.add(sync_engine)
+    latency = DB_QUERY_LATENCY.labels(name)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started_at = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        latency.observe(time.perf_counter() - context._metrics_started_at)
+
+    event.listen(sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def observe_checkout_wait(elapsed):
+    DB_POOL_CHECKOUT_WAIT.observe(elapsed)
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Запускает HTTP-сервер /metrics в фоновом потоке; возвращает его или None, если порт 0."""
+    if not port:
+        return None
+    try:
+        server, _ = start_http_server(port, addr=host)
+    except OSError as e:
+        logger.error(f"Не удалось запустить эндпоинт метрик на {host}:{port}: {e}")
+        return None
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
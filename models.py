@@ -1,22 +1,47 @@
 import os
+import time
+from contextlib import asynccontextmanager
 from sqlalchemy import (
     Column,
     Integer,
+    SmallInteger,
     BigInteger,
     String,
     JSON,
     create_engine,
     CheckConstraint,
+    Date,
     DateTime,
+    ForeignKey,
+    Index,
+    select,
     text
 )
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, lazyload
 from dotenv import load_dotenv
 
+import tracing
+
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# Настройки пула соединений асинхронного движка
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+
+# Асинхронные драйверы для синхронных URL из DATABASE_URL
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+}
+
 Base = declarative_base()
 
 
@@ -26,7 +51,9 @@ class User(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     telegram_id = Column(BigInteger, unique=True, nullable=False)
     username = Column(String(255))
-    subjects = Column(JSON)  # Список предметов в формате JSON
+    # Устаревший список предметов в JSON; источник истины — user_subjects,
+    # колонка поддерживается в актуальном состоянии для отката миграции
+    subjects = Column(JSON)
     created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     updated_at = Column(
         DateTime,
@@ -34,22 +61,186 @@ class User(Base):
         onupdate=text("CURRENT_TIMESTAMP")
     )
 
+    subscriptions = relationship(
+        'UserSubject',
+        cascade='all, delete-orphan',
+        lazy='selectin',
+        order_by='UserSubject.subject'
+    )
+
+    @property
+    def subject_names(self):
+        return [subscription.subject for subscription in self.subscriptions]
+
+    def set_subjects(self, subjects):
+        subjects = list(dict.fromkeys(subjects))
+        existing = {subscription.subject: subscription for subscription in self.subscriptions}
+        self.subscriptions = [existing.get(subject) or UserSubject(subject=subject) for subject in subjects]
+        self.subjects = subjects
+
+    @classmethod
+    def _subscribers_query(cls, subject, batch_size, after_id=None, limit=None):
+        # Сортировка и условие по user_subjects.user_id, чтобы обе обслуживал
+        # индекс ix_user_subjects_subject_user_id
+        query = (
+            select(cls)
+            .join(UserSubject, UserSubject.user_id == cls.id)
+            .where(UserSubject.subject == subject)
+            .order_by(UserSubject.user_id)
+            .options(lazyload(cls.subscriptions))
+            .execution_options(yield_per=batch_size)
+        )
+        if after_id is not None:
+            # Продолжение с места остановки по ключу, без OFFSET
+            query = query.where(UserSubject.user_id > after_id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    @classmethod
+    def iter_subscribers(cls, session, subject, batch_size=1000, after_id=None, limit=None):
+        """Потоково перебирает подписчиков предмета через серверный курсор (синхронная сессия)."""
+        yield from session.scalars(cls._subscribers_query(subject, batch_size, after_id, limit))
+
+    @classmethod
+    async def stream_subscribers(cls, session, subject, batch_size=1000, after_id=None, limit=None):
+        """Асинхронный аналог iter_subscribers для AsyncSession."""
+        result = await session.stream_scalars(cls._subscribers_query(subject, batch_size, after_id, limit))
+        async for user in result:
+            yield user
+
+
+class UserSubject(Base):
+    # Предмет хранится названием, а не subject_id: колонка входит в первичный ключ,
+    # и её пишет прежняя версия бота во время выката, так что перевод на справочник
+    # требует отдельного цикла expand/contract с двойной записью
+    __tablename__ = 'user_subjects'
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    subject = Column(String(255), primary_key=True)
+
+    __table_args__ = (
+        # Индекс для выборки подписчиков предмета
+        Index('ix_user_subjects_subject_user_id', 'subject', 'user_id'),
+    )
+
+
+# Ключ справочника: smallint, а в SQLite — INTEGER, иначе колонка не станет
+# синонимом rowid и не получит автоинкремент
+LOOKUP_ID = SmallInteger().with_variant(Integer, 'sqlite')
+
+
+class Subject(Base):
+    """Справочник предметов; ресурсы ссылаются на него smallint-ключом."""
+
+    __tablename__ = 'subjects'
+
+    id = Column(LOOKUP_ID, primary_key=True, autoincrement=True)
+    name = Column(String(255), unique=True, nullable=False)
+
+
+class ResourceType(Base):
+    """Справочник типов материалов (Статья, Видео, Туториал)."""
+
+    __tablename__ = 'resource_types'
+
+    id = Column(LOOKUP_ID, primary_key=True, autoincrement=True)
+    name = Column(String(50), unique=True, nullable=False)
+
+
+# Выражение полнотекстового индекса resources; запросы должны использовать его дословно,
+# иначе Postgres не применит индекс. Предмет и тип ищутся по справочникам (см. search.py)
+RESOURCE_SEARCH_VECTOR = "to_tsvector('russian', title)"
+
 
 class Resource(Base):
     __tablename__ = 'resources'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    subject = Column(String(255), nullable=False)
-    type = Column(String(50), nullable=False)
+    subject_id = Column(SmallInteger, ForeignKey('subjects.id'), nullable=False)
+    type_id = Column(SmallInteger, ForeignKey('resource_types.id'), nullable=False)
     title = Column(String(255), nullable=False)
     link = Column(String, nullable=False)
+    # Ссылка в каноническом виде (add_resources.normalize_link) для поиска дубликатов
+    normalized_link = Column(String)
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+
+    __table_args__ = (
+        Index('uq_resources_normalized_link', 'normalized_link', unique=True),
+        # Постраничный вывод /resources по ключу (subject_id, id): без фильтра по типу
+        # и с ним; тип хранится в индексе, чтобы фильтр не читал таблицу
+        Index('ix_resources_subject_page', 'subject_id', 'id', postgresql_include=['type_id']),
+        Index('ix_resources_subject_type_page', 'subject_id', 'type_id', 'id'),
+        # Индексы поиска есть только в Postgres (см. search.search_resources_db)
+        Index('ix_resources_search', text(RESOURCE_SEARCH_VECTOR), postgresql_using='gin').ddl_if(dialect='postgresql'),
+        Index(
+            'ix_resources_title_trgm',
+            'title',
+            postgresql_using='gin',
+            postgresql_ops={'title': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+    )
+
+    # Названия предмета и типа берутся из справочника в памяти, без JOIN
+    @property
+    def subject(self):
+        from registry import registry
+        return registry.subject_name(self.subject_id)
+
+    @property
+    def type(self):
+        from registry import registry
+        return registry.type_name(self.type_id)
+
+
+class UserActivity(Base):
+    """
+    Активность пользователя за сутки (UTC): последнее обращение, вопросы и токены GigaChat.
+
+    Пишется пачками из activity.ActivityBuffer. Ключ — telegram_id, а не users.id:
+    строка в users появляется только после выбора предметов.
+    """
+
+    __tablename__ = 'user_activity'
+
+    telegram_id = Column(BigInteger, primary_key=True)
+    day = Column(Date, primary_key=True)
+    last_seen = Column(DateTime, nullable=False)
+    questions = Column(Integer, nullable=False, server_default='0')
+    prompt_tokens = Column(Integer, nullable=False, server_default='0')
+    completion_tokens = Column(Integer, nullable=False, server_default='0')
+
+    __table_args__ = (
+        # Загрузка расхода за сегодня при запуске бота и выборки для аналитики
+        Index('ix_user_activity_day', 'day'),
+    )
+
+
+class NotificationJob(Base):
+    """Рассылка о новом материале подписчикам его предмета с точкой продолжения."""
+
+    __tablename__ = 'notification_jobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    resource_id = Column(Integer, ForeignKey('resources.id', ondelete='CASCADE'), nullable=False)
+    subject = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False, server_default='pending')
+    # users.id последнего обработанного подписчика; рассылка продолжается со следующего
+    last_user_id = Column(Integer, nullable=False, server_default='0')
+    sent = Column(Integer, nullable=False, server_default='0')
+    failed = Column(Integer, nullable=False, server_default='0')
     created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+    updated_at = Column(
+        DateTime,
+        server_default=text("CURRENT_TIMESTAMP"),
+        onupdate=text("CURRENT_TIMESTAMP")
+    )
+
+    resource = relationship('Resource')
 
     __table_args__ = (
-        CheckConstraint(
-            "type IN ('Статья', 'Видео', 'Туториал')",
-            name='check_resource_type'
-        ),
+        CheckConstraint("status IN ('pending', 'done')", name='check_notification_job_status'),
+        Index('ix_notification_jobs_status', 'status'),
     )
 
 
@@ -67,9 +258,88 @@ def get_session():
         session.close()
 
 
+def make_async_url(database_url):
+    url = make_url(database_url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def create_bot_async_engine(database_url=DATABASE_URL):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = make_async_url(database_url)
+    pool_options = {
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'pool_recycle': DB_POOL_RECYCLE,
+    }
+    # У SQLite свой пул без ограничений по размеру
+    if url.get_backend_name() != 'sqlite':
+        pool_options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT
+        )
+    return create_async_engine(url, **pool_options)
+
+
+# Асинхронный движок и фабрика сессий для обработчиков бота создаются при первом
+# обращении, чтобы CLI-команды не платили за импорт sqlalchemy.ext.asyncio
+_async_engine = None
+_async_sessionmaker = None
+
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_bot_async_engine()
+    return _async_engine
+
+
+def get_async_sessionmaker():
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        _async_sessionmaker = async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker
+
+
+def __getattr__(name):
+    # models.async_engine и models.AsyncSessionLocal остаются доступны как атрибуты модуля
+    if name == 'async_engine':
+        return get_async_engine()
+    if name == 'AsyncSessionLocal':
+        return get_async_sessionmaker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Необязательный приёмник времени ожидания соединения из пула (устанавливает metrics)
+checkout_wait_observer = None
+
+
+# Асинхронный аналог get_session для использования в обработчиках
+@asynccontextmanager
+async def get_async_session():
+    async with get_async_sessionmaker()() as session:
+        if checkout_wait_observer is not None:
+            # Соединение берётся сразу, чтобы замерить ожидание пула отдельно от запросов
+            started_at = time.perf_counter()
+            with tracing.span('db.checkout'):
+                await session.connection()
+            checkout_wait_observer(time.perf_counter() - started_at)
+        yield session
+
+
 # Инициализация базы данных и создание таблиц
 def init_db():
+    from registry import DEFAULT_RESOURCE_TYPES, DEFAULT_SUBJECTS
+
     Base.metadata.create_all(engine)
+    # Заполняем пустые справочники значениями по умолчанию; id выдаются по порядку
+    with SessionLocal() as session:
+        if session.scalar(select(Subject.id).limit(1)) is None:
+            session.add_all([Subject(name=name) for name in DEFAULT_SUBJECTS])
+        if session.scalar(select(ResourceType.id).limit(1)) is None:
+            session.add_all([ResourceType(name=name) for name in DEFAULT_RESOURCE_TYPES])
+        session.commit()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import selectinload
+from telegram import MessageEntity
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, ChatMigrated, Forbidden, RetryAfter, TelegramError
+from telegram.helpers import escape_markdown
+
+from models import NotificationJob, Resource, SessionLocal, User, UserSubject, get_async_engine, get_async_session
+
+# Загрузка переменных окружения
+load_dotenv()
+TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
+# Сколько подписчиков обрабатывать между сохранениями точки продолжения
+NOTIFY_BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', '100'))
+# Как часто запущенный бот ищет незавершённые рассылки (в секундах); 0 — бот рассылки не выполняет
+NOTIFY_POLL_INTERVAL = float(os.getenv('NOTIFY_POLL_INTERVAL', '10'))
+# Повторы пачки при временных ошибках Telegram (сеть, таймаут, RetryAfter) и пауза перед первым из них
+NOTIFY_MAX_RETRIES = int(os.getenv('NOTIFY_MAX_RETRIES', '5'))
+NOTIFY_RETRY_DELAY = float(os.getenv('NOTIFY_RETRY_DELAY', '1'))
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationStats:
+    __slots__ = ('job_id', 'total', 'sent', 'failed', 'started_at')
+
+    def __init__(self, job_id, total):
+        self.job_id = job_id
+        self.total = total  # подписчиков осталось на момент запуска
+        self.sent = 0
+        self.failed = 0
+        self.started_at = time.perf_counter()
+
+    @property
+    def processed(self):
+        return self.sent + self.failed
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    @property
+    def messages_per_second(self):
+        return self.processed / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Оценка оставшегося времени в секундах или None, пока скорость неизвестна."""
+        rate = self.messages_per_second
+        if not rate:
+            return None
+        return max(self.total - self.processed, 0) / rate
+
+
+def format_notification(resource):
+    """Текст уведомления в MarkdownV2; названия и ссылка экранируются, иначе Telegram отклонит сообщение."""
+    subject = escape_markdown(resource.subject, version=2)
+    resource_type = escape_markdown(resource.type, version=2)
+    title = escape_markdown(resource.title, version=2)
+    link = escape_markdown(resource.link, version=2, entity_type=MessageEntity.TEXT_LINK)
+    return f"Новый материал по предмету {subject}\\!\n\n*{resource_type}*\n[{title}]({link})"
+
+
+def enqueue_notification(normalized_link=None, resource_id=None, session_factory=SessionLocal):
+    """Создаёт рассылку о ресурсе (по нормализованной ссылке или id); возвращает id задания."""
+    with session_factory() as session:
+        if resource_id is not None:
+            resource = session.get(Resource, resource_id)
+        else:
+            resource = session.scalar(select(Resource).where(Resource.normalized_link == normalized_link))
+        if resource is None:
+            raise ValueError("Ресурс не найден.")
+        job = NotificationJob(resource_id=resource.id, subject=resource.subject)
+        session.add(job)
+        session.commit()
+        return job.id
+
+
+def create_bot():
+    """
+    Отдельный бот для рассылки из CLI при остановленном боте.
+
+    У него свой OutboundRateLimiter с полным лимитом Telegram, поэтому вместе
+    с запущенным ботом он превысил бы общий лимит; рассылки при работающем боте
+    выполняет NotificationRunner через лимитер самого бота.
+    """
+    from telegram.ext import ExtBot
+    from rate_limiter import OutboundRateLimiter
+
+    bot_kwargs = {'base_url': TELEGRAM_API_BASE_URL} if TELEGRAM_API_BASE_URL else {}
+    return ExtBot(TELEGRAM_BOT_TOKEN, rate_limiter=OutboundRateLimiter(), **bot_kwargs)
+
+
+async def send_batch(bot, chat_ids, text, max_retries=NOTIFY_MAX_RETRIES, retry_delay=NOTIFY_RETRY_DELAY):
+    """
+    Отправляет сообщение пачке чатов; возвращает (отправлено, не доставлено).
+
+    Не доставленными считаются только чаты, отправка в которые не удастся и при
+    повторе (бот заблокирован, чат удалён). Временные ошибки повторяются для
+    оставшихся чатов с растущей паузой; если они не проходят и после max_retries
+    повторов, ошибка пробрасывается, и точка продолжения не сдвигается за пачку.
+    """
+    from rate_limiter import BULK
+
+    sent = failed = 0
+    pending = list(chat_ids)
+    for attempt in range(max_retries + 1):
+        results = await asyncio.gather(
+            *(
+                bot.send_message(chat_id, text, parse_mode=ParseMode.MARKDOWN_V2, rate_limit_args=BULK)
+                for chat_id in pending
+            ),
+            return_exceptions=True
+        )
+        retry = []
+        for chat_id, result in zip(pending, results):
+            if not isinstance(result, BaseException):
+                sent += 1
+            elif isinstance(result, (Forbidden, BadRequest, ChatMigrated)):
+                # Пользователь заблокировал бота или чат удалён — повторять бессмысленно
+                logger.info(f"Уведомление в чат {chat_id} не доставлено: {result}")
+                failed += 1
+            elif isinstance(result, TelegramError):
+                retry.append((chat_id, result))
+            else:
+                raise result
+        if not retry:
+            break
+        pending = [chat_id for chat_id, _ in retry]
+        error = retry[0][1]
+        if attempt == max_retries:
+            raise error
+        delay = retry_delay * 2 ** attempt
+        if isinstance(error, RetryAfter):
+            from streaming import retry_after_seconds
+            delay = max(delay, retry_after_seconds(error))
+        logger.warning(
+            f"Временная ошибка отправки уведомлений в {len(pending)} чатов ({error}), "
+            f"повтор {attempt + 1} из {max_retries} через {delay:.0f} с"
+        )
+        await asyncio.sleep(delay)
+    return sent, failed
+
+
+async def run_job(bot, job_id, batch_size=NOTIFY_BATCH_SIZE, on_progress=None):
+    """
+    Выполняет рассылку с места последней остановки.
+
+    Подписчики читаются пачками по возрастанию users.id серверным курсором
+    с продолжением по ключу после last_user_id; после каждой пачки точка
+    продолжения сохраняется, поэтому после падения повторно может уйти не больше
+    одной пачки. on_progress(NotificationStats) вызывается после каждой пачки.
+    """
+    async with get_async_session() as session:
+        job = await session.get(NotificationJob, job_id, options=[selectinload(NotificationJob.resource)])
+        if job is None:
+            raise ValueError(f"Рассылка {job_id} не найдена.")
+        if job.status == 'done':
+            return NotificationStats(job_id, 0)
+        total = await session.scalar(
+            select(func.count())
+            .select_from(UserSubject)
+            .where(UserSubject.subject == job.subject, UserSubject.user_id > job.last_user_id)
+        )
+        text = format_notification(job.resource)
+        subject, last_user_id = job.subject, job.last_user_id
+
+    stats = NotificationStats(job_id, total)
+    logger.info(f"Рассылка {job_id} по предмету {subject}: осталось {total} подписчиков")
+
+    async def flush(batch):
+        sent, failed = await send_batch(bot, [telegram_id for _, telegram_id in batch], text)
+        stats.sent += sent
+        stats.failed += failed
+        async with get_async_session() as checkpoint:
+            await checkpoint.execute(
+                update(NotificationJob)
+                .where(NotificationJob.id == job_id)
+                .values(
+                    last_user_id=batch[-1][0],
+                    sent=NotificationJob.sent + sent,
+                    failed=NotificationJob.failed + failed
+                )
+            )
+            await checkpoint.commit()
+        if on_progress is not None:
+            on_progress(stats)
+
+    while True:
+        # Курсор закрывается до отправки: долгая рассылка не держит транзакцию чтения,
+        # которая в SQLite блокировала бы запись точки продолжения
+        async with get_async_session() as reader:
+            batch = [
+                (user.id, user.telegram_id)
+                async for user in User.stream_subscribers(reader, subject, batch_size, last_user_id, batch_size)
+            ]
+        if not batch:
+            break
+        await flush(batch)
+        last_user_id = batch[-1][0]
+
+    async with get_async_session() as session:
+        await session.execute(update(NotificationJob).where(NotificationJob.id == job_id).values(status='done'))
+        await session.commit()
+    logger.info(
+        f"Рассылка {job_id} завершена: отправлено {stats.sent}, не доставлено {stats.failed} "
+        f"за {stats.elapsed:.1f} с ({stats.messages_per_second:.1f} сообщений/с)"
+    )
+    return stats
+
+
+async def pending_job_ids():
+    async with get_async_session() as session:
+        return list(await session.scalars(
+            select(NotificationJob.id).where(NotificationJob.status == 'pending').order_by(NotificationJob.id)
+        ))
+
+
+async def run_jobs(bot, job_ids=None, batch_size=NOTIFY_BATCH_SIZE, on_progress=None):
+    """Выполняет указанные или все незавершённые рассылки по порядку создания через bot; возвращает их статистику."""
+    if job_ids is None:
+        job_ids = await pending_job_ids()
+    return [await run_job(bot, job_id, batch_size, on_progress) for job_id in job_ids]
+
+
+async def run_pending(job_ids=None, batch_size=NOTIFY_BATCH_SIZE, on_progress=None, bot=None):
+    """Выполняет рассылки отдельным ботом (create_bot) и закрывает соединения с базой по окончании."""
+    bot = bot or create_bot()
+    try:
+        async with bot:
+            return await run_jobs(bot, job_ids, batch_size, on_progress)
+    finally:
+        await get_async_engine().dispose()
+
+
+class NotificationRunner:
+    """
+    Выполняет рассылки в запущенном боте.
+
+    Раз в poll_interval секунд проверяет незавершённые задания и отправляет их
+    через bot приложения: рассылка идёт в полосе BULK того же OutboundRateLimiter,
+    что и ответы пользователям, поэтому общий лимит Telegram не превышается,
+    а ответы обгоняют рассылку. Задание, прерванное ошибкой или остановкой бота,
+    продолжается со следующей проверки с сохранённой точки.
+    """
+
+    def __init__(self, bot, poll_interval=NOTIFY_POLL_INTERVAL, batch_size=NOTIFY_BATCH_SIZE):
+        self.bot = bot
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await run_jobs(self.bot, batch_size=self.batch_size)
+            except Exception as e:
+                logger.error(f"Ошибка при выполнении рассылки: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self.poll_interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+# Период снятия стеков (в секундах)
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+# Длительность профиля по умолчанию (в секундах) и верхняя граница
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', '30'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+# Куда сохранять профили
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """
+    Семплирующий профайлер работающего процесса.
+
+    Фоновый поток каждые interval секунд снимает стеки всех остальных потоков
+    (sys._current_frames) и считает одинаковые стеки. Результат сохраняется
+    в «свёрнутом» формате (стек через «;» и число попаданий), который понимают
+    flamegraph.pl, speedscope и inferno. Сам бот не останавливается; пока
+    профиль не снимается, накладных расходов нет.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, output_dir=PROFILE_DIR):
+        self.interval = interval
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._thread = None
+        self.profiles = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _sample(self, seconds):
+        own_thread = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[';'.join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(self.interval)
+        return stacks, samples
+
+    def profile(self, seconds=PROFILE_SECONDS):
+        """Снимает профиль в текущем потоке и возвращает путь к файлу .folded."""
+        seconds = min(max(seconds, self.interval), PROFILE_MAX_SECONDS)
+        started_at = time.strftime('%Y%m%d-%H%M%S')
+        stacks, samples = self._sample(seconds)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.profiles += 1
+        path = os.path.join(self.output_dir, f'profile-{os.getpid()}-{started_at}-{self.profiles}.folded')
+        with open(path, 'w', encoding='utf-8') as output:
+            for stack, count in stacks.most_common():
+                output.write(f'{stack} {count}\n')
+        logger.info(f"Профиль сохранён в {path}: {samples} снимков за {seconds:.0f} с, {len(stacks)} различных стеков")
+        return path
+
+    async def run(self, seconds=PROFILE_SECONDS):
+        """
+        Снимает профиль в отдельном потоке, не блокируя цикл событий; возвращает путь к файлу.
+
+        Одновременно снимается только один профиль, повторный вызов бросает RuntimeError.
+        """
+        with self._lock:
+            if self.running:
+                raise RuntimeError("Профиль уже снимается.")
+            loop = asyncio.get_running_loop()
+            done = loop.create_future()
+
+            def target():
+                try:
+                    result = self.profile(seconds)
+                except BaseException as e:
+                    loop.call_soon_threadsafe(_set_exception, done, e)
+                else:
+                    loop.call_soon_threadsafe(_set_result, done, result)
+
+            self._thread = threading.Thread(target=target, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return await done
+
+    def install_signal_handler(self, signum=getattr(signal, 'SIGUSR2', None), seconds=PROFILE_SECONDS):
+        """
+        По сигналу (по умолчанию SIGUSR2: kill -USR2 <pid>) снимает профиль на seconds секунд.
+
+        Возвращает False, если платформа не поддерживает сигналы в цикле событий.
+        """
+        if signum is None:
+            return False
+        loop = asyncio.get_running_loop()
+
+        def on_signal():
+            if self.running:
+                logger.warning("Профиль уже снимается, сигнал пропущен")
+                return
+            logger.info(f"Получен сигнал {signum}: снимаю профиль на {seconds:.0f} с")
+            task = loop.create_task(self.run(seconds))
+            task.add_done_callback(_log_failure)
+
+        try:
+            loop.add_signal_handler(signum, on_signal)
+        except (NotImplementedError, RuntimeError, ValueError):
+            return False
+        return True
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Ошибка при снятии профиля: {task.exception()}")
+
+
+# Общий профайлер процесса
+profiler = SamplingProfiler()
@@ -0,0 +1,247 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import tracing
+from streaming import retry_after_seconds
+
+# Загрузка переменных окружения
+load_dotenv()
+# Глобальный лимит исходящих сообщений бота (в секунду); 0 отключает ограничение
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_GLOBAL_BURST = int(os.getenv('TELEGRAM_GLOBAL_BURST', '30'))
+# Лимиты на один чат: личный — около сообщения в секунду, группа — 20 в минуту; 0 отключает
+TELEGRAM_PRIVATE_CHAT_RATE = float(os.getenv('TELEGRAM_PRIVATE_CHAT_RATE', '1'))
+TELEGRAM_GROUP_CHAT_RATE = float(os.getenv('TELEGRAM_GROUP_CHAT_RATE', str(20 / 60)))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+# Сколько раз повторять запрос после RetryAfter и сколько максимум готовы ждать (в секундах)
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))
+TELEGRAM_MAX_RETRY_AFTER = float(os.getenv('TELEGRAM_MAX_RETRY_AFTER', '60'))
+TELEGRAM_MAX_TRACKED_CHATS = int(os.getenv('TELEGRAM_MAX_TRACKED_CHATS', '10000'))
+
+# Полосы приоритета: чем меньше число, тем раньше запрос получит токен
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+# Массовые рассылки уступают ответам пользователям: bot.send_message(..., rate_limit_args=BULK)
+BULK = {'priority': PRIORITY_BULK}
+
+logger = logging.getLogger(__name__)
+
+
+class _TokenBucket:
+    """Ведро токенов; take() резервирует токен и возвращает, сколько ждать до него."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = now
+
+    def _refill(self, now):
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def delay(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        # Токены могут уйти в минус: так следующие запросы чата выстраиваются в очередь по времени
+        wait = self.delay(now)
+        self.tokens -= 1
+        return wait
+
+    def pause(self, until):
+        # После RetryAfter до момента until токенов нет, а в until доступен ровно один — для повтора
+        self.updated_at = max(self.updated_at, until)
+        self.tokens = 1.0
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """
+    Ограничитель исходящих запросов бота к Bot API для ExtBot.
+
+    Через него проходят все вызовы бота во всех обработчиках (reply_text,
+    edit_message_text, send_message и т. д.). Запросы с chat_id сначала ждут
+    своей очереди в ведре чата, затем — глобального токена; глобальные токены
+    выдаются по полосам приоритета, поэтому ответы пользователям обгоняют
+    массовые рассылки. На RetryAfter отправка в этот чат и глобальная выдача
+    приостанавливаются на указанное Telegram время, после чего запрос
+    повторяется. Запросы без chat_id (ответы на callback и inline-запросы)
+    не ограничиваются, но RetryAfter для них тоже обрабатывается.
+
+    Параметры отдельного вызова передаются через rate_limit_args: число —
+    приоритет, словарь — {'priority': ..., 'retries': ...}.
+    """
+
+    def __init__(
+        self,
+        global_rate=TELEGRAM_GLOBAL_RATE,
+        global_burst=TELEGRAM_GLOBAL_BURST,
+        private_chat_rate=TELEGRAM_PRIVATE_CHAT_RATE,
+        group_chat_rate=TELEGRAM_GROUP_CHAT_RATE,
+        chat_burst=TELEGRAM_CHAT_BURST,
+        max_retries=TELEGRAM_MAX_RETRIES,
+        max_retry_after=TELEGRAM_MAX_RETRY_AFTER,
+        max_tracked_chats=TELEGRAM_MAX_TRACKED_CHATS
+    ):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.max_tracked_chats = max_tracked_chats
+        self._global = None
+        self._chats = OrderedDict()
+        self._heap = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._dispatcher = None
+        self._waiting = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    @property
+    def queue_depth(self):
+        """Сколько запросов сейчас ждут лимита чата, глобального токена или повтора после RetryAfter."""
+        return self._waiting
+
+    def stats(self):
+        return {
+            'queue_depth': self._waiting,
+            'sent': self.sent,
+            'retries': self.retries,
+            'failed': self.failed,
+        }
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, future in self._heap:
+            if not future.done():
+                future.cancel()
+        self._heap.clear()
+
+    @staticmethod
+    def _options(rate_limit_args):
+        if isinstance(rate_limit_args, int):
+            return rate_limit_args, None
+        if isinstance(rate_limit_args, dict):
+            return rate_limit_args.get('priority', PRIORITY_INTERACTIVE), rate_limit_args.get('retries')
+        return PRIORITY_INTERACTIVE, None
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id — группы и каналы, у них лимит строже
+            rate = self.group_chat_rate if str(chat_id).startswith(('-', '@')) else self.private_chat_rate
+            if rate <= 0:
+                return None
+            bucket = self._chats[chat_id] = _TokenBucket(rate, self.chat_burst, now)
+            while len(self._chats) > self.max_tracked_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat_id, priority):
+        loop = asyncio.get_running_loop()
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id, loop.time())
+            if bucket is not None:
+                wait = bucket.take(loop.time())
+                if wait > 0:
+                    await asyncio.sleep(wait)
+        now = loop.time()
+        if self.global_rate > 0 and self._global is None:
+            self._global = _TokenBucket(self.global_rate, self.global_burst, now)
+        if not self._heap and now >= self._paused_until:
+            if self.global_rate <= 0:
+                return
+            if self._global.delay(now) == 0:
+                self._global.take(now)
+                return
+        future = loop.create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self._heap:
+            now = loop.time()
+            wait = self._paused_until - now
+            if self.global_rate > 0:
+                wait = max(wait, self._global.delay(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            if self.global_rate > 0:
+                self._global.take(now)
+            future.set_result(None)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority, max_retries = self._options(rate_limit_args)
+        if max_retries is None:
+            max_retries = self.max_retries
+        chat_id = data.get('chat_id')
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                self._waiting += 1
+                try:
+                    with tracing.span('telegram.rate_limit'):
+                        await self._acquire(chat_id, priority)
+                finally:
+                    self._waiting -= 1
+            try:
+                with tracing.span(f'telegram.{endpoint}', attempt=attempt):
+                    result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                if attempt >= max_retries or delay > self.max_retry_after:
+                    self.failed += 1
+                    logger.error(f"Запрос {endpoint} отклонён Telegram (RetryAfter {delay} с), повторов больше не будет")
+                    raise
+                attempt += 1
+                self.retries += 1
+                until = loop.time() + delay
+                # Неизвестно, упёрлись мы в лимит чата или бота, поэтому притормаживаем оба
+                self._paused_until = max(self._paused_until, until)
+                if chat_id is not None:
+                    bucket = self._chat_bucket(chat_id, loop.time())
+                    if bucket is not None:
+                        bucket.pause(until)
+                logger.warning(f"RetryAfter {delay} с для {endpoint}, повтор {attempt} из {max_retries}")
+                self._waiting += 1
+                try:
+                    with tracing.span('telegram.retry_after', delay=delay):
+                        await asyncio.sleep(delay)
+                finally:
+                    self._waiting -= 1
+                continue
+            self.sent += 1
+            return result
+
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Начальное содержимое справочников; порядок задаёт id и порядок кнопок в боте
+DEFAULT_SUBJECTS = (
+    'Математика',
+    'Физика',
+    'Химия',
+    'Биология',
+    'История',
+    'Литература',
+    'Информатика',
+    'География',
+    'Английский язык',
+    'Русский язык'
+)
+DEFAULT_RESOURCE_TYPES = ('Статья', 'Видео', 'Туториал')
+# Не чаще чем раз в столько секунд перечитывать справочник из цикла событий
+RELOAD_INTERVAL = 5.0
+
+
+class Registry:
+    """
+    Справочники предметов и типов материалов (таблицы subjects и resource_types).
+
+    Загружается один раз при запуске бота или CLI-команды и дальше читается
+    из памяти. До загрузки содержит значения по умолчанию — те же, которыми
+    заполняются таблицы. Неизвестный id (справочник пополнили в другом
+    процессе) приводит к перезагрузке: в CLI и рабочих потоках сразу, а в цикле
+    событий — в фоновом потоке, пока вызывающий получает название-заглушку.
+    """
+
+    def __init__(self, subjects=DEFAULT_SUBJECTS, resource_types=DEFAULT_RESOURCE_TYPES):
+        self._lock = threading.Lock()
+        self._reload_task = None
+        self._reload_requested_at = None
+        self.loaded = False
+        self._set(list(enumerate(subjects, start=1)), list(enumerate(resource_types, start=1)))
+
+    def _set(self, subjects, resource_types):
+        # Сначала строятся все словари, затем подменяются атрибуты: читатели в других
+        # потоках видят либо старый, либо новый справочник
+        subject_names = dict(subjects)
+        type_names = dict(resource_types)
+        self.subjects = tuple(subject_names.values())
+        self.resource_types = tuple(type_names.values())
+        self.subject_ids = {name: subject_id for subject_id, name in subject_names.items()}
+        self.type_ids = {name: type_id for type_id, name in type_names.items()}
+        self.subject_names = subject_names
+        self.type_names = type_names
+
+    def load(self, session_factory=None):
+        from sqlalchemy import select
+        from models import ResourceType, SessionLocal, Subject
+
+        with self._lock, (session_factory or SessionLocal)() as session:
+            subjects = session.execute(select(Subject.id, Subject.name).order_by(Subject.id)).all()
+            resource_types = session.execute(select(ResourceType.id, ResourceType.name).order_by(ResourceType.id)).all()
+            self._set([tuple(row) for row in subjects], [tuple(row) for row in resource_types])
+            self.loaded = True
+        logger.info(f"Справочники загружены: {len(self.subjects)} предметов, {len(self.resource_types)} типов")
+        return self
+
+    def _reload(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.load()
+            return
+        # Синхронный запрос к базе остановил бы все обработчики бота
+        now = time.monotonic()
+        if self._reload_task is not None and not self._reload_task.done():
+            return
+        if self._reload_requested_at is not None and now - self._reload_requested_at < RELOAD_INTERVAL:
+            return
+        self._reload_requested_at = now
+        self._reload_task = loop.create_task(asyncio.to_thread(self.load))
+        self._reload_task.add_done_callback(_log_reload_failure)
+
+    def subject_name(self, subject_id):
+        if subject_id not in self.subject_names:
+            self._reload()
+        return self.subject_names.get(subject_id, f'Предмет {subject_id}')
+
+    def type_name(self, type_id):
+        if type_id not in self.type_names:
+            self._reload()
+        return self.type_names.get(type_id, f'Тип {type_id}')
+
+    def subject_id(self, name):
+        subject_id = self.subject_ids.get(name)
+        if subject_id is None:
+            raise ValueError(f"Неизвестный предмет: {name}")
+        return subject_id
+
+    def type_id(self, name):
+        type_id = self.type_ids.get(name)
+        if type_id is None:
+            raise ValueError(f"Неизвестный тип ресурса: {name}")
+        return type_id
+
+    def matching_subjects(self, prefix, whole_word=False):
+        """
+        Id предметов, в названии которых есть слово, начинающееся с prefix (без учёта
+        регистра); при whole_word — слово, совпадающее с prefix целиком.
+        """
+        return [subject_id for subject_id, name in self.subject_names.items() if _has_word(name, prefix, whole_word)]
+
+    def matching_types(self, prefix, whole_word=False):
+        return [type_id for type_id, name in self.type_names.items() if _has_word(name, prefix, whole_word)]
+
+
+def _log_reload_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Ошибка при перезагрузке справочников: {task.exception()}")
+
+
+def _has_word(name, prefix, whole_word):
+    words = name.lower().replace('ё', 'е').split()
+    if whole_word:
+        return prefix in words
+    return any(word.startswith(prefix) for word in words)
+
+
+# Общий экземпляр для бота и CLI
+registry = Registry()
+
+
+def get_registry():
+    """Возвращает общий справочник, загружая его из базы при первом обращении."""
+    if not registry.loaded:
+        registry.load()
+    return registry
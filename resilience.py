@@ -0,0 +1,141 @@
+import bisect
+import logging
+import random
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи с учётом задержек.
+
+    Хранит исходы последних window вызовов. Когда их набралось хотя бы
+    min_calls и доля ошибок достигает failure_rate либо доля медленных (дольше
+    slow_call секунд) вызовов — slow_rate, цепь размыкается: allow() возвращает
+    False open_duration секунд. Затем пропускается один пробный вызов
+    (полуоткрытое состояние): успех замыкает цепь, ошибка снова размыкает.
+    on_change(state) вызывается при каждой смене состояния.
+    """
+
+    def __init__(
+        self,
+        window=20,
+        min_calls=10,
+        failure_rate=0.5,
+        slow_call=0.0,
+        slow_rate=1.0,
+        open_duration=30.0,
+        on_change=None,
+        clock=time.monotonic
+    ):
+        self.enabled = window > 0
+        self.min_calls = max(min_calls, 1)
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_duration = open_duration
+        self.on_change = on_change
+        self._clock = clock
+        self._outcomes = deque(maxlen=max(window, 1))  # (ошибка, медленный)
+        self._failures = 0
+        self._slow = 0
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        self.rejected = 0
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        logger.warning(f"Размыкатель цепи: {self.state} -> {state}")
+        self.state = state
+        if self.on_change is not None:
+            self.on_change(state)
+
+    def _reset_window(self):
+        self._outcomes.clear()
+        self._failures = 0
+        self._slow = 0
+
+    def allow(self):
+        """Можно ли выполнять вызов сейчас; отказ учитывается в rejected."""
+        if not self.enabled or self.state == CLOSED:
+            return True
+        now = self._clock()
+        if self.state == OPEN and now - self._opened_at >= self.open_duration:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            # Пробный вызов один; если он потерялся (отменён), через open_duration пускаем следующий
+            if self._probe_started_at is None or now - self._probe_started_at >= self.open_duration:
+                self._probe_started_at = now
+                return True
+        self.rejected += 1
+        return False
+
+    def record(self, failed, elapsed):
+        if not self.enabled:
+            return
+        slow = bool(self.slow_call) and elapsed >= self.slow_call
+        if self.state == HALF_OPEN:
+            self._probe_started_at = None
+            if failed or slow:
+                self._open()
+            else:
+                self._reset_window()
+                self._set_state(CLOSED)
+            return
+        if self.state == OPEN:
+            # Запоздавший ответ вызова, начатого до размыкания
+            return
+        if len(self._outcomes) == self._outcomes.maxlen:
+            old_failed, old_slow = self._outcomes[0]
+            self._failures -= old_failed
+            self._slow -= old_slow
+        self._outcomes.append((failed, slow))
+        self._failures += failed
+        self._slow += slow
+        calls = len(self._outcomes)
+        if calls >= self.min_calls and (
+            self._failures / calls >= self.failure_rate or self._slow / calls >= self.slow_rate
+        ):
+            self._open()
+
+    def _open(self):
+        self._opened_at = self._clock()
+        self._probe_started_at = None
+        self._reset_window()
+        self._set_state(OPEN)
+
+
+class LatencyWindow:
+    """Скользящее окно задержек успешных вызовов для оценки перцентиля."""
+
+    def __init__(self, size=200):
+        self._values = deque(maxlen=max(size, 1))
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def observe(self, elapsed):
+        if len(self._values) == self._values.maxlen:
+            del self._sorted[bisect.bisect_left(self._sorted, self._values[0])]
+        self._values.append(elapsed)
+        bisect.insort(self._sorted, elapsed)
+
+    def percentile(self, percent):
+        if not self._sorted:
+            return None
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * percent / 100))
+        return self._sorted[index]
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Экспоненциальная пауза с полным джиттером перед повтором номер attempt (с нуля)."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
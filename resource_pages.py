@@ -0,0 +1,115 @@
+import os
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from sqlalchemy import select, tuple_
+
+from models import Resource
+from registry import registry
+
+# Загрузка переменных окружения
+load_dotenv()
+# Сколько материалов на одной странице /resources
+RESOURCES_PAGE_SIZE = int(os.getenv('RESOURCES_PAGE_SIZE', '8'))
+# Сколько отрисованных страниц держать в памяти
+RESOURCES_PAGE_CACHE_SIZE = int(os.getenv('RESOURCES_PAGE_CACHE_SIZE', '2048'))
+
+# Направления курсора: страница после ключа или перед ним
+AFTER = '>'
+BEFORE = '<'
+
+
+class PageEntry:
+    __slots__ = ('id', 'subject_id', 'subject', 'type', 'title', 'link')
+
+    def __init__(self, id, subject_id, subject, type, title, link):
+        self.id = id
+        self.subject_id = subject_id  # нужен для курсора следующей страницы
+        self.subject = subject
+        self.type = type
+        self.title = title
+        self.link = link
+
+
+class ResourcePage:
+    __slots__ = ('entries', 'has_prev', 'has_next')
+
+    def __init__(self, entries, has_prev, has_next):
+        self.entries = entries
+        self.has_prev = has_prev
+        self.has_next = has_next
+
+
+async def fetch_page(session, subject_ids, type_id=None, direction=AFTER, key=None, limit=RESOURCES_PAGE_SIZE):
+    """
+    Одна страница материалов по предметам в порядке (subject_id, id).
+
+    key — ключ (subject_id, id), после (AFTER) или перед (BEFORE) которым начинается
+    страница; None — первая страница. Запрашивается на строку больше страницы,
+    чтобы без COUNT узнать, есть ли материалы дальше в этом направлении.
+    Запрос обслуживается индексом ix_resources_subject_page или, с фильтром
+    по типу, ix_resources_subject_type_page; названия предметов и типов
+    подставляются из справочника без JOIN.
+    """
+    statement = select(Resource.id, Resource.subject_id, Resource.type_id, Resource.title, Resource.link).where(
+        Resource.subject_id.in_(subject_ids)
+    )
+    if type_id is not None:
+        statement = statement.where(Resource.type_id == type_id)
+    position = tuple_(Resource.subject_id, Resource.id)
+    if direction == BEFORE:
+        if key is not None:
+            statement = statement.where(position < tuple_(*key))
+        statement = statement.order_by(Resource.subject_id.desc(), Resource.id.desc())
+    else:
+        if key is not None:
+            statement = statement.where(position > tuple_(*key))
+        statement = statement.order_by(Resource.subject_id, Resource.id)
+    rows = list(await session.execute(statement.limit(limit + 1)))
+    more = len(rows) > limit
+    entries = [
+        PageEntry(resource_id, subject_id, registry.subject_name(subject_id), registry.type_name(type_id), title, link)
+        for resource_id, subject_id, type_id, title, link in rows[:limit]
+    ]
+    if direction == BEFORE:
+        # Назад листаем только от уже показанной страницы, поэтому следующая точно есть
+        return ResourcePage(entries[::-1], has_prev=more, has_next=key is not None)
+    return ResourcePage(entries, has_prev=key is not None, has_next=more)
+
+
+class PageCache:
+    """
+    LRU отрисованных страниц. Ключ — (маска предметов, тип, курсор); при смене
+    версии каталога кэш очищается, так как страницы могли сдвинуться.
+    """
+
+    def __init__(self, max_size=RESOURCES_PAGE_CACHE_SIZE):
+        self.max_size = max_size
+        self._pages = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key, version):
+        if version != self._version:
+            self._pages.clear()
+            self._version = version
+        page = self._pages.get(key)
+        if page is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._pages.move_to_end(key)
+        return page
+
+    def set(self, key, version, page):
+        if version != self._version:
+            self._pages.clear()
+            self._version = version
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_size:
+            self._pages.popitem(last=False)
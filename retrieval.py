@@ -0,0 +1,177 @@
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+from search import tokenize
+
+# Загрузка переменных окружения
+load_dotenv()
+# Сколько материалов прикладывать к ответу GigaChat
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '3'))
+# Минимальное косинусное сходство вопроса и названия материала
+RETRIEVAL_MIN_SCORE = float(os.getenv('RETRIEVAL_MIN_SCORE', '0.2'))
+# Передавать найденные материалы в запрос к GigaChat, чтобы он мог на них ссылаться
+RETRIEVAL_GROUNDING = os.getenv('RETRIEVAL_GROUNDING', 'false').lower() in ('1', 'true', 'yes')
+
+# Слова обрезаются до основы фиксированной длины: «производная» и «производной» совпадают
+STEM_LENGTH = 6
+STOP_WORDS = frozenset((
+    'а', 'в', 'во', 'и', 'к', 'на', 'не', 'о', 'об', 'от', 'по', 'с', 'со', 'у', 'за', 'из', 'для',
+    'до', 'же', 'ли', 'как', 'что', 'это', 'так', 'такое', 'такой', 'где', 'когда', 'почему',
+    'зачем', 'чем', 'или', 'мне', 'меня', 'я', 'ты', 'мы', 'вы', 'он', 'она', 'они', 'его', 'её',
+    'их', 'есть', 'был', 'была', 'было', 'быть', 'можно', 'нужно', 'объясни', 'расскажи',
+    'помоги', 'пожалуйста', 'the', 'a', 'an', 'of', 'to', 'in', 'is', 'what', 'how', 'and'
+))
+
+
+def stems(text):
+    return [token[:STEM_LENGTH] for token in tokenize(text) if token not in STOP_WORDS]
+
+
+class _Matrix:
+    """Неизменяемый снимок TF-IDF матрицы в формате CSR по термам."""
+
+    __slots__ = ('vocabulary', 'idf', 'indptr', 'documents', 'weights', 'size')
+
+    def __init__(self, vocabulary, idf, indptr, documents, weights, size):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.indptr = indptr
+        self.documents = documents
+        self.weights = weights
+        self.size = size
+
+
+class RetrievalIndex:
+    """
+    TF-IDF индекс названий материалов в NumPy.
+
+    Названия разбираются на основы слов один раз при добавлении; после каждого
+    добавления из накопленных троек (документ, терм, частота) и документной
+    частоты термов векторно пересчитываются IDF, нормы документов и CSR-матрица
+    по термам. Поиск складывает только строки матрицы для термов вопроса, а не
+    перемножает весь каталог.
+
+    copy() даёт независимую копию без повторного разбора названий: массивы
+    при добавлении не меняются, а заменяются, поэтому копии делят их с оригиналом.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._vocabulary = {}
+        self._document_ids = np.zeros(0, dtype=np.int32)
+        self._term_ids = np.zeros(0, dtype=np.int32)
+        self._counts = np.zeros(0, dtype=np.float32)
+        self._document_frequency = np.zeros(0, dtype=np.int64)
+        self._matrix = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def copy(self):
+        """Копия индекса, в которую можно добавлять материалы, не трогая этот."""
+        index = RetrievalIndex()
+        with self._lock:
+            index._entries = list(self._entries)
+            index._vocabulary = dict(self._vocabulary)
+            index._document_ids = self._document_ids
+            index._term_ids = self._term_ids
+            index._counts = self._counts
+            index._document_frequency = self._document_frequency
+            index._matrix = self._matrix
+        return index
+
+    def add(self, entries):
+        """Добавляет материалы и перестраивает матрицу; поиск видит либо старый, либо новый снимок."""
+        entries = list(entries)
+        if not entries:
+            return
+        with self._lock:
+            offset = len(self._entries)
+            document_ids, term_ids, counts = [], [], []
+            for number, entry in enumerate(entries, start=offset):
+                # Предмет и тип тоже помогают: вопрос про «химию» найдёт материалы по химии
+                terms = {}
+                for stem in stems(f'{entry.title} {entry.subject} {entry.type}'):
+                    term_id = self._vocabulary.setdefault(stem, len(self._vocabulary))
+                    terms[term_id] = terms.get(term_id, 0) + 1
+                document_ids.extend([number] * len(terms))
+                term_ids.extend(terms)
+                counts.extend(terms.values())
+            self._entries.extend(entries)
+            new_term_ids = np.array(term_ids, dtype=np.int32)
+            self._document_ids = np.concatenate((self._document_ids, np.array(document_ids, dtype=np.int32)))
+            self._term_ids = np.concatenate((self._term_ids, new_term_ids))
+            self._counts = np.concatenate((self._counts, np.array(counts, dtype=np.float32)))
+            # Документная частота дополняется только термами новых материалов
+            vocabulary_size = len(self._vocabulary)
+            document_frequency = np.bincount(new_term_ids, minlength=vocabulary_size)
+            document_frequency[:len(self._document_frequency)] += self._document_frequency
+            self._document_frequency = document_frequency
+            self._matrix = self._build_matrix()
+
+    def _build_matrix(self):
+        size = len(self._entries)
+        vocabulary_size = len(self._vocabulary)
+        document_frequency = self._document_frequency
+        idf = (np.log((1 + size) / (1 + document_frequency)) + 1).astype(np.float32)
+        # Сублинейный TF и L2-нормировка документа
+        weights = (1 + np.log(self._counts)) * idf[self._term_ids]
+        norms = np.sqrt(np.bincount(self._document_ids, weights=weights * weights, minlength=size))
+        weights = (weights / norms[self._document_ids]).astype(np.float32)
+        order = np.argsort(self._term_ids, kind='stable')
+        indptr = np.zeros(vocabulary_size + 1, dtype=np.int64)
+        np.cumsum(document_frequency, out=indptr[1:])
+        return _Matrix(dict(self._vocabulary), idf, indptr, self._document_ids[order], weights[order], size)
+
+    def _query_vector(self, matrix, text):
+        terms = {}
+        for stem in stems(text):
+            term_id = matrix.vocabulary.get(stem)
+            if term_id is not None:
+                terms[term_id] = terms.get(term_id, 0) + 1
+        if not terms:
+            return None, None
+        term_ids = np.fromiter(terms, dtype=np.int64, count=len(terms))
+        weights = (1 + np.log(np.fromiter(terms.values(), dtype=np.float32, count=len(terms)))) * matrix.idf[term_ids]
+        return term_ids, weights / np.linalg.norm(weights)
+
+    def search_many(self, questions, k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        """
+        Для каждого вопроса возвращает до k пар (материал, сходство) по убыванию сходства.
+
+        Все вопросы пачки оцениваются одной матрицей оценок (вопросы × материалы).
+        """
+        matrix = self._matrix
+        if matrix is None or not questions:
+            return [[] for _ in questions]
+        scores = np.zeros((len(questions), matrix.size), dtype=np.float32)
+        for row, question in enumerate(questions):
+            term_ids, query_weights = self._query_vector(matrix, question)
+            if term_ids is None:
+                continue
+            starts, ends = matrix.indptr[term_ids], matrix.indptr[term_ids + 1]
+            lengths = ends - starts
+            # Позиции всех ненулевых элементов нужных строк CSR одним вектором
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            scores[row] = np.bincount(
+                matrix.documents[positions],
+                weights=matrix.weights[positions] * np.repeat(query_weights, lengths),
+                minlength=matrix.size
+            )
+
+        entries = self._entries
+        results = []
+        for row in scores:
+            candidates = np.flatnonzero(row >= max(min_score, 1e-6))
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(row[candidates], -k)[-k:]]
+            candidates = candidates[np.argsort(-row[candidates], kind='stable')]
+            results.append([(entries[index], float(row[index])) for index in candidates])
+        return results
+
+    def search(self, question, k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        return self.search_many([question], k, min_score)[0]
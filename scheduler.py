@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '32'))
+LLM_PER_USER_CONCURRENCY = int(os.getenv('LLM_PER_USER_CONCURRENCY', '1'))
+# Сколько задач одного пользователя может ждать и выполняться одновременно
+LLM_PER_USER_MAX_PENDING = int(os.getenv('LLM_PER_USER_MAX_PENDING', '3'))
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', '500'))
+LLM_QUEUE_REPORT_INTERVAL = float(os.getenv('LLM_QUEUE_REPORT_INTERVAL', '60'))
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerBusy(Exception):
+    """Очередь переполнена или у пользователя слишком много задач — запрос отклонён."""
+
+
+class _Job:
+    __slots__ = ('user_id', 'future', 'enqueued_at')
+
+    def __init__(self, user_id, future, enqueued_at):
+        self.user_id = user_id
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+
+class LLMScheduler:
+    """
+    Планировщик обращений к GigaChat.
+
+    Ограничивает число одновременных вызовов глобально и на пользователя,
+    держит ожидающие задачи в ограниченной очереди (в порядке поступления) и
+    отклоняет новые задачи (SchedulerBusy), когда очередь заполнена. Все
+    обращения к GigaChat — ответы на вопросы пользователей, поэтому полос
+    приоритета нет.
+    Обработчики, которые не обращаются к GigaChat, планировщик не проходят
+    вовсе, поэтому LLM-нагрузка их не задерживает.
+
+    Общее для нескольких пользователей вычисление (схлопнутые одинаковые вопросы)
+    запускается с user_id=None и подчиняется только глобальным ограничениям,
+    а каждый ожидающий его пользователь учитывается через admit(user_id).
+    """
+
+    def __init__(
+        self,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        per_user_concurrency=LLM_PER_USER_CONCURRENCY,
+        per_user_max_pending=LLM_PER_USER_MAX_PENDING,
+        max_queue=LLM_MAX_QUEUE
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.per_user_max_pending = max(per_user_max_pending, per_user_concurrency)
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._waiting = 0
+        self._running = 0
+        self._user_running = defaultdict(int)
+        self._user_pending = defaultdict(int)
+        self._report_task = None
+        self.admitted = 0
+        self.shed = 0
+        self.completed = 0
+        self._window_waits = 0
+        self._window_wait_total = 0.0
+        self._window_wait_max = 0.0
+
+    @property
+    def queue_depth(self):
+        return self._waiting
+
+    @property
+    def running(self):
+        return self._running
+
+    def _check_user(self, user_id):
+        if self._user_pending.get(user_id, 0) >= self.per_user_max_pending:
+            self.shed += 1
+            raise SchedulerBusy("too many pending requests for user")
+
+    @contextmanager
+    def admit(self, user_id):
+        """
+        Учитывает ожидание пользователем общего вычисления в его лимите задач.
+
+        Слот GigaChat не занимается (его берёт само вычисление через run(None, ...));
+        если у пользователя уже per_user_max_pending задач, бросает SchedulerBusy.
+        """
+        self._check_user(user_id)
+        self._user_pending[user_id] += 1
+        try:
+            yield
+        finally:
+            self._forget_pending(user_id)
+
+    async def run(self, user_id, factory):
+        """
+        Дожидается слота и выполняет корутину factory(); при перегрузке бросает SchedulerBusy.
+
+        С user_id=None задача не относится к пользователю и ограничивается только глобально.
+        """
+        if self._waiting >= self.max_queue:
+            self.shed += 1
+            logger.warning(f"Очередь GigaChat переполнена ({self._waiting}), запрос отклонён")
+            raise SchedulerBusy("queue is full")
+        if user_id is not None:
+            self._check_user(user_id)
+
+        loop = asyncio.get_running_loop()
+        job = _Job(user_id, loop.create_future(), loop.time())
+        self._queue.append(job)
+        self._waiting += 1
+        if user_id is not None:
+            self._user_pending[user_id] += 1
+        self.admitted += 1
+        self._dispatch()
+
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.future.cancelled():
+                # Задача так и не получила слот: убираем её из учёта очереди
+                self._waiting -= 1
+                if user_id is not None:
+                    self._forget_pending(user_id)
+                self._dispatch()
+            else:
+                self._release(job)
+            raise
+
+        self._record_wait(loop.time() - job.enqueued_at)
+        try:
+            return await factory()
+        finally:
+            self.completed += 1
+            self._release(job)
+
+    def _dispatch(self):
+        deferred = []
+        while self._queue and self._running < self.max_concurrency:
+            job = self._queue.popleft()
+            if job.future.done():
+                continue
+            if job.user_id is not None:
+                if self._user_running.get(job.user_id, 0) >= self.per_user_concurrency:
+                    deferred.append(job)
+                    continue
+                self._user_running[job.user_id] += 1
+            self._waiting -= 1
+            self._running += 1
+            job.future.set_result(None)
+        # Отложенные задачи (у пользователя заняты все слоты) сохраняют своё место в очереди
+        self._queue.extendleft(reversed(deferred))
+
+    def _forget_pending(self, user_id):
+        self._user_pending[user_id] -= 1
+        if self._user_pending[user_id] <= 0:
+            del self._user_pending[user_id]
+
+    def _release(self, job):
+        self._running -= 1
+        if job.user_id is not None:
+            self._user_running[job.user_id] -= 1
+            if self._user_running[job.user_id] <= 0:
+                del self._user_running[job.user_id]
+            self._forget_pending(job.user_id)
+        self._dispatch()
+
+    def _record_wait(self, wait):
+        self._window_waits += 1
+        self._window_wait_total += wait
+        self._window_wait_max = max(self._window_wait_max, wait)
+
+    def stats(self):
+        avg_wait = self._window_wait_total / self._window_waits if self._window_waits else 0.0
+        return {
+            'queue_depth': self._waiting,
+            'running': self._running,
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'completed': self.completed,
+            'avg_wait': avg_wait,
+            'max_wait': self._window_wait_max,
+        }
+
+    def report(self):
+        """Пишет в лог текущую нагрузку и начинает новое окно статистики ожидания."""
+        stats = self.stats()
+        logger.info(
+            f"Очередь GigaChat: в очереди {stats['queue_depth']}, выполняется {stats['running']}, "
+            f"отклонено {stats['shed']}, среднее ожидание {stats['avg_wait']:.3f} с, "
+            f"максимальное {stats['max_wait']:.3f} с"
+        )
+        self._window_waits = 0
+        self._window_wait_total = 0.0
+        self._window_wait_max = 0.0
+        return stats
+
+    async def _report_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.report()
+
+    def start_reporting(self, interval=LLM_QUEUE_REPORT_INTERVAL):
+        if interval > 0 and self._report_task is None:
+            self._report_task = asyncio.ensure_future(self._report_loop(interval))
+
+    async def stop_reporting(self):
+        if self._report_task is not None:
+            self._report_task.cancel()
+            try:
+                await self._report_task
+            except asyncio.CancelledError:
+                pass
+            self._report_task = None
@@ -0,0 +1,328 @@
+import bisect
+import heapq
+import os
+import re
+from operator import attrgetter, itemgetter
+
+from dotenv import load_dotenv
+from sqlalchemy import func, literal_column, or_, select
+
+from models import Resource, RESOURCE_SEARCH_VECTOR
+from registry import registry
+
+# Загрузка переменных окружения
+load_dotenv()
+# Сколько результатов показывать в /search и в inline-режиме
+SEARCH_RESULT_LIMIT = int(os.getenv('SEARCH_RESULT_LIMIT', '10'))
+INLINE_RESULT_LIMIT = int(os.getenv('INLINE_RESULT_LIMIT', '20'))
+# Сколько совпадений одного слова запроса собирать целиком для точного ранжирования
+SEARCH_EAGER_LIMIT = int(os.getenv('SEARCH_EAGER_LIMIT', '5000'))
+# Минимальная похожесть названия для нечёткого поиска по триграммам (Postgres)
+SEARCH_TRIGRAM_THRESHOLD = float(os.getenv('SEARCH_TRIGRAM_THRESHOLD', '0.3'))
+# Минимальная длина слова, которое поиск в Postgres заменяет фильтром по предмету или типу
+SEARCH_FACET_MIN_LENGTH = int(os.getenv('SEARCH_FACET_MIN_LENGTH', '3'))
+
+# Веса совпадений: слово названия целиком, начало слова названия, предмет или тип
+EXACT_WEIGHT = 3
+PREFIX_WEIGHT = 2
+FACET_WEIGHT = 1
+
+_WORD = re.compile(r'\w+')
+_last = itemgetter(-1)
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower().replace('ё', 'е'))
+
+
+def _descending(lists):
+    """
+    Сливает возрастающие списки id в один поток по убыванию. Список попадает
+    в кучу, только когда его максимум может оказаться следующим, поэтому для
+    первых результатов тысячи редких слов даже не открываются.
+    """
+    lists = sorted(lists, key=_last, reverse=True)
+    heap = []
+    opened = 0
+    while True:
+        while opened < len(lists) and (not heap or lists[opened][-1] > -heap[0][0]):
+            ids = lists[opened]
+            heapq.heappush(heap, (-ids[-1], opened, len(ids) - 1))
+            opened += 1
+        if not heap:
+            return
+        value, index, position = heapq.heappop(heap)
+        yield -value
+        if position:
+            heapq.heappush(heap, (-lists[index][position - 1], index, position - 1))
+
+
+class _Term:
+    __slots__ = ('text', 'tokens', 'facets', 'size', 'scores')
+
+    def __init__(self, text, tokens, facets, size):
+        self.text = text
+        self.tokens = tokens  # слова названий, начинающиеся с text
+        self.facets = facets  # подходящие предметы и типы
+        self.size = size  # сколько всего совпадений по словам и предметам
+        self.scores = None  # {id: вес}, если совпадения собраны целиком
+
+
+class SearchIndex:
+    """
+    Префиксный индекс по словам названий материалов, предметам и типам.
+
+    Каждое слово запроса считается началом слова, поэтому результаты
+    обновляются на каждое нажатие клавиши в inline-режиме. Все слова запроса
+    должны совпасть (в названии, предмете или типе); выше ранжируются точные
+    совпадения слов названия, затем совпадения по началу слова, затем по
+    предмету или типу, при равенстве — более новые материалы.
+    """
+
+    def __init__(self, eager_limit=SEARCH_EAGER_LIMIT):
+        # Совпадения слова собираются целиком, только если их не больше eager_limit;
+        # для коротких префиксов кандидаты перебираются лениво от лучших к худшим
+        self.eager_limit = eager_limit
+        self._entries = {}
+        self._title_tokens = {}  # id -> слова названия
+        self._postings = {}  # слово названия -> id материалов по возрастанию
+        self._tokens = []  # отсортированные слова для поиска по префиксу
+        self._facets = {}  # слово предмета или типа -> значения ('subject'/'type', строка)
+        self._facet_tokens = []
+        self._by_facet = {}  # ('subject'/'type', строка) -> id материалов
+
+    def __len__(self):
+        return len(self._entries)
+
+    def copy(self):
+        """
+        Копия индекса, в которую можно добавлять материалы, не трогая этот.
+
+        Копируются только словари; списки id общие, так как add() их не меняет,
+        а заменяет дополненными.
+        """
+        index = SearchIndex(self.eager_limit)
+        index._entries = dict(self._entries)
+        index._title_tokens = dict(self._title_tokens)
+        index._postings = dict(self._postings)
+        index._tokens = self._tokens
+        index._facets = dict(self._facets)
+        index._facet_tokens = self._facet_tokens
+        index._by_facet = dict(self._by_facet)
+        return index
+
+    def add(self, entries):
+        """Добавляет материалы; id должны возрастать, как при загрузке каталога."""
+        postings = {}
+        by_facet = {}
+        for entry in entries:
+            self._entries[entry.id] = entry
+            title_tokens = tuple(dict.fromkeys(tokenize(entry.title)))
+            self._title_tokens[entry.id] = title_tokens
+            for token in title_tokens:
+                postings.setdefault(token, []).append(entry.id)
+            by_facet.setdefault(('subject', entry.subject), []).append(entry.id)
+            by_facet.setdefault(('type', entry.type), []).append(entry.id)
+        # Списки, которые могут быть общими с копией индекса, не дополняются на месте, а заменяются
+        new_tokens = False
+        for token, ids in postings.items():
+            existing = self._postings.get(token)
+            if existing is None:
+                new_tokens = True
+                self._postings[token] = ids
+            else:
+                self._postings[token] = existing + ids
+        new_facets = False
+        for facet, ids in by_facet.items():
+            existing = self._by_facet.get(facet)
+            if existing is None:
+                new_facets = True
+                self._by_facet[facet] = ids
+                for token in tokenize(facet[1]):
+                    self._facets[token] = self._facets.get(token, frozenset()) | {facet}
+            else:
+                self._by_facet[facet] = existing + ids
+        # Списки подменяются целиком: поиск в другом потоке видит либо старый, либо новый
+        if new_tokens:
+            self._tokens = sorted(self._postings)
+        if new_facets:
+            self._facet_tokens = sorted(self._facets)
+
+    @staticmethod
+    def _prefix_range(tokens, prefix):
+        start = bisect.bisect_left(tokens, prefix)
+        end = bisect.bisect_left(tokens, prefix + '\uffff', start)
+        return tokens[start:end]
+
+    def _term(self, tokens, text):
+        matched = self._prefix_range(tokens, text)
+        facets = set()
+        for token in self._prefix_range(self._facet_tokens, text):
+            facets |= self._facets[token]
+        size = sum(len(self._postings[token]) for token in matched)
+        size += sum(len(self._by_facet[facet]) for facet in facets)
+        return _Term(text, matched, facets, size)
+
+    def _collect(self, term):
+        """Собирает все совпадения слова в словарь {id: вес} (dict.fromkeys работает на C)."""
+        scores = {}
+        for facet in term.facets:
+            scores.update(dict.fromkeys(self._by_facet[facet], FACET_WEIGHT))
+        for token in term.tokens:
+            if token != term.text:
+                scores.update(dict.fromkeys(self._postings[token], PREFIX_WEIGHT))
+        exact = self._postings.get(term.text)
+        if exact:
+            scores.update(dict.fromkeys(exact, EXACT_WEIGHT))
+        return scores
+
+    def _ranked(self, term):
+        """Лениво перечисляет (id, вес) совпадений слова: по убыванию веса, затем id."""
+        seen = set()
+        exact = self._postings.get(term.text, ())
+        for entry_id in reversed(exact):
+            seen.add(entry_id)
+            yield entry_id, EXACT_WEIGHT
+        tiers = (
+            (PREFIX_WEIGHT, [self._postings[token] for token in term.tokens if token != term.text]),
+            (FACET_WEIGHT, [self._by_facet[facet] for facet in term.facets]),
+        )
+        for weight, lists in tiers:
+            for entry_id in _descending(lists):
+                if entry_id not in seen:
+                    seen.add(entry_id)
+                    yield entry_id, weight
+
+    def _weight(self, entry_id, term):
+        if term.scores is not None:
+            return term.scores.get(entry_id)
+        title_tokens = self._title_tokens[entry_id]
+        if term.text in title_tokens:
+            return EXACT_WEIGHT
+        for token in title_tokens:
+            if token.startswith(term.text):
+                return PREFIX_WEIGHT
+        entry = self._entries[entry_id]
+        if ('subject', entry.subject) in term.facets or ('type', entry.type) in term.facets:
+            return FACET_WEIGHT
+        return None
+
+    def _max_weight(self, term):
+        """Наибольший вес, который слово может добавить материалу."""
+        if term.text in self._postings:
+            return EXACT_WEIGHT
+        if term.tokens:
+            return PREFIX_WEIGHT
+        if term.facets:
+            return FACET_WEIGHT
+        return 0
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        """Возвращает до limit материалов, подходящих под все слова запроса, по убыванию релевантности."""
+        texts = list(dict.fromkeys(tokenize(query)))
+        if not texts or limit <= 0:
+            return []
+        tokens = self._tokens
+        # Кандидатов даёт самое избирательное слово, остальные слова их фильтруют
+        terms = sorted((self._term(tokens, text) for text in texts), key=attrgetter('size'))
+        driver, others = terms[0], terms[1:]
+        for term in others:
+            if term.size <= self.eager_limit:
+                term.scores = self._collect(term)
+
+        if driver.size <= self.eager_limit:
+            candidates = self._collect(driver).items()
+            bonus = None
+        else:
+            # Для очень частого префикса кандидаты идут по убыванию веса этого слова,
+            # а остальные слова добавляют к нему не больше bonus
+            candidates = self._ranked(driver)
+            bonus = sum(self._max_weight(term) for term in others)
+
+        best = []  # куча из limit лучших (вес, id), наверху худший
+        for entry_id, score in candidates:
+            # Оставшиеся кандидаты не лучше (вес ведущего слова + bonus, id) текущего:
+            # вес ведущего слова не растёт, а при равном весе id убывают
+            if bonus is not None and len(best) == limit and best[0] > (score + bonus, entry_id):
+                break
+            for term in others:
+                weight = self._weight(entry_id, term)
+                if weight is None:
+                    break
+                score += weight
+            else:
+                if len(best) < limit:
+                    heapq.heappush(best, (score, entry_id))
+                elif (score, entry_id) > best[0]:
+                    heapq.heapreplace(best, (score, entry_id))
+        best.sort(reverse=True)
+        return [self._entries[entry_id] for _, entry_id in best]
+
+
+def _like_pattern(term):
+    """Шаблон LIKE «подстрока term»; % и _ из запроса экранируются символом \\."""
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _facet_filter(term, whole_word=False):
+    """
+    Условие «слово запроса — начало слова в названии предмета или типа» (при whole_word —
+    слово названия целиком) по справочникам; None, если таких нет.
+    """
+    subject_ids = registry.matching_subjects(term, whole_word)
+    type_ids = registry.matching_types(term, whole_word)
+    conditions = []
+    if subject_ids:
+        conditions.append(Resource.subject_id.in_(subject_ids))
+    if type_ids:
+        conditions.append(Resource.type_id.in_(type_ids))
+    return or_(*conditions) if conditions else None
+
+
+async def search_resources_db(session, query, limit=SEARCH_RESULT_LIMIT):
+    """
+    Поиск в базе, когда каталог в памяти недоступен.
+
+    В Postgres слова, совпадающие целиком со словом из названия предмета или
+    типа (не короче SEARCH_FACET_MIN_LENGTH), превращаются в фильтры по
+    subject_id/type_id, а остальные ищутся полнотекстовым индексом по названию
+    (с учётом морфологии русского языка) и триграммным индексом для опечаток.
+    Короткие слова вроде «в» и «и» фильтрами не становятся и остаются в
+    полнотекстовом запросе. В остальных СУБД каждое слово ищется как подстрока
+    названия или начало слова в предмете или типе.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    if session.get_bind().dialect.name == 'postgresql':
+        statement = select(Resource)
+        text_terms = []
+        for term in terms:
+            facet = _facet_filter(term, whole_word=True) if len(term) >= SEARCH_FACET_MIN_LENGTH else None
+            if facet is None:
+                text_terms.append(term)
+            else:
+                statement = statement.where(facet)
+        if not text_terms:
+            return list(await session.scalars(statement.order_by(Resource.id.desc()).limit(limit)))
+        text = ' '.join(text_terms)
+        vector = literal_column(RESOURCE_SEARCH_VECTOR)
+        ts_query = func.websearch_to_tsquery(literal_column("'russian'"), text)
+        await session.execute(select(func.set_config('pg_trgm.similarity_threshold', str(SEARCH_TRIGRAM_THRESHOLD), True)))
+        statement = (
+            statement
+            .where(or_(vector.op('@@')(ts_query), Resource.title.op('%')(text)))
+            .order_by(
+                (func.ts_rank(vector, ts_query) + func.similarity(Resource.title, text)).desc(),
+                Resource.id.desc()
+            )
+            .limit(limit)
+        )
+    else:
+        statement = select(Resource)
+        for term in terms:
+            condition = Resource.title.ilike(_like_pattern(term), escape='\\')
+            facet = _facet_filter(term)
+            statement = statement.where(condition if facet is None else or_(condition, facet))
+        statement = statement.order_by(Resource.id.desc()).limit(limit)
+    return list(await session.scalars(statement))
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
+# Сколько обновлений одновременно обрабатывает воркер. При 1 обновления
+# пользователя применяются строго по порядку; вопросы к GigaChat всё равно
+# выполняются параллельно, так как их обработчик не блокирующий
+SHARD_WORKER_CONCURRENT_UPDATES = int(os.getenv('SHARD_WORKER_CONCURRENT_UPDATES', '1'))
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '10000'))
+# Пауза перед повторной попыткой поставить обновление в заполненную очередь (polling)
+SHARD_FULL_RETRY_DELAY = float(os.getenv('SHARD_FULL_RETRY_DELAY', '0.1'))
+# Сколько ждать места в очереди для маркера остановки (в секундах)
+SHARD_STOP_TIMEOUT = 30
+
+# Маркер остановки воркера
+STOP = '__stop__'
+
+logger = logging.getLogger(__name__)
+
+
+def user_id_from_update_data(data):
+    """Находит id пользователя (или чата) в JSON обновления без его полного разбора."""
+    for key, value in data.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+        chat = value.get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return 0
+
+
+def shard_for(user_id, shards):
+    # Остаток от деления, а не hash(): результат одинаков во всех процессах
+    return abs(user_id) % shards
+
+
+class LocalTransport:
+    """Очереди внутри одного процесса; заменяет межпроцессный транспорт в тестах."""
+
+    def __init__(self, shards, maxsize=SHARD_QUEUE_SIZE):
+        self.shards = shards
+        self._queues = [queue.Queue(maxsize) for _ in range(shards)]
+
+    def send(self, shard, data, block=False, timeout=None):
+        """Кладёт данные в очередь шарда; по умолчанию не ждёт места и бросает queue.Full."""
+        self._queues[shard].put(data, block, timeout)
+
+    def receive(self, shard, timeout=1.0):
+        try:
+            return self._queues[shard].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def depth(self, shard):
+        return self._queues[shard].qsize()
+
+    def close(self):
+        pass
+
+
+class MultiprocessingTransport(LocalTransport):
+    """Очередь multiprocessing на каждый шард."""
+
+    def __init__(self, shards, maxsize=SHARD_QUEUE_SIZE, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self.shards = shards
+        self._queues = [context.Queue(maxsize) for _ in range(shards)]
+
+    def depth(self, shard):
+        try:
+            return self._queues[shard].qsize()
+        except NotImplementedError:  # macOS
+            return -1
+
+    def close(self):
+        for shard_queue in self._queues:
+            shard_queue.close()
+
+
+class ShardRouter:
+    """
+    Раскладывает обновления по шардам в зависимости от id пользователя.
+
+    route вызывается из цикла событий входного процесса и никогда не ждёт:
+    если очередь шарда заполнена, обновление не принимается, и его повторит
+    Telegram (webhook отвечает 503) или следующий опрос (polling не сдвигает offset).
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.routed = 0
+        self.rejected = 0
+
+    def route(self, data, user_id=None):
+        """Возвращает False, если очередь шарда заполнена и обновление не принято."""
+        if user_id is None:
+            user_id = user_id_from_update_data(data)
+        try:
+            self.transport.send(shard_for(user_id, self.transport.shards), data)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.routed += 1
+        return True
+
+    def stop_workers(self):
+        for shard in range(self.transport.shards):
+            # Маркер остановки ждёт места в очереди, пока воркер её дочитывает
+            try:
+                self.transport.send(shard, STOP, block=True, timeout=SHARD_STOP_TIMEOUT)
+            except queue.Full:
+                logger.warning(f"Очередь шарда {shard} не освободилась, воркер будет остановлен принудительно")
+
+
+async def run_worker_async(shard, transport, concurrent_updates=SHARD_WORKER_CONCURRENT_UPDATES):
+    """Обрабатывает обновления своего шарда обработчиками из bot.py."""
+    import bot
+    from telegram import Update
+
+    application = bot.build_application(concurrent_updates)
+    async with application:
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+        logger.info(f"Воркер шарда {shard} запущен (pid {os.getpid()})")
+        try:
+            while True:
+                data = await asyncio.to_thread(transport.receive, shard)
+                if data is None:
+                    continue
+                if data == STOP:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+        finally:
+            await application.stop()
+    if application.post_shutdown is not None:
+        await application.post_shutdown(application)
+
+
+def run_worker(shard, transport, concurrent_updates=SHARD_WORKER_CONCURRENT_UPDATES):
+    # Воркер останавливается по маркеру STOP от входного процесса, а не по Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # У каждого воркера свой эндпоинт метрик: METRICS_PORT + номер шарда
+    metrics_port = int(os.getenv('METRICS_PORT', '9464'))
+    if metrics_port:
+        os.environ['METRICS_PORT'] = str(metrics_port + shard)
+    # Глобальный лимит Telegram общий на бота, поэтому делится между воркерами поровну.
+    # Общего счётчика между процессами нет: воркер с «горячими» пользователями упирается
+    # в свою долю, даже пока остальные простаивают, поэтому суммарная скорость отправки
+    # может быть ниже TELEGRAM_GLOBAL_RATE. Личные чаты ограничиваются полностью, так как
+    # пользователь всегда обслуживается одним воркером
+    global_rate = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+    os.environ['TELEGRAM_GLOBAL_RATE'] = str(global_rate / transport.shards)
+    # Рассылки выполняет только нулевой шард, иначе каждое задание ушло бы N раз
+    if shard:
+        os.environ['NOTIFY_POLL_INTERVAL'] = '0'
+    asyncio.run(run_worker_async(shard, transport, concurrent_updates))
+
+
+async def poll_updates(router):
+    """Входной процесс в режиме polling: получает обновления и раскладывает их по шардам."""
+    from telegram import Bot, Update
+    from telegram.error import NetworkError
+
+    bot_kwargs = {'base_url': TELEGRAM_API_BASE_URL} if TELEGRAM_API_BASE_URL else {}
+    async with Bot(TELEGRAM_BOT_TOKEN, **bot_kwargs) as telegram_bot:
+        await telegram_bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                updates = await telegram_bot.get_updates(
+                    offset=offset,
+                    timeout=30,
+                    read_timeout=40,
+                    allowed_updates=Update.ALL_TYPES
+                )
+            except NetworkError as e:
+                logger.warning(f"Ошибка при получении обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                user = update.effective_user
+                # Очередь шарда заполнена — ждём, не сдвигая offset, чтобы не потерять обновление
+                while not router.route(update.to_dict(), user.id if user else None):
+                    await asyncio.sleep(SHARD_FULL_RETRY_DELAY)
+                offset = update.update_id + 1
+
+
+async def run_ingress(router, mode='polling', host=None, port=None, webhook_url=None):
+    import webhook
+
+    if mode == 'webhook':
+        async def route(data):
+            if not router.route(data):
+                raise webhook.Overloaded("очередь шарда заполнена")
+
+        if webhook_url:
+            from telegram import Bot, Update
+            bot_kwargs = {'base_url': TELEGRAM_API_BASE_URL} if TELEGRAM_API_BASE_URL else {}
+            async with Bot(TELEGRAM_BOT_TOKEN, **bot_kwargs) as telegram_bot:
+                await telegram_bot.set_webhook(
+                    url=f"{webhook_url.rstrip('/')}{webhook.WEBHOOK_PATH}",
+                    secret_token=webhook.WEBHOOK_SECRET_TOKEN,
+                    allowed_updates=Update.ALL_TYPES
+                )
+        await webhook.serve_until_stopped(
+            webhook.create_webhook_app(route),
+            host or webhook.WEBHOOK_HOST,
+            port or webhook.WEBHOOK_PORT
+        )
+    else:
+        poll_task = asyncio.ensure_future(poll_updates(router))
+        try:
+            await webhook.wait_for_stop_signal()
+        finally:
+            poll_task.cancel()
+            try:
+                await poll_task
+            except asyncio.CancelledError:
+                pass
+
+
+def run_sharded(
+    workers,
+    mode='polling',
+    concurrent_updates=SHARD_WORKER_CONCURRENT_UPDATES,
+    host=None,
+    port=None,
+    webhook_url=None,
+    transport=None
+):
+    """
+    Запускает входной процесс и N воркеров.
+
+    Все обновления одного пользователя попадают в один и тот же воркер, поэтому
+    их порядок сохраняется, а нагрузка распределяется по ядрам. Глобальный лимит
+    Telegram (TELEGRAM_GLOBAL_RATE) делится между воркерами поровну, см. run_worker.
+    """
+    context = multiprocessing.get_context('spawn')
+    transport = transport or MultiprocessingTransport(workers, context=context)
+    router = ShardRouter(transport)
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(shard, transport, concurrent_updates),
+            name=f'studyhomie-shard-{shard}',
+            daemon=True
+        )
+        for shard in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено воркеров: {workers}")
+    try:
+        asyncio.run(run_ingress(router, mode, host, port, webhook_url))
+    finally:
+        router.stop_workers()
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        transport.close()
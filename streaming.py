@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+from telegram.error import BadRequest, RetryAfter
+
+# Загрузка переменных окружения
+load_dotenv()
+# Минимальный интервал между правками одного сообщения (в секундах)
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+
+# Максимальная длина текста сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAM_CURSOR = ' ▌'
+STREAM_INTERRUPTED_SUFFIX = "\n\n⚠️ Ответ был прерван. Попробуй задать вопрос ещё раз."
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(error):
+    # В новых версиях PTB retry_after — timedelta, в старых — число секунд
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def _split_point(text, limit):
+    # Режем по последнему переводу строки или пробелу, чтобы не рвать слова
+    for separator in ('\n', ' '):
+        index = text.rfind(separator, 0, limit)
+        if index > limit // 2:
+            return index + 1
+    return limit
+
+
+class StreamingReply:
+    """
+    Постепенно редактирует сообщение-заглушку по мере поступления фрагментов ответа.
+
+    Правки не чаще одной в edit_interval секунд, чтобы не упираться в лимиты
+    Telegram; при RetryAfter следующая правка откладывается. Текст длиннее
+    4096 символов продолжается в новых сообщениях.
+    """
+
+    def __init__(self, message, edit_interval=STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.parts = []
+        self._offset = 0  # начало текста текущего сообщения
+        self._shown = message.text
+        self._next_edit_at = 0.0
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+    async def append(self, chunk):
+        self.parts.append(chunk)
+        if asyncio.get_running_loop().time() >= self._next_edit_at:
+            await self._flush(cursor=True)
+
+    async def finish(self, suffix=''):
+        """Выводит окончательный текст без курсора."""
+        await self._flush(suffix=suffix, force=True)
+
+    async def fail(self, fallback_text):
+        """Завершает поток после обрыва: сохраняет частичный ответ или показывает fallback_text."""
+        if self.text.strip():
+            await self.finish(STREAM_INTERRUPTED_SUFFIX)
+        else:
+            await self._edit(fallback_text, force=True)
+
+    async def _flush(self, cursor=False, suffix='', force=False):
+        full_text = self.text + suffix
+        current = full_text[self._offset:]
+        reserve = len(STREAM_CURSOR) if cursor else 0
+        # Переполнение: фиксируем текущее сообщение и продолжаем в новом
+        while len(current) + reserve > TELEGRAM_MESSAGE_LIMIT:
+            split = _split_point(current, TELEGRAM_MESSAGE_LIMIT - reserve)
+            await self._edit(current[:split], force=True)
+            self._offset += split
+            current = full_text[self._offset:]
+            self.message = await self.message.reply_text(current[:TELEGRAM_MESSAGE_LIMIT - reserve] or '…')
+            self._shown = self.message.text
+        if current:
+            await self._edit(current + (STREAM_CURSOR if cursor else ''), force=force)
+
+    async def _edit(self, text, force=False):
+        if text == self._shown:
+            return
+        loop = asyncio.get_running_loop()
+        if force:
+            delay = self._next_edit_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        try:
+            await self.message.edit_text(text)
+            self._shown = text
+        except RetryAfter as e:
+            self._next_edit_at = loop.time() + retry_after_seconds(e)
+            if force:
+                await self._edit(text, force=True)
+            return
+        except BadRequest as e:
+            # Совпадение текста не ошибка; остальное логируем и продолжаем поток
+            if 'not modified' not in str(e).lower():
+                logger.warning(f"Не удалось обновить сообщение при потоковой выдаче: {e}")
+        self._next_edit_at = loop.time() + self.edit_interval
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# models создаёт движок при импорте; тесты, которым нужна база, создают свою
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    """Файл SQLite со схемой models и заполненными справочниками."""
+    from models import Base, ResourceType, Subject
+    from registry import DEFAULT_RESOURCE_TYPES, DEFAULT_SUBJECTS
+
+    url = f'sqlite:///{tmp_path / "studyhomie.db"}'
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all([Subject(name=name) for name in DEFAULT_SUBJECTS])
+        session.add_all([ResourceType(name=name) for name in DEFAULT_RESOURCE_TYPES])
+        session.commit()
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def async_session_factory(database_url):
+    """Фабрика асинхронных сессий к database_url; без пула, чтобы работать в любом цикле событий."""
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from models import make_async_url
+
+    engine = create_async_engine(make_async_url(database_url), poolclass=NullPool)
+    return async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
@@ -0,0 +1,121 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+
+from activity import QUESTIONS, TOKENS, ActivityBuffer
+from models import UserActivity
+
+
+class FakeClock:
+    def __init__(self, now=datetime(2026, 10, 17, 12, 0)):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def rows(session_factory):
+    async def main():
+        async with session_factory() as session:
+            result = await session.execute(select(UserActivity).order_by(UserActivity.telegram_id, UserActivity.day))
+            return [
+                (row.telegram_id, row.day, row.questions, row.prompt_tokens, row.completion_tokens, row.last_seen)
+                for row in result.scalars()
+            ]
+
+    return asyncio.run(main())
+
+
+def test_quota_counts_questions_and_tokens():
+    clock = FakeClock()
+    buffer = ActivityBuffer(question_limit=2, token_limit=100, clock=clock)
+    assert buffer.check_quota(1) is None
+    buffer.record_question(1)
+    buffer.record_usage(1, {'prompt_tokens': 10, 'completion_tokens': 20})
+    assert buffer.check_quota(1) is None
+    buffer.record_question(1)
+    assert buffer.check_quota(1) == QUESTIONS
+    buffer.record_usage(2, {'prompt_tokens': 60, 'completion_tokens': 50})
+    assert buffer.check_quota(2) == TOKENS
+    assert buffer.stats()['rejected_questions'] == 1 and buffer.stats()['rejected_tokens'] == 1
+    # С новыми сутками лимиты начинаются заново
+    clock.now += timedelta(days=1)
+    assert buffer.check_quota(1) is None
+    buffer.record_question(1)
+    assert buffer.check_quota(1) is None
+
+
+def test_flush_upserts_and_adds_increments(async_session_factory):
+    clock = FakeClock()
+    buffer = ActivityBuffer(session_factory=async_session_factory, clock=clock)
+    buffer.record_question(1)
+    buffer.record_usage(1, {'prompt_tokens': 5, 'completion_tokens': 7})
+    buffer.touch(2)
+    assert asyncio.run(buffer.flush()) == 2
+    assert len(buffer) == 0
+
+    clock.now += timedelta(hours=1)
+    buffer.record_question(1)
+    clock.now += timedelta(days=1)
+    buffer.record_question(1)
+    assert asyncio.run(buffer.flush()) == 2
+    today = date(2026, 10, 17)
+    assert rows(async_session_factory) == [
+        (1, today, 2, 5, 7, datetime(2026, 10, 17, 13, 0)),
+        (1, today + timedelta(days=1), 1, 0, 0, datetime(2026, 10, 18, 13, 0)),
+        (2, today, 0, 0, 0, datetime(2026, 10, 17, 12, 0)),
+    ]
+    assert buffer.stats()['flushed'] == 4
+
+
+def test_failed_flush_keeps_increments(async_session_factory):
+    failing = True
+
+    def session_factory():
+        if failing:
+            raise RuntimeError('database is down')
+        return async_session_factory()
+
+    clock = FakeClock()
+    buffer = ActivityBuffer(session_factory=session_factory, clock=clock)
+    buffer.record_question(1)
+    assert asyncio.run(buffer.flush()) == 0
+    assert buffer.stats()['flush_errors'] == 1 and len(buffer) == 1
+    buffer.record_question(1)
+    failing = False
+    assert asyncio.run(buffer.flush()) == 1
+    assert rows(async_session_factory)[0][2] == 2
+
+
+def test_flush_size_triggers_early_flush(async_session_factory):
+    async def main():
+        buffer = ActivityBuffer(flush_interval=3600, flush_size=3, session_factory=async_session_factory, clock=FakeClock())
+        await buffer.start()
+        for telegram_id in range(3):
+            buffer.touch(telegram_id)
+        await asyncio.sleep(0.1)
+        flushed = buffer.flushed
+        await buffer.stop()
+        return flushed
+
+    assert asyncio.run(main()) == 3
+    assert len(rows(async_session_factory)) == 3
+
+
+def test_start_restores_todays_usage(async_session_factory):
+    clock = FakeClock()
+    first = ActivityBuffer(question_limit=2, session_factory=async_session_factory, clock=clock)
+    first.record_question(1)
+    first.record_question(1)
+    asyncio.run(first.stop())
+
+    async def main():
+        second = ActivityBuffer(question_limit=2, session_factory=async_session_factory, clock=clock)
+        await second.start()
+        reason = second.check_quota(1)
+        await second.stop()
+        return reason
+
+    # После перезапуска расход за сутки не обнуляется
+    assert asyncio.run(main()) == QUESTIONS
@@ -0,0 +1,115 @@
+import io
+from functools import partial
+
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+import add_resources
+import manage
+from models import Resource
+from registry import registry
+
+
+@pytest.fixture
+def session_factory(database_url, monkeypatch):
+    # Справочник по умолчанию совпадает с заполненными таблицами, поэтому из базы он не читается
+    monkeypatch.setattr(registry, 'loaded', True)
+    engine = create_engine(database_url)
+    yield sessionmaker(engine)
+    engine.dispose()
+
+
+def titles(session_factory):
+    with session_factory() as session:
+        return list(session.scalars(select(Resource.title).order_by(Resource.id)))
+
+
+def test_add_resource_refuses_to_overwrite_without_update(session_factory):
+    first = add_resources.validate_resource('Физика', 'Video', 'Законы Ньютона', 'https://example.com/newton/')
+    duplicate = add_resources.validate_resource('Химия', 'Article', 'Другое', 'https://www.example.com/newton')
+
+    assert add_resources.add_resource(first, session_factory=session_factory) is True
+    with pytest.raises(ValueError, match='--update'):
+        add_resources.add_resource(duplicate, session_factory=session_factory)
+    assert titles(session_factory) == ['Законы Ньютона']
+
+    assert add_resources.add_resource(duplicate, update=True, session_factory=session_factory) is False
+    with session_factory() as session:
+        resource = session.scalars(select(Resource)).one()
+    assert (resource.title, resource.subject_id, resource.link) == ('Другое', 3, 'https://www.example.com/newton')
+
+
+def invoke_addresource(session_factory, monkeypatch, *options):
+    monkeypatch.setattr(add_resources, 'add_resource', partial(add_resources.add_resource, session_factory=session_factory))
+    arguments = ['addresource', '--subject', '2', '--type', '2', '--title', 'Оптика', '--link', 'https://example.com/optics']
+    return CliRunner().invoke(manage.cli, [*arguments, *options], input='y\n').output
+
+
+def test_addresource_reports_added_existing_and_updated(session_factory, monkeypatch):
+    assert 'успешно добавлен' in invoke_addresource(session_factory, monkeypatch)
+    assert 'уже есть' in invoke_addresource(session_factory, monkeypatch)
+    assert 'обновлён' in invoke_addresource(session_factory, monkeypatch, '--update')
+    assert titles(session_factory) == ['Оптика']
+
+
+def test_normalize_link_ignores_cosmetic_differences():
+    canonical = 'https://example.com/course?page=2'
+    for link in (
+        'https://example.com/course?page=2',
+        ' HTTPS://WWW.Example.com:443/course/?page=2#top ',
+    ):
+        assert add_resources.normalize_link(link) == canonical
+    assert add_resources.normalize_link('http://example.com:8080/a') == 'http://example.com:8080/a'
+
+
+def test_read_resource_rows_streams_csv_and_jsonl():
+    csv_rows = list(add_resources.read_resource_rows(
+        io.StringIO('subject,type,title,link\nФизика,Video,Оптика,https://example.com/1\n'), 'csv'
+    ))
+    assert csv_rows == [(2, {'subject': 'Физика', 'type': 'Video', 'title': 'Оптика', 'link': 'https://example.com/1'})]
+    jsonl_rows = add_resources.read_resource_rows(io.StringIO('{"title": "a"}\n\n{oops\n'), 'jsonl')
+    assert next(jsonl_rows) == (1, {'title': 'a'})
+    with pytest.raises(ValueError, match='Строка 3'):
+        next(jsonl_rows)
+
+
+def test_import_resources_batches_validates_and_dedupes(session_factory):
+    rows = [
+        (1, {'subject': 'Физика', 'type': 'Video', 'title': 'Оптика', 'link': 'https://example.com/optics'}),
+        (2, {'subject': 'Физика', 'type': 'Video', 'title': 'Без ссылки', 'link': 'не ссылка'}),
+        (3, {'subject': 'Химия', 'type': 'Статья', 'title': 'Кислоты', 'link': 'https://example.com/acids'}),
+        # Повтор ресурса в той же пачке (оптика) и в следующей (кислоты): побеждает последняя версия
+        (4, {'subject': 'Физика', 'type': 'Video', 'title': 'Оптика 2', 'link': 'https://www.example.com/optics/'}),
+        (5, {'subject': 'Химия', 'type': 'Article', 'title': 'Кислоты 2', 'link': 'https://example.com/acids'}),
+        (6, {'subject': 'Астрономия', 'type': 'Video', 'title': 'Звёзды', 'link': 'https://example.com/stars'}),
+    ]
+    invalid, batches = [], []
+    stats = add_resources.import_resources(
+        rows,
+        batch_size=3,
+        allowed_subjects=registry.subjects,
+        session_factory=session_factory,
+        on_invalid=lambda line_number, error: invalid.append(line_number),
+        on_batch=lambda stats: batches.append(stats.written)
+    )
+    assert (stats.read, stats.written, stats.invalid) == (6, 3, 2)
+    assert invalid == [2, 6]
+    # Первая пачка из трёх проверенных строк схлопнула две строки об оптике в одну
+    assert batches == [2, 3]
+    assert titles(session_factory) == ['Оптика 2', 'Кислоты 2']
+
+
+def test_importresources_command_reads_file(session_factory, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        add_resources, 'import_resources', partial(add_resources.import_resources, session_factory=session_factory)
+    )
+    source = tmp_path / 'resources.jsonl'
+    source.write_text(
+        '{"subject": "Физика", "type": "Video", "title": "Оптика", "link": "https://example.com/optics"}\n',
+        encoding='utf-8'
+    )
+    output = CliRunner().invoke(manage.cli, ['importresources', str(source)]).output
+    assert '(jsonl)' in output and 'записано 1' in output
+    assert titles(session_factory) == ['Оптика']
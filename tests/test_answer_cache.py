@@ -0,0 +1,187 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import answer_cache
+from answer_cache import AnswerCache, SqliteAnswerStore, make_cache_key, normalize_question
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(answer_cache, 'time', SimpleNamespace(time=clock.time))
+    return clock
+
+
+def test_questions_are_normalized():
+    assert normalize_question('  Что   такое ЁЖ?? ') == 'что такое еж'
+    assert make_cache_key('Что такое еж') == make_cache_key('что  такое ёж?!')
+    assert make_cache_key(' ?! ') is None
+
+
+def test_ttl_expires_entries(clock):
+    cache = AnswerCache(ttl=10)
+    asyncio.run(cache.set('вопрос', 'ответ'))
+    assert asyncio.run(cache.get('Вопрос?')) == ('ответ', None)
+    clock.now += 11
+    assert asyncio.run(cache.get('вопрос')) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_lru_eviction_by_count(clock):
+    cache = AnswerCache(max_entries=2)
+
+    async def main():
+        await cache.set('a', 'ответ a')
+        await cache.set('b', 'ответ b')
+        # a использован недавно, поэтому вытесняется b
+        await cache.get('a')
+        await cache.set('c', 'ответ c')
+        return [await cache.get(question) for question in 'abc']
+
+    assert asyncio.run(main()) == [('ответ a', None), None, ('ответ c', None)]
+    assert cache.evictions == 1
+
+
+def test_byte_bound(clock):
+    size = sys.getsizeof('x' * 100)
+    cache = AnswerCache(max_bytes=size * 2)
+
+    async def main():
+        for question in 'abc':
+            await cache.set(question, question * 100)
+        # Ответ больше всего кэша не сохраняется вовсе
+        await cache.set('d', 'd' * (size * 3))
+        return [await cache.get(question) for question in 'abcd']
+
+    assert asyncio.run(main()) == [None, ('b' * 100, None), ('c' * 100, None), None]
+    assert cache.stats()['bytes'] <= size * 2
+
+
+def test_concurrent_identical_questions_are_coalesced(clock):
+    cache = AnswerCache()
+    calls = []
+
+    usage = {'prompt_tokens': 10, 'completion_tokens': 20}
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return 'ответ', usage
+
+    async def main():
+        answers = await asyncio.gather(*(cache.get_or_compute('Вопрос', compute) for _ in range(5)))
+        answers.append(await cache.get_or_compute('вопрос?', compute))
+        return answers
+
+    # Каждый получатель общего ответа узнаёт, сколько токенов он стоил
+    assert asyncio.run(main()) == [('ответ', usage)] * 6
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats['misses'], stats['coalesced'], stats['hits'], stats['inflight']) == (1, 4, 1, 0)
+
+
+def test_cancelled_waiter_does_not_cancel_shared_computation(clock):
+    cache = AnswerCache()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return 'ответ', None
+
+    async def main():
+        first = asyncio.ensure_future(cache.get_or_compute('вопрос', compute))
+        second = asyncio.ensure_future(cache.get_or_compute('вопрос', compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(main()) == (('ответ', None), True)
+    assert asyncio.run(cache.get('вопрос')) == ('ответ', None)
+
+
+def test_errors_are_shared_but_not_cached(clock):
+    cache = AnswerCache()
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        raise RuntimeError('GigaChat недоступен')
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_compute('вопрос', compute) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(main()))
+    assert len(calls) == 1
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_persistent_store_survives_restart(tmp_path, clock):
+    path = str(tmp_path / 'answers.db')
+    first = AnswerCache(store=SqliteAnswerStore(path))
+    asyncio.run(first.set('вопрос', 'ответ', {'total_tokens': 30}))
+    first.close()
+    second = AnswerCache(store=SqliteAnswerStore(path))
+    assert asyncio.run(second.get('вопрос')) == ('ответ', {'total_tokens': 30})
+    second.close()
+
+
+def test_store_prunes_expired_and_excess_rows(tmp_path, clock):
+    path = str(tmp_path / 'answers.db')
+    store = SqliteAnswerStore(path, max_entries=3)
+    for number in range(5):
+        store.set(f'key{number}', 'ответ', None, clock.now + 100 + number)
+    store.set('expired', 'ответ', None, clock.now - 1)
+    assert store.prune() == 3
+    assert [store.get(f'key{number}') is not None for number in range(5)] == [False, False, True, True, True]
+    store.close()
+    # Истёкшие ответы удаляются уже при открытии файла
+    store = SqliteAnswerStore(path, max_entries=3)
+    clock.now += 103
+    store.close()
+    store = SqliteAnswerStore(path, max_entries=3)
+    assert store._conn.execute('SELECT COUNT(*) FROM answers').fetchone()[0] == 1
+    store.close()
+
+
+def test_start_prunes_on_timer(tmp_path, clock):
+    store = SqliteAnswerStore(str(tmp_path / 'answers.db'))
+    store.set('expired', 'ответ', None, clock.now + 1)
+    cache = AnswerCache(store=store, prune_interval=0.01)
+
+    async def main():
+        clock.now += 2
+        cache.start()
+        await asyncio.sleep(0.05)
+        await cache.stop()
+
+    asyncio.run(main())
+    assert store._conn.execute('SELECT COUNT(*) FROM answers').fetchone()[0] == 0
+    cache.close()
+
+
+def test_store_created_before_usage_column_is_upgraded(tmp_path, clock):
+    import sqlite3
+
+    path = str(tmp_path / 'answers.db')
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE answers (key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL)')
+    connection.execute("INSERT INTO answers VALUES ('old', 'ответ', ?)", (clock.now + 100,))
+    connection.commit()
+    connection.close()
+    store = SqliteAnswerStore(path)
+    assert store.get('old') == ('ответ', None, clock.now + 100)
+    store.set('new', 'ответ', {'total_tokens': 5}, clock.now + 100)
+    assert store.get('new')[1] == {'total_tokens': 5}
+    store.close()
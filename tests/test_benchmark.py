@@ -0,0 +1,87 @@
+import asyncio
+import json
+from collections import Counter
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmark import (
+    LatencyProfile,
+    compare_with_baseline,
+    create_fake_gigachat_app,
+    percentile,
+    summarize,
+    synthetic_updates
+)
+
+
+def test_latency_profile_is_reproducible_and_bounded():
+    first, second = LatencyProfile(0.2, 0.05, error_rate=0.3, seed=7), LatencyProfile(0.2, 0.05, error_rate=0.3, seed=7)
+    delays = [first.delay() for _ in range(100)]
+    assert delays == [second.delay() for _ in range(100)]
+    assert all(0.15 <= delay <= 0.25 for delay in delays)
+    failures = sum(first.fails() for _ in range(1000))
+    assert 200 < failures < 400
+    assert not any(LatencyProfile(seed=1).fails() for _ in range(100))
+
+
+def test_percentiles_use_nearest_rank():
+    values = [n / 1000 for n in range(1, 101)]
+    assert [percentile(values, q) for q in (50, 95, 99, 100)] == [0.05, 0.095, 0.099, 0.1]
+    assert percentile([], 50) == 0.0
+    assert summarize([0.003, 0.001, 0.002]) == {
+        'count': 3, 'mean_ms': 2.0, 'p50_ms': 2.0, 'p95_ms': 3.0, 'p99_ms': 3.0, 'max_ms': 3.0,
+    }
+
+
+def result(throughput, p95, errors=0):
+    row = {'count': 10, 'p50_ms': 1.0, 'p95_ms': p95, 'p99_ms': p95, 'errors': errors}
+    return {'throughput_per_s': throughput, 'handlers': {'start': row}, 'end_to_end': dict(row, errors=0)}
+
+
+def test_compare_with_baseline_ignores_noise_and_flags_regressions():
+    baseline = result(100, 50.0)
+    assert compare_with_baseline(result(90, 59.0), baseline) == []
+    # Рост на 100% при разнице меньше min_delta_ms — шум
+    assert compare_with_baseline(result(100, 4.0), result(100, 2.0)) == []
+    regressions = compare_with_baseline(result(70, 80.0, errors=1), baseline)
+    assert len(regressions) == 6
+    assert regressions[0].startswith('пропускная способность')
+    assert 'start ошибки: 1 > 0' in regressions
+
+
+def test_synthetic_updates_keep_each_users_order():
+    updates = synthetic_updates(users=5, questions_per_user=2, seed=3)
+    assert updates == synthetic_updates(users=5, questions_per_user=2, seed=3)
+    assert [update['update_id'] for update in updates] == list(range(1, len(updates) + 1))
+    steps = {}
+    for update in updates:
+        kind = next(key for key in update if key != 'update_id')
+        body = update[kind]
+        steps.setdefault(body['from']['id'], []).append(body.get('text') or body.get('data') or body.get('query'))
+    assert sorted(steps) == [1, 2, 3, 4, 5]
+    for user_steps in steps.values():
+        assert user_steps[:2] == ['/start', '/setsubjects']
+        assert user_steps[-2].startswith('Объясни') and user_steps[-1].startswith('Объясни')
+
+
+def test_fake_gigachat_answers_streams_and_injects_errors():
+    async def run():
+        stats = Counter()
+        app = create_fake_gigachat_app(LatencyProfile(seed=0), stats, answer_length=100, stream_chunks=4)
+        async with TestClient(TestServer(app)) as client:
+            payload = {'messages': [{'role': 'user', 'content': 'Что такое интеграл?'}]}
+            response = await client.post('/api/v1/chat/completions', json=payload)
+            answer = (await response.json())['choices'][0]['message']['content']
+            response = await client.post('/api/v1/chat/completions', json=dict(payload, stream=True))
+            events = [line[len('data: '):] for line in (await response.text()).split('\n\n') if line]
+            failing = create_fake_gigachat_app(LatencyProfile(error_rate=1.0, seed=0), stats)
+            async with TestClient(TestServer(failing)) as failing_client:
+                status = (await failing_client.post('/api/v1/chat/completions', json=payload)).status
+        chunks = [json.loads(event)['choices'][0]['delta']['content'] for event in events[:-1]]
+        return answer, chunks, events[-1], status, stats
+
+    answer, chunks, last, status, stats = asyncio.run(run())
+    assert len(answer) == 100 and 'интеграл' in answer
+    assert len(chunks) == 4 and ''.join(chunks) == answer
+    assert last == '[DONE]' and status == 500
+    assert stats == Counter({'gigachat.requests': 3, 'gigachat.errors': 1})
@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+
+class FakeQuery:
+    def __init__(self, data):
+        self.data = data
+        self.from_user = SimpleNamespace(id=1, username='user')
+        self.answers = []
+        self.edits = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+
+
+def press(data):
+    query = FakeQuery(data)
+    asyncio.run(bot.button_handler(SimpleNamespace(callback_query=query), None))
+    return query
+
+
+@pytest.mark.parametrize('data', [
+    'subjects:abc',
+    'subjects:-1',
+    f'subjects:{1 << 40}',
+    'done:x',
+    'res:1',
+    'res:1:x:',
+    'res:1:99:',
+    'res:1:-1:',
+    'res:1:1:?0.1',
+    'res:1:1:>0',
+])
+def test_forged_callback_data_reports_expired_keyboard(data):
+    query = press(data)
+    assert query.answers == [bot.KEYBOARD_EXPIRED_MESSAGE]
+    assert query.edits == []
+
+
+def test_subject_toggle_edits_keyboard():
+    query = press('subjects:3')
+    assert query.answers == [None]
+    assert query.edits == [bot.SUBJECTS_PROMPT]
+
+
+def test_parse_resources_callback():
+    assert bot.parse_resources_callback('res:3:1:>0.5') == (3, 1, '>0.5')
+    assert bot.parse_resources_callback('res:3:0:') == (3, 0, '')
@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+from activity import ActivityBuffer, TOKENS
+from answer_cache import AnswerCache
+from conversation import ConversationStore
+from scheduler import LLMScheduler
+
+USAGE = {'prompt_tokens': 40, 'completion_tokens': 60}
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+
+def question_update(user_id, text):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=FakeMessage(text))
+
+
+@pytest.fixture
+def bot_state(monkeypatch):
+    calls = []
+
+    async def send_message(question, history=None, grounding=None, on_usage=None):
+        calls.append(question)
+        await asyncio.sleep(0.01)
+        if on_usage is not None:
+            on_usage(dict(USAGE))
+        return f'Ответ на «{question}»'
+
+    activity = ActivityBuffer(token_limit=150, session_factory=None)
+    monkeypatch.setattr(bot, 'GIGACHAT_STREAMING', False)
+    monkeypatch.setattr(bot, 'activity', activity)
+    monkeypatch.setattr(bot, 'answer_cache', AnswerCache())
+    monkeypatch.setattr(bot, 'conversations', ConversationStore())
+    monkeypatch.setattr(bot, 'llm_scheduler', LLMScheduler())
+    monkeypatch.setattr(bot.async_giga_chat_api, 'send_message', send_message)
+    return activity, calls
+
+
+def ask(*updates):
+    async def main():
+        await asyncio.gather(*(bot.handle_question(update, None) for update in updates))
+
+    asyncio.run(main())
+
+
+def test_coalesced_and_cached_answers_are_charged_to_every_user(bot_state):
+    activity, calls = bot_state
+    ask(question_update(1, 'Что такое интеграл?'), question_update(2, 'что такое интеграл'))
+    ask(question_update(3, 'Что такое интеграл'))
+    # GigaChat спросили один раз, а токены списаны с каждого получившего ответ
+    assert len(calls) == 1
+    assert {user_id: activity._usage[user_id][1] for user_id in (1, 2, 3)} == {1: 100, 2: 100, 3: 100}
+
+
+def test_cached_answer_counts_towards_token_quota(bot_state):
+    activity, calls = bot_state
+    activity.token_limit = 100
+    ask(question_update(1, 'Что такое интеграл?'))
+    # Ответ из кэша исчерпывает квоту второго пользователя так же, как запрос к GigaChat
+    ask(question_update(2, 'Что такое интеграл?'))
+    assert activity.check_quota(2) == TOKENS
+    update = question_update(2, 'Что такое ряд?')
+    ask(update)
+    assert update.message.replies == [bot.QUOTA_MESSAGE]
+    assert len(calls) == 1
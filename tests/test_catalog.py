@@ -0,0 +1,69 @@
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+
+from catalog import ResourceCatalog
+from models import Resource
+
+
+def add_resources(session_factory, titles):
+    with session_factory() as session:
+        session.add_all([
+            Resource(subject_id=1, type_id=1, title=title, link=f'https://example.com/{title}') for title in titles
+        ])
+        session.commit()
+
+
+def test_incremental_refresh_swaps_indexes(database_url):
+    session_factory = sessionmaker(create_engine(database_url))
+    add_resources(session_factory, ['интегралы', 'производные'])
+    catalog = ResourceCatalog(session_factory=session_factory)
+    assert catalog.refresh(force=True)
+    search_index, retrieval_index = catalog._search_index, catalog._retrieval_index
+    assert not catalog.refresh()
+
+    add_resources(session_factory, ['интегралы по частям'])
+    version = catalog.version
+    assert catalog.refresh()
+    # Старые индексы не изменились: поиск, начатый до обновления, видит прежний снимок
+    assert catalog._search_index is not search_index and catalog._retrieval_index is not retrieval_index
+    assert len(search_index) == len(retrieval_index) == 2
+    assert [entry.title for entry in search_index.search('интегралы')] == ['интегралы']
+    assert catalog.version == version + 1 and len(catalog) == 3
+    assert [entry.title for entry in catalog.search('интегралы')] == ['интегралы по частям', 'интегралы']
+    assert catalog.related('интегралы по частям')[0][0].title == 'интегралы по частям'
+
+
+def test_deleted_rows_trigger_full_reload(database_url):
+    session_factory = sessionmaker(create_engine(database_url))
+    add_resources(session_factory, ['интегралы', 'производные'])
+    catalog = ResourceCatalog(session_factory=session_factory)
+    catalog.refresh(force=True)
+    with session_factory() as session:
+        session.execute(delete(Resource).where(Resource.title == 'интегралы'))
+        session.commit()
+    add_resources(session_factory, ['ряды'])
+    assert catalog.refresh()
+    assert len(catalog) == 2
+    assert catalog.search('интегралы') == []
+
+
+def test_incremental_refresh_indexes_only_new_rows(database_url, monkeypatch):
+    import retrieval
+    import search
+
+    session_factory = sessionmaker(create_engine(database_url))
+    add_resources(session_factory, [f'материал {number}' for number in range(50)])
+    catalog = ResourceCatalog(session_factory=session_factory)
+    catalog.refresh(force=True)
+
+    indexed = []
+    tokenize, stems = search.tokenize, retrieval.stems
+    monkeypatch.setattr(search, 'tokenize', lambda text: indexed.append(text) or tokenize(text))
+    monkeypatch.setattr(retrieval, 'stems', lambda text: indexed.append(text) or stems(text))
+    add_resources(session_factory, ['новый конспект'])
+    assert catalog.refresh()
+    # Разбираются только название и факеты новой строки, а не весь каталог
+    assert indexed and all('новый конспект' in text or 'материал' not in text for text in indexed)
+    assert len(indexed) <= 3
+    assert [entry.title for entry in catalog.search('конспект')] == ['новый конспект']
+    assert catalog.search('материал', 100)[-1].title == 'материал 0'
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+import conversation
+from conversation import CHARS_PER_TOKEN, TRUNCATION_MARK, ConversationStore, SqliteConversationStore, estimate_tokens
+
+
+class FakeTime:
+    """Заменяет модуль time в conversation: и monotonic(), и time() управляются тестом."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(conversation, 'time', clock)
+    return clock
+
+
+def text(tokens):
+    """Строка, которая оценивается ровно в tokens токенов."""
+    return 'я' * ((tokens - 1) * CHARS_PER_TOKEN)
+
+
+def test_history_fits_budget_and_starts_with_user():
+    async def run():
+        store = ConversationStore(token_budget=100)
+        for number in range(3):
+            await store.append(1, f'вопрос {number} ' + text(10), f'ответ {number} ' + text(20))
+        question = text(40)
+        history = await store.history(1, question)
+        return history, estimate_tokens(question)
+
+    history, question_tokens = asyncio.run(run())
+    assert sum(estimate_tokens(turn['content']) for turn in history) + question_tokens <= 100
+    # Влезает только последняя пара: отброшенный вопрос не оставляет ответ без начала
+    assert [turn['role'] for turn in history] == ['user', 'assistant']
+    assert history[0]['content'].startswith('вопрос 2')
+
+
+def test_max_turns_keeps_latest_turns():
+    async def run():
+        store = ConversationStore(max_turns=4, token_budget=10_000)
+        for number in range(5):
+            await store.append(1, f'вопрос {number}', f'ответ {number}')
+        return await store.history(1, 'ещё')
+
+    assert [turn['content'] for turn in asyncio.run(run())] == ['вопрос 3', 'ответ 3', 'вопрос 4', 'ответ 4']
+
+
+def test_fit_question_truncates_to_budget():
+    store = ConversationStore(token_budget=10)
+    question = store.fit_question('а' * 100)
+    assert len(question) == 10 * CHARS_PER_TOKEN and question.endswith(TRUNCATION_MARK)
+    assert store.fit_question('коротко') == 'коротко'
+
+
+def test_idle_and_least_recent_users_are_forgotten(clock):
+    async def run():
+        store = ConversationStore(max_users=2, ttl=60)
+        await store.append(1, 'вопрос', 'ответ')
+        await store.append(2, 'вопрос', 'ответ')
+        await store.history(1, 'ещё')
+        await store.append(3, 'вопрос', 'ответ')
+        # Пользователь 2 вытеснен как самый давно активный
+        evicted = await store.history(2, 'ещё')
+        clock.now += 61
+        expired = await store.history(1, 'ещё')
+        return evicted, expired, len(store)
+
+    assert asyncio.run(run()) == ([], [], 0)
+
+
+def test_persistent_history_survives_restart_and_expires(tmp_path, clock):
+    path = str(tmp_path / 'conversations.db')
+
+    async def first_run():
+        store = ConversationStore(max_turns=4, store=SqliteConversationStore(path))
+        for number in range(3):
+            await store.append(1, f'вопрос {number}', f'ответ {number}')
+        await store.append(2, 'вопрос', 'ответ')
+        await store.clear(2)
+        store.close()
+
+    async def second_run():
+        store = ConversationStore(ttl=60, store=SqliteConversationStore(path))
+        restored = await store.history(1, 'ещё')
+        cleared = await store.history(2, 'ещё')
+        store._conversations.clear()
+        clock.now += 61
+        expired = await store.history(1, 'ещё')
+        store.close()
+        return [turn['content'] for turn in restored], cleared, expired
+
+    asyncio.run(first_run())
+    restored, cleared, expired = asyncio.run(second_run())
+    # В файле остаются только max_turns последних реплик
+    assert restored == ['вопрос 1', 'ответ 1', 'вопрос 2', 'ответ 2']
+    assert cleared == [] and expired == []
@@ -0,0 +1,122 @@
+import asyncio
+import gc
+import logging
+
+import httpx
+import pytest
+
+from gigachat import AsyncGigaChatAPI, GigaChatError
+from resilience import OPEN, CircuitBreaker
+
+
+def make_api(handler=None, **kwargs):
+    api = AsyncGigaChatAPI('key', breaker=CircuitBreaker(window=1, min_calls=1), max_retries=0, **kwargs)
+
+    async def get_access_token():
+        return 'token'
+
+    api.get_access_token = get_access_token
+    if handler is not None:
+        api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return api
+
+
+def test_hedged_call_retrieves_losing_error(monkeypatch, caplog):
+    api = make_api(hedge_percentile=50, hedge_min_delay=0.01, hedge_min_samples=1)
+    api.latencies.observe(0.01)
+    calls = []
+
+    async def complete(payload):
+        calls.append(payload)
+        if len(calls) % 2:
+            await release.wait()
+            raise httpx.ConnectError('primary failed')
+        # Хедж отвечает в той же итерации, в которой падает основной запрос
+        release.set()
+        return {'choices': [{'message': {'content': 'ok'}}]}
+
+    monkeypatch.setattr(api, '_complete', complete)
+
+    async def main():
+        nonlocal release
+        results = []
+        # Порядок задач в наборе done не определён, поэтому сценарий повторяется
+        for _ in range(20):
+            release = asyncio.Event()
+            results.append(await api._complete_hedged({}))
+        await asyncio.sleep(0)
+        return results
+
+    release = None
+    with caplog.at_level(logging.ERROR, logger='asyncio'):
+        results = asyncio.run(main())
+        gc.collect()
+    assert all(result['choices'][0]['message']['content'] == 'ok' for result in results)
+    assert len(calls) == 40
+    assert 'never retrieved' not in caplog.text
+
+
+def test_hedged_call_awaits_cancelled_loser(monkeypatch):
+    api = make_api(hedge_percentile=50, hedge_min_delay=0.01, hedge_min_samples=1)
+    api.latencies.observe(0.01)
+    cancelled = []
+
+    async def complete(payload):
+        if not cancelled:
+            cancelled.append(False)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled[0] = True
+                raise
+        return {'choices': [{'message': {'content': 'hedge'}}]}
+
+    monkeypatch.setattr(api, '_complete', complete)
+    result = asyncio.run(api._complete_hedged({}))
+    assert result['choices'][0]['message']['content'] == 'hedge'
+    # Проигравший запрос отменён и завершён до возврата ответа
+    assert cancelled == [True]
+
+
+class HangingStream(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        yield b'data: {"choices": [{"delta": {"content": "part"}}]}\n\n'
+        await asyncio.sleep(10)
+        yield b'data: [DONE]\n\n'
+
+
+def test_stream_timeout_opens_breaker():
+    def handler(request):
+        return httpx.Response(200, stream=HangingStream())
+
+    api = make_api(handler, total_timeout=0.2)
+
+    async def main():
+        chunks = []
+        with pytest.raises(GigaChatError, match='timeout'):
+            async for chunk in api.stream_message('вопрос'):
+                chunks.append(chunk)
+        await api._client.aclose()
+        return chunks
+
+    assert asyncio.run(main()) == ['part']
+    assert api.breaker.state == OPEN
+
+
+def test_stream_returns_chunks_and_usage():
+    body = (
+        b'data: {"choices": [{"delta": {"content": "one "}}]}\n\n'
+        b'data: {"choices": [{"delta": {"content": "two"}}], "usage": {"total_tokens": 3}}\n\n'
+        b'data: [DONE]\n\n'
+    )
+    api = make_api(lambda request: httpx.Response(200, content=body))
+    usages = []
+
+    async def main():
+        chunks = [chunk async for chunk in api.stream_message('вопрос', on_usage=usages.append)]
+        await api._client.aclose()
+        return chunks
+
+    assert asyncio.run(main()) == ['one ', 'two']
+    assert {'total_tokens': 3} in usages
+    assert api.breaker.allow()
@@ -0,0 +1,76 @@
+import builtins
+import os
+import subprocess
+import sys
+import types
+
+from click.testing import CliRunner
+
+import manage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_cli_does_not_load_command_dependencies():
+    # Отдельный интерпретатор: в процессе тестов эти модули уже загружены
+    code = (
+        'import sys, manage; '
+        "print(' '.join(name for name in ('models', 'sqlalchemy', 'alembic', 'validators', 'bot', 'telegram', 'dotenv') "
+        'if name in sys.modules))'
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
+
+
+def test_import_profiler_reports_nested_imports(tmp_path, monkeypatch):
+    (tmp_path / 'profiled_outer.py').write_text('import profiled_inner\n')
+    (tmp_path / 'profiled_inner.py').write_text('VALUE = 1\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    profiler = manage.ImportProfiler()
+    profiler.install()
+    try:
+        import profiled_outer  # noqa: F401
+    finally:
+        profiler.uninstall()
+        sys.modules.pop('profiled_outer', None)
+        sys.modules.pop('profiled_inner', None)
+
+    records = {name: (elapsed, self_time, depth) for name, elapsed, self_time, depth in profiler.records}
+    outer, inner = records['profiled_outer'], records['profiled_inner']
+    assert (outer[2], inner[2]) == (0, 1)
+    assert outer[0] >= inner[0] and abs(outer[0] - inner[0] - outer[1]) < 1e-9
+
+
+def test_profile_startup_prints_breakdown_after_command(monkeypatch):
+    original_import = builtins.__import__
+    monkeypatch.chdir(ROOT)
+    result = CliRunner().invoke(manage.cli, ['--profile-startup', 'status'])
+    assert builtins.__import__ is original_import
+    assert 'Профиль запуска' in result.output and 'Общее время работы' in result.output
+
+
+def test_schema_heads_skip_contract_branch(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    config = manage.alembic_config()
+    from alembic.script import ScriptDirectory
+
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    assert set(manage.schema_heads(config)) == heads - {'0a6d4e93c1f5'}
+    assert len(heads) == 2
+
+
+def test_runbot_runs_in_process(monkeypatch):
+    calls = []
+    fake_bot = types.ModuleType('bot')
+    fake_bot.BOT_CONCURRENT_UPDATES = 8
+    fake_bot.main = lambda **options: calls.append(options)
+    monkeypatch.setitem(sys.modules, 'bot', fake_bot)
+    monkeypatch.setattr(manage, 'upgrade_schema', lambda config: calls.append('upgrade'))
+    monkeypatch.setattr(subprocess, 'run', None)
+
+    result = CliRunner().invoke(manage.cli, ['runbot', '--mode', 'webhook', '--port', '8443'])
+    assert result.exit_code == 0, result.output
+    assert calls == [
+        'upgrade',
+        {'mode': 'webhook', 'concurrent_updates': 8, 'host': None, 'port': 8443, 'webhook_url': None},
+    ]
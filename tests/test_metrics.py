@@ -0,0 +1,97 @@
+import asyncio
+import socket
+import urllib.request
+
+import pytest
+from prometheus_client.core import REGISTRY
+from sqlalchemy import create_engine, text
+
+import metrics
+from answer_cache import AnswerCache
+from scheduler import LLMScheduler
+
+
+def sample(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0.0
+
+
+def test_timed_handler_records_latency_errors_and_in_progress():
+    async def metrics_probe(update, context):
+        assert sample('studyhomie_updates_in_progress') == 1
+        if update == 'bad':
+            raise RuntimeError('boom')
+
+    handler = metrics.timed_handler(metrics_probe)
+    labels = {'handler': 'metrics_probe'}
+    asyncio.run(handler('good', None))
+    with pytest.raises(RuntimeError):
+        asyncio.run(handler('bad', None))
+    assert handler.__name__ == 'metrics_probe'
+    assert sample('studyhomie_handler_duration_seconds_count', labels) == 2
+    assert sample('studyhomie_handler_errors_total', labels) == 1
+    assert sample('studyhomie_updates_in_progress') == 0
+
+
+def test_gigachat_observations():
+    before = {
+        'prompt': sample('studyhomie_gigachat_tokens_total', {'kind': 'prompt'}),
+        'completion': sample('studyhomie_gigachat_tokens_total', {'kind': 'completion'}),
+        'responses': sample('studyhomie_gigachat_responses_total', {'operation': 'completion', 'status': '429'}),
+    }
+    metrics.record_token_usage({'prompt_tokens': 12, 'completion_tokens': 30, 'total_tokens': 42})
+    metrics.record_token_usage(None)
+    metrics.observe_gigachat('completion', 429, 0.3)
+    assert sample('studyhomie_gigachat_tokens_total', {'kind': 'prompt'}) - before['prompt'] == 12
+    assert sample('studyhomie_gigachat_tokens_total', {'kind': 'completion'}) - before['completion'] == 30
+    assert sample('studyhomie_gigachat_responses_total', {'operation': 'completion', 'status': '429'}) - before['responses'] == 1
+
+    metrics.set_breaker_state('open')
+    states = [sample('studyhomie_gigachat_breaker_state', {'state': state}) for state in metrics.BREAKER_STATES]
+    metrics.set_breaker_state('closed')
+    assert states == [0, 1, 0]
+
+
+def test_instrument_engine_times_each_query_once():
+    engine = create_engine('sqlite://')
+    labels = {'engine': 'metrics_test'}
+    metrics.instrument_engine(engine, 'metrics_test')
+    metrics.instrument_engine(engine, 'metrics_test')
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+        connection.execute(text('SELECT 2'))
+    assert sample('studyhomie_db_query_duration_seconds_count', labels) == 2
+
+
+def test_state_collector_reads_component_counters(monkeypatch):
+    for name in ('token_manager', 'scheduler', 'answer_cache', 'rate_limiter', 'activity'):
+        monkeypatch.setattr(metrics.state_collector, name, None)
+    scheduler, cache = LLMScheduler(), AnswerCache()
+
+    async def fill():
+        async def compute():
+            return 'ответ', None
+
+        await scheduler.run(1, compute)
+        await cache.get_or_compute('вопрос', compute)
+        await cache.get('вопрос')
+
+    asyncio.run(fill())
+    metrics.watch(scheduler=scheduler, answer_cache=cache)
+    assert sample('studyhomie_llm_requests_total', {'outcome': 'completed'}) == 1
+    assert sample('studyhomie_llm_queued') == 0
+    assert sample('studyhomie_answer_cache_lookups_total', {'result': 'hits'}) == 1
+    assert sample('studyhomie_answer_cache_entries') == 1
+    assert REGISTRY.get_sample_value('studyhomie_gigachat_token_refreshes_total') is None
+
+
+def test_metrics_server_serves_local_endpoint():
+    assert metrics.start_metrics_server(port=0) is None
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = metrics.start_metrics_server('127.0.0.1', port)
+    try:
+        body = urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5).read().decode()
+    finally:
+        server.shutdown()
+    assert 'studyhomie_handler_duration_seconds' in body
@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest, Forbidden, NetworkError, TimedOut
+
+from notifications import format_notification, send_batch
+
+
+class FakeBot:
+    """Отвечает на send_message по сценарию: {chat_id: [ошибка или None на каждую попытку]}."""
+
+    def __init__(self, script):
+        self.script = script
+        self.calls = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(chat_id)
+        outcomes = self.script.get(chat_id, [])
+        outcome = outcomes.pop(0) if outcomes else None
+        if outcome is not None:
+            raise outcome
+        return SimpleNamespace(chat_id=chat_id)
+
+
+def test_format_notification_escapes_markdown():
+    resource = SimpleNamespace(
+        subject='Информатика',
+        type='Статья',
+        title='snake_case, *args и [списки]',
+        link='https://example.com/a_(b)'
+    )
+    text = format_notification(resource)
+    assert r'snake\_case, \*args и \[списки\]' in text
+    assert r'(https://example.com/a_(b\))' in text
+    assert r'Информатика\!' in text
+
+
+def test_send_batch_retries_transient_errors():
+    bot = FakeBot({1: [NetworkError('reset'), TimedOut()], 2: [Forbidden('blocked')], 3: [BadRequest('chat not found')]})
+    sent, failed = asyncio.run(send_batch(bot, [1, 2, 3, 4], 'text', max_retries=3, retry_delay=0))
+    assert (sent, failed) == (2, 2)
+    assert bot.calls.count(1) == 3
+    assert bot.calls.count(2) == 1
+
+
+def test_send_batch_raises_when_retries_run_out():
+    bot = FakeBot({1: [NetworkError('down')] * 3})
+    with pytest.raises(NetworkError):
+        asyncio.run(send_batch(bot, [1, 2], 'text', max_retries=2, retry_delay=0))
+    # Успешный чат отправляется один раз, повторяется только недоставленный
+    assert bot.calls.count(2) == 1
@@ -0,0 +1,29 @@
+import asyncio
+
+from rate_limiter import BULK, PRIORITY_INTERACTIVE, OutboundRateLimiter
+
+
+def test_interactive_requests_overtake_queued_bulk():
+    async def run():
+        limiter = OutboundRateLimiter(global_rate=10, global_burst=1, private_chat_rate=0)
+        order = []
+
+        async def send(name):
+            order.append(name)
+
+        bulk = [
+            asyncio.create_task(limiter.process_request(send, (f'bulk-{n}',), {}, 'sendMessage', {'chat_id': n}, BULK))
+            for n in range(5)
+        ]
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(
+            limiter.process_request(send, ('reply',), {}, 'sendMessage', {'chat_id': 100}, PRIORITY_INTERACTIVE)
+        )
+        await asyncio.gather(*bulk, interactive)
+        await limiter.shutdown()
+        return order
+
+    order = asyncio.run(run())
+    # Первый запрос рассылки забирает единственный токен, ответ идёт следующим
+    assert order[:2] == ['bulk-0', 'reply']
+    assert sorted(order[2:]) == ['bulk-1', 'bulk-2', 'bulk-3', 'bulk-4']
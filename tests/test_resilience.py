@@ -0,0 +1,107 @@
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, LatencyWindow
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock, changes, **kwargs):
+    options = dict(window=4, min_calls=4, failure_rate=0.5, open_duration=10.0, on_change=changes.append, clock=clock)
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+def test_opens_after_failure_rate_and_rejects_calls():
+    clock, changes = FakeClock(), []
+    breaker = make_breaker(clock, changes)
+    for failed in (False, True, False):
+        breaker.record(failed, 0.1)
+    # Меньше min_calls вызовов — решение не принимается
+    assert breaker.state == CLOSED
+    breaker.record(True, 0.1)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+    assert changes == [OPEN]
+
+
+def test_half_open_probe_success_closes_circuit():
+    clock, changes = FakeClock(), []
+    breaker = make_breaker(clock, changes, min_calls=1, window=1)
+    breaker.record(True, 0.1)
+    clock.now = 10.0
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Пока идёт пробный вызов, остальные отклоняются
+    assert not breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    assert changes == [OPEN, HALF_OPEN, CLOSED]
+
+
+def test_half_open_probe_failure_reopens_circuit():
+    clock, changes = FakeClock(), []
+    breaker = make_breaker(clock, changes, min_calls=1, window=1)
+    breaker.record(True, 0.1)
+    clock.now = 10.0
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == OPEN
+    clock.now = 15.0
+    assert not breaker.allow()
+    clock.now = 20.0
+    assert breaker.allow()
+    assert changes == [OPEN, HALF_OPEN, OPEN, HALF_OPEN]
+
+
+def test_lost_probe_is_replaced_after_open_duration():
+    clock, changes = FakeClock(), []
+    breaker = make_breaker(clock, changes, min_calls=1, window=1)
+    breaker.record(True, 0.1)
+    clock.now = 10.0
+    assert breaker.allow()
+    clock.now = 15.0
+    assert not breaker.allow()
+    clock.now = 20.0
+    assert breaker.allow()
+
+
+def test_slow_calls_open_circuit():
+    clock, changes = FakeClock(), []
+    breaker = make_breaker(clock, changes, slow_call=1.0, slow_rate=0.75)
+    for elapsed in (2.0, 2.0, 0.1):
+        breaker.record(False, elapsed)
+    assert breaker.state == CLOSED
+    breaker.record(False, 3.0)
+    assert breaker.state == OPEN
+
+
+def test_window_forgets_old_outcomes():
+    clock, changes = FakeClock(), []
+    breaker = make_breaker(clock, changes, failure_rate=0.75)
+    for failed in (True, True, False, False, False, True):
+        breaker.record(failed, 0.1)
+    assert breaker.state == CLOSED
+
+
+def test_disabled_breaker_always_allows():
+    breaker = CircuitBreaker(window=0)
+    for _ in range(50):
+        breaker.record(True, 1.0)
+    assert breaker.allow() and breaker.state == CLOSED
+
+
+def test_latency_window_percentile():
+    window = LatencyWindow(size=4)
+    assert window.percentile(50) is None
+    for value in (5, 1, 4, 2, 3):
+        window.observe(value)
+    # Первое значение (5) вытеснено из окна
+    assert len(window) == 4
+    assert window.percentile(50) == 3
+    assert window.percentile(99) == 4
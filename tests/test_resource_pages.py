@@ -0,0 +1,94 @@
+import asyncio
+import random
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import Resource
+from resource_pages import AFTER, BEFORE, PageCache, fetch_page
+
+
+@pytest.fixture
+def resources(database_url):
+    rng = random.Random(0)
+    rows = [(rng.randint(1, 4), rng.randint(1, 3)) for _ in range(60)]
+    engine = create_engine(database_url)
+    with Session(engine) as session:
+        session.add_all([
+            Resource(subject_id=subject_id, type_id=type_id, title=f'Материал {number}', link=f'https://example.com/{number}')
+            for number, (subject_id, type_id) in enumerate(rows)
+        ])
+        session.commit()
+        keys = [(resource.subject_id, resource.type_id, resource.id) for resource in session.query(Resource)]
+    engine.dispose()
+    return keys
+
+
+def expected_ids(keys, subject_ids, type_id=None):
+    return [
+        resource_id for subject_id, resource_type, resource_id in sorted(keys, key=lambda key: (key[0], key[2]))
+        if subject_id in subject_ids and (type_id is None or resource_type == type_id)
+    ]
+
+
+def walk(session_factory, subject_ids, type_id=None, limit=7):
+    """Листает вперёд до конца, затем назад до начала; возвращает id страниц в обоих направлениях."""
+
+    async def main():
+        forward, backward = [], []
+        async with session_factory() as session:
+            page = await fetch_page(session, subject_ids, type_id, limit=limit)
+            assert not page.has_prev
+            forward.append(page)
+            while page.has_next:
+                last = page.entries[-1]
+                page = await fetch_page(session, subject_ids, type_id, AFTER, (last.subject_id, last.id), limit)
+                assert page.has_prev
+                forward.append(page)
+            backward.append(page)
+            while page.has_prev:
+                first = page.entries[0]
+                page = await fetch_page(session, subject_ids, type_id, BEFORE, (first.subject_id, first.id), limit)
+                assert page.has_next
+                backward.append(page)
+        return forward, backward
+
+    forward, backward = asyncio.run(main())
+    return [[entry.id for entry in page.entries] for page in forward], [[entry.id for entry in page.entries] for page in backward]
+
+
+@pytest.mark.parametrize('subject_ids, type_id', [([1, 2, 3, 4], None), ([2, 4], None), ([1, 3], 2), ([4], 3)])
+def test_keyset_pages_cover_all_rows_in_order(resources, async_session_factory, subject_ids, type_id):
+    expected = expected_ids(resources, subject_ids, type_id)
+    forward, backward = walk(async_session_factory, subject_ids, type_id)
+    assert [resource_id for page in forward for resource_id in page] == expected
+    assert all(len(page) == 7 for page in forward[:-1])
+    # Назад от последней страницы листаются те же материалы, страницы выровнены по ключу
+    assert [resource_id for page in reversed(backward[1:]) for resource_id in page] == expected[:len(expected) - len(forward[-1])]
+    assert all(len(page) == 7 for page in backward[1:])
+
+
+def test_empty_subjects_give_empty_page(resources, async_session_factory):
+    forward, _ = walk(async_session_factory, [9])
+    assert forward == [[]]
+
+
+def test_page_entries_carry_lookup_names(resources, async_session_factory):
+    async def main():
+        async with async_session_factory() as session:
+            return await fetch_page(session, [1], limit=1)
+
+    entry = asyncio.run(main()).entries[0]
+    assert entry.subject == 'Математика' and entry.type in ('Статья', 'Видео', 'Туториал')
+
+
+def test_page_cache_is_dropped_on_new_version():
+    cache = PageCache(max_size=2)
+    cache.set('a', 1, 'page a')
+    cache.set('b', 1, 'page b')
+    assert cache.get('a', 1) == 'page a'
+    cache.set('c', 1, 'page c')
+    # Вытеснена давно не использованная страница b
+    assert cache.get('b', 1) is None and cache.get('a', 1) == 'page a'
+    assert cache.get('a', 2) is None and len(cache) == 0
@@ -0,0 +1,104 @@
+import math
+
+import pytest
+
+from catalog import CatalogEntry
+from retrieval import RetrievalIndex, stems
+
+
+def entry(resource_id, title, subject='Математика', type='Статья'):
+    return CatalogEntry(resource_id, subject, type, title, f'https://example.com/{resource_id}')
+
+
+ENTRIES = [
+    entry(1, 'Производная сложной функции'),
+    entry(2, 'Таблица производных'),
+    entry(3, 'Интегралы по частям'),
+    entry(4, 'Законы Ньютона', subject='Физика', type='Видео'),
+    entry(5, 'Производная и интеграл: связь', type='Видео'),
+]
+
+
+def brute_force(entries, question):
+    """Косинусное сходство по той же формуле TF-IDF, посчитанное напрямую."""
+    documents = [stems(f'{e.title} {e.subject} {e.type}') for e in entries]
+    size = len(documents)
+    frequency = {}
+    for terms in documents:
+        for term in set(terms):
+            frequency[term] = frequency.get(term, 0) + 1
+
+    def vector(terms):
+        counts = {}
+        for term in terms:
+            if term in frequency:
+                counts[term] = counts.get(term, 0) + 1
+        weights = {
+            term: (1 + math.log(count)) * (math.log((1 + size) / (1 + frequency[term])) + 1)
+            for term, count in counts.items()
+        }
+        norm = math.sqrt(sum(value * value for value in weights.values())) or 1
+        return {term: value / norm for term, value in weights.items()}
+
+    query = vector(stems(question))
+    scores = []
+    for e, terms in zip(entries, documents):
+        document = vector(terms)
+        scores.append((sum(weight * document.get(term, 0) for term, weight in query.items()), e.id))
+    return scores
+
+
+def test_stems_drop_stop_words_and_endings():
+    assert stems('Объясни, что такое производной функции') == ['произв', 'функци']
+
+
+@pytest.mark.parametrize('question', ['производная функции', 'интеграл', 'законы ньютона физика', 'таблица'])
+def test_scores_match_brute_force_and_are_sorted(question):
+    index = RetrievalIndex()
+    index.add(ENTRIES)
+    results = index.search(question, k=3, min_score=0.0)
+    expected = sorted(
+        ((score, resource_id) for score, resource_id in brute_force(ENTRIES, question) if score > 1e-6),
+        key=lambda item: -item[0]
+    )[:3]
+    assert [res.id for res, _ in results] == [resource_id for _, resource_id in expected]
+    for (_, score), (expected_score, _) in zip(results, expected):
+        assert score == pytest.approx(expected_score, rel=1e-4)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_min_score_and_unknown_words():
+    index = RetrievalIndex()
+    index.add(ENTRIES)
+    assert index.search('квантовая хромодинамика') == []
+    assert all(score >= 0.5 for _, score in index.search('производная', k=5, min_score=0.5))
+
+
+def test_search_many_matches_single_searches():
+    index = RetrievalIndex()
+    index.add(ENTRIES)
+    questions = ['производная', 'ньютон', 'ничего']
+    assert index.search_many(questions, k=2) == [index.search(question, k=2) for question in questions]
+
+
+def test_incremental_add_equals_full_build():
+    incremental = RetrievalIndex()
+    incremental.add(ENTRIES[:3])
+    incremental.add(ENTRIES[3:])
+    full = RetrievalIndex()
+    full.add(ENTRIES)
+    for question in ('производная', 'интеграл видео', 'ньютон'):
+        assert [(res.id, pytest.approx(score)) for res, score in incremental.search(question, k=5)] == [
+            (res.id, score) for res, score in full.search(question, k=5)
+        ]
+
+
+def test_copy_leaves_original_untouched():
+    original = RetrievalIndex()
+    original.add(ENTRIES[:3])
+    before = original.search('интеграл', k=5)
+    extended = original.copy()
+    extended.add([entry(6, 'Интеграл Римана')])
+    assert len(original) == 3 and len(extended) == 4
+    assert original.search('интеграл', k=5) == before
+    assert 6 in [res.id for res, _ in extended.search('интеграл', k=5)]
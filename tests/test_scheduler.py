@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+from answer_cache import AnswerCache
+from scheduler import LLMScheduler, SchedulerBusy
+
+
+class Gate:
+    """Задача, которая ждёт открытия ворот и запоминает, сколько задач выполнялось одновременно."""
+
+    def __init__(self):
+        self.opened = asyncio.Event()
+        self.running = 0
+        self.max_running = 0
+        self.started = []
+
+    def job(self, name):
+        async def run():
+            self.started.append(name)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                await self.opened.wait()
+                return name
+            finally:
+                self.running -= 1
+        return run
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_global_concurrency_limit():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=2, per_user_concurrency=5)
+        gate = Gate()
+        tasks = [asyncio.create_task(scheduler.run(user_id, gate.job(user_id))) for user_id in range(5)]
+        await settle()
+        assert scheduler.running == 2
+        assert scheduler.queue_depth == 3
+        gate.opened.set()
+        assert await asyncio.gather(*tasks) == list(range(5))
+        return gate.max_running, scheduler.stats()
+
+    max_running, stats = asyncio.run(run())
+    assert max_running == 2
+    assert stats['completed'] == 5 and stats['running'] == 0 and stats['queue_depth'] == 0
+
+
+def test_per_user_concurrency_does_not_block_other_users():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=10, per_user_concurrency=1, per_user_max_pending=3)
+        gate = Gate()
+        tasks = [
+            asyncio.create_task(scheduler.run(1, gate.job('a1'))),
+            asyncio.create_task(scheduler.run(1, gate.job('a2'))),
+            asyncio.create_task(scheduler.run(2, gate.job('b1'))),
+        ]
+        await settle()
+        started = list(gate.started)
+        gate.opened.set()
+        await asyncio.gather(*tasks)
+        return started
+
+    assert asyncio.run(run()) == ['a1', 'b1']
+
+
+def test_per_user_pending_cap_and_queue_limit_shed_load():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1, per_user_concurrency=1, per_user_max_pending=2, max_queue=2)
+        gate = Gate()
+        tasks = [asyncio.create_task(scheduler.run(1, gate.job(n))) for n in range(2)]
+        await settle()
+        with pytest.raises(SchedulerBusy):
+            await scheduler.run(1, gate.job('over user cap'))
+        tasks.append(asyncio.create_task(scheduler.run(2, gate.job('b'))))
+        await settle()
+        # В очереди двое (вторая задача пользователя 1 и задача пользователя 2) — очередь полна
+        with pytest.raises(SchedulerBusy):
+            await scheduler.run(3, gate.job('over queue'))
+        gate.opened.set()
+        await asyncio.gather(*tasks)
+        return scheduler.stats()
+
+    assert asyncio.run(run())['shed'] == 2
+
+
+def test_waiting_jobs_run_in_arrival_order():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1, per_user_concurrency=1)
+        gate = Gate()
+        order = []
+
+        def job(name):
+            async def run_job():
+                order.append(name)
+            return run_job
+
+        blocker = asyncio.create_task(scheduler.run(0, gate.job('blocker')))
+        await settle()
+        # Задача пользователя 0 ждёт, пока у него занят слот, но не уступает место тем, кто пришёл позже
+        tasks = [
+            asyncio.create_task(scheduler.run(0, job('user-0'))),
+            asyncio.create_task(scheduler.run(1, job('user-1'))),
+            asyncio.create_task(scheduler.run(None, job('shared'))),
+        ]
+        await settle()
+        gate.opened.set()
+        await asyncio.gather(blocker, *tasks)
+        return order
+
+    assert asyncio.run(run()) == ['user-0', 'user-1', 'shared']
+
+
+def test_cancelled_waiting_job_releases_its_place():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1, per_user_concurrency=1, per_user_max_pending=1)
+        gate = Gate()
+        blocker = asyncio.create_task(scheduler.run(0, gate.job('blocker')))
+        waiting = asyncio.create_task(scheduler.run(1, gate.job('waiting')))
+        await settle()
+        waiting.cancel()
+        await settle()
+        assert scheduler.queue_depth == 0
+        # Отменённая задача больше не занимает лимит пользователя
+        follow_up = asyncio.create_task(scheduler.run(1, gate.job('follow-up')))
+        gate.opened.set()
+        return await asyncio.gather(blocker, follow_up)
+
+    assert asyncio.run(run()) == ['blocker', 'follow-up']
+
+
+def test_coalesced_question_is_not_limited_by_first_callers_cap():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=4, per_user_concurrency=1, per_user_max_pending=1)
+        cache = AnswerCache()
+        gate = Gate()
+        # Пользователь 1 уже исчерпал свой лимит другим вопросом
+        busy = asyncio.create_task(scheduler.run(1, gate.job('other question')))
+        await settle()
+
+        async def compute():
+            return await scheduler.run(None, gate.job('answer')), None
+
+        async def ask(user_id):
+            with scheduler.admit(user_id):
+                answer, _ = await cache.get_or_compute('Что такое интеграл?', compute)
+                return answer
+
+        first = asyncio.create_task(ask(2))
+        await settle()
+        second = asyncio.create_task(ask(3))
+        await settle()
+        with pytest.raises(SchedulerBusy):
+            await ask(1)
+        gate.opened.set()
+        results = await asyncio.gather(first, second, busy)
+        return results, cache.stats(), scheduler.stats()
+
+    results, cache_stats, scheduler_stats = asyncio.run(run())
+    assert results == ['answer', 'answer', 'other question']
+    assert cache_stats['coalesced'] == 1
+    assert scheduler_stats['running'] == 0 and scheduler_stats['queue_depth'] == 0
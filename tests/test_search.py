@@ -0,0 +1,133 @@
+import asyncio
+import random
+
+import pytest
+
+from catalog import CatalogEntry
+from registry import DEFAULT_RESOURCE_TYPES, DEFAULT_SUBJECTS
+from models import Resource
+from search import EXACT_WEIGHT, FACET_WEIGHT, PREFIX_WEIGHT, SearchIndex, search_resources_db, tokenize
+
+WORDS = (
+    'интеграл', 'интегралы', 'производная', 'пример', 'примеры', 'задачи', 'задача', 'физика',
+    'python', 'питон', 'введение', 'курс', 'основы', 'решение', 'функции', 'ряд', 'история', 'статьи'
+)
+QUERIES = (
+    'интеграл физ',
+    'пример задачи',
+    'инт',
+    'п',
+    'задач статья',
+    'python основы видео',
+    'история ист',
+    'несуществующее',
+)
+
+
+def make_entries(count=3000, seed=0):
+    rng = random.Random(seed)
+    return [
+        CatalogEntry(
+            resource_id,
+            rng.choice(DEFAULT_SUBJECTS),
+            rng.choice(DEFAULT_RESOURCE_TYPES),
+            ' '.join(rng.sample(WORDS, rng.randint(1, 4))),
+            f'https://example.com/{resource_id}'
+        )
+        for resource_id in range(1, count + 1)
+    ]
+
+
+def brute_force(entries, query, limit):
+    """Эталон: вес каждого материала по всем словам запроса, затем сортировка."""
+    scored = []
+    for entry in entries:
+        title_tokens = tokenize(entry.title)
+        facet_tokens = tokenize(entry.subject) + tokenize(entry.type)
+        score = 0
+        for text in dict.fromkeys(tokenize(query)):
+            if text in title_tokens:
+                score += EXACT_WEIGHT
+            elif any(token.startswith(text) for token in title_tokens):
+                score += PREFIX_WEIGHT
+            elif any(token.startswith(text) for token in facet_tokens):
+                score += FACET_WEIGHT
+            else:
+                break
+        else:
+            scored.append((score, entry.id))
+    scored.sort(reverse=True)
+    return [entry_id for _, entry_id in scored[:limit]]
+
+
+@pytest.fixture(scope='module')
+def entries():
+    return make_entries()
+
+
+@pytest.mark.parametrize('eager_limit', [50, 1_000_000], ids=['lazy', 'eager'])
+@pytest.mark.parametrize('limit', [1, 10, 20])
+@pytest.mark.parametrize('query', QUERIES)
+def test_search_matches_brute_force(entries, query, limit, eager_limit):
+    index = SearchIndex(eager_limit=eager_limit)
+    index.add(entries)
+    assert [entry.id for entry in index.search(query, limit)] == brute_force(entries, query, limit)
+
+
+def test_search_ignores_empty_query(entries):
+    index = SearchIndex()
+    index.add(entries)
+    assert index.search('  ', 10) == []
+    assert index.search('интеграл', 0) == []
+
+
+def test_search_db_treats_like_wildcards_literally(async_session_factory):
+    async def run():
+        async with async_session_factory() as session:
+            session.add_all([
+                Resource(subject_id=1, type_id=1, title='snake_case в Python', link='https://example.com/1'),
+                Resource(subject_id=1, type_id=1, title='snakeXcase в Python', link='https://example.com/2'),
+            ])
+            await session.commit()
+            return await search_resources_db(session, 'snake_case', 10)
+
+    assert [resource.title for resource in asyncio.run(run())] == ['snake_case в Python']
+
+
+class _PostgresSession:
+    """Сессия, которая выдаёт себя за Postgres и запоминает запрос поиска вместо выполнения."""
+
+    def __init__(self):
+        self.statement = None
+
+    def get_bind(self):
+        from sqlalchemy.dialects import postgresql
+        return type('Bind', (), {'dialect': postgresql.dialect()})()
+
+    async def execute(self, statement):
+        pass
+
+    async def scalars(self, statement):
+        self.statement = statement
+        return []
+
+
+def _compiled_postgres_search(query):
+    session = _PostgresSession()
+    asyncio.run(search_resources_db(session, query, 10))
+    compiled = session.statement.compile(dialect=session.get_bind().dialect)
+    return str(compiled), list(compiled.params.values())
+
+
+def test_search_db_postgres_keeps_short_words_in_text_query():
+    # «в» — начало слова «Видео», но фильтром по типу не становится
+    sql, params = _compiled_postgres_search('задачи в видео')
+    assert 'resources.type_id IN' in sql
+    assert params[:2] == [[DEFAULT_RESOURCE_TYPES.index('Видео') + 1], 'задачи в']
+
+
+def test_search_db_postgres_requires_whole_word_for_facets():
+    # «физ» — лишь начало названия предмета, а «язык» — слово из «Английский язык» целиком
+    sql, params = _compiled_postgres_search('физ язык')
+    assert 'resources.subject_id IN' in sql and 'resources.type_id IN' not in sql
+    assert params[:2] == [[DEFAULT_SUBJECTS.index('Английский язык') + 1, DEFAULT_SUBJECTS.index('Русский язык') + 1], 'физ']
@@ -0,0 +1,68 @@
+import queue
+
+import pytest
+
+from sharding import STOP, LocalTransport, ShardRouter, shard_for, user_id_from_update_data
+
+
+def message_update(update_id, user_id):
+    return {
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'from': {'id': user_id}, 'chat': {'id': user_id}, 'text': 'hi'}
+    }
+
+
+def test_user_id_from_update_data():
+    assert user_id_from_update_data(message_update(1, 42)) == 42
+    assert user_id_from_update_data({'update_id': 2, 'callback_query': {'id': 'q', 'from': {'id': 7}}}) == 7
+    assert user_id_from_update_data({'update_id': 3, 'my_chat_member': {'chat': {'id': -100}}}) == -100
+    assert user_id_from_update_data({'update_id': 4}) == 0
+
+
+def test_shard_for_is_stable_and_covers_negative_ids():
+    assert shard_for(10, 4) == 2
+    assert shard_for(-10, 4) == 2
+    assert all(0 <= shard_for(user_id, 3) < 3 for user_id in range(-50, 50))
+
+
+def test_router_keeps_user_updates_on_one_shard_in_order():
+    transport = LocalTransport(3)
+    router = ShardRouter(transport)
+    updates = [message_update(update_id, user_id) for update_id, user_id in enumerate([1, 2, 3, 1, 4, 1, 2], 1)]
+    for update in updates:
+        assert router.route(update)
+    assert router.routed == len(updates)
+    assert [transport.depth(shard) for shard in range(3)] == [1, 4, 2]
+
+    received = []
+    while (data := transport.receive(1, timeout=0)) is not None:
+        received.append(data['update_id'])
+    # Пользователи 1 и 4 попадают в шард 1, обновления пользователя 1 идут по порядку
+    assert received == [1, 4, 5, 6]
+
+
+def test_route_does_not_block_on_full_queue():
+    transport = LocalTransport(1, maxsize=2)
+    router = ShardRouter(transport)
+    assert router.route(message_update(1, 1))
+    assert router.route(message_update(2, 1))
+    assert not router.route(message_update(3, 1))
+    assert router.routed == 2 and router.rejected == 1
+    # Место освободилось — обновление принимается снова
+    assert transport.receive(0, timeout=0)['update_id'] == 1
+    assert router.route(message_update(3, 1))
+
+
+def test_stop_workers_sends_marker_to_every_shard():
+    transport = LocalTransport(2)
+    ShardRouter(transport).stop_workers()
+    assert transport.receive(0, timeout=0) == STOP
+    assert transport.receive(1, timeout=0) == STOP
+    assert transport.receive(0, timeout=0) is None
+
+
+def test_local_transport_send_raises_when_full():
+    transport = LocalTransport(1, maxsize=1)
+    transport.send(0, 'a')
+    with pytest.raises(queue.Full):
+        transport.send(0, 'b')
@@ -0,0 +1,85 @@
+import asyncio
+from datetime import timedelta
+
+from telegram.error import BadRequest, RetryAfter
+
+from streaming import STREAM_CURSOR, STREAM_INTERRUPTED_SUFFIX, TELEGRAM_MESSAGE_LIMIT, StreamingReply
+
+
+class FakeMessage:
+    """Сообщение Telegram, которое запоминает правки и ответы; edit_errors выбрасываются по очереди."""
+
+    def __init__(self, text, sent, edit_errors=()):
+        self.text = text
+        self.sent = sent
+        self.edits = []
+        self.edit_errors = list(edit_errors)
+        sent.append(self)
+
+    async def edit_text(self, text):
+        if self.edit_errors:
+            raise self.edit_errors.pop(0)
+        self.edits.append(text)
+        self.text = text
+
+    async def reply_text(self, text):
+        return FakeMessage(text, self.sent)
+
+
+def stream(chunks, edit_interval=0.0, edit_errors=(), fail=None):
+    async def run():
+        sent = []
+        reply = StreamingReply(FakeMessage('Дай мне подумать над этим...', sent, edit_errors), edit_interval)
+        for chunk in chunks:
+            await reply.append(chunk)
+        if fail is None:
+            await reply.finish()
+        else:
+            await reply.fail(fail)
+        return sent
+
+    return asyncio.run(run())
+
+
+def test_each_chunk_is_shown_with_cursor_and_finished_without_it():
+    [message] = stream(['Интеграл ', 'это ', 'площадь'])
+    assert message.edits == [
+        'Интеграл ' + STREAM_CURSOR,
+        'Интеграл это ' + STREAM_CURSOR,
+        'Интеграл это площадь' + STREAM_CURSOR,
+        'Интеграл это площадь',
+    ]
+
+
+def test_edits_are_throttled_between_intervals():
+    [message] = stream(['a', 'b', 'c', 'd'], edit_interval=0.05)
+    # Первый фрагмент показывается сразу, остальные — одной итоговой правкой после интервала
+    assert message.edits == ['a' + STREAM_CURSOR, 'abcd']
+
+
+def test_long_answer_continues_in_new_messages_without_breaking_words():
+    words = [f'слово{number} ' for number in range(1000)]
+    messages = stream(words)
+    texts = [message.text for message in messages]
+    assert len(messages) > 1
+    assert all(len(text) <= TELEGRAM_MESSAGE_LIMIT for text in texts)
+    assert ''.join(texts) == ''.join(words)
+    assert all(text.endswith(' ') for text in texts[:-1])
+
+
+def test_retry_after_defers_the_edit_and_forced_edit_waits_it_out():
+    errors = [RetryAfter(timedelta(seconds=0.01)), RetryAfter(timedelta(seconds=0.01))]
+    [message] = stream(['ответ'], edit_errors=errors)
+    assert message.edits == ['ответ']
+
+
+def test_not_modified_is_not_an_error():
+    [message] = stream(['ответ'], edit_errors=[BadRequest('Message is not modified')])
+    assert message.edits == ['ответ']
+
+
+def test_fail_keeps_partial_answer_or_shows_fallback():
+    [partial] = stream(['Половина '], fail='Сервис недоступен')
+    assert partial.text == 'Половина ' + STREAM_INTERRUPTED_SUFFIX
+    [empty] = stream([], fail='Сервис недоступен')
+    assert empty.edits == ['Сервис недоступен']
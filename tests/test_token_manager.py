@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+import stat
+import time
+
+import pytest
+
+from token_manager import FileTokenStore, TokenManager
+
+
+def make_manager(store):
+    calls = []
+
+    async def fetch_token():
+        calls.append(None)
+        return f'token-{len(calls)}', time.time() + 1800
+
+    return TokenManager(fetch_token, store=store), calls
+
+
+@pytest.mark.parametrize('content', [
+    '{not json',
+    '{"expires_at": 4102444800}',
+    '{"access_token": "abc"}',
+    '["abc", 4102444800]',
+    '{"access_token": null, "expires_at": 4102444800}',
+    '{"access_token": "abc", "expires_at": "never"}',
+    '{"access_token": "abc", "expires_at": Infinity}',
+])
+def test_corrupt_token_file_is_a_cache_miss(tmp_path, content):
+    store = FileTokenStore(str(tmp_path / 'token.json'))
+    with open(store.path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    assert store.load() is None
+    manager, calls = make_manager(store)
+    assert asyncio.run(manager.refresh()) == 'token-1'
+    assert len(calls) == 1
+    # Повреждённый файл заменён свежим токеном
+    assert store.load()[0] == 'token-1'
+
+
+def test_token_is_shared_through_store(tmp_path):
+    path = str(tmp_path / 'token.json')
+    first, first_calls = make_manager(FileTokenStore(path))
+    second, second_calls = make_manager(FileTokenStore(path))
+    assert asyncio.run(first.get_token()) == 'token-1'
+    assert asyncio.run(second.get_token()) == 'token-1'
+    assert len(first_calls) == 1 and second_calls == []
+
+
+def test_store_creates_private_directory(tmp_path):
+    store = FileTokenStore(str(tmp_path / 'private' / 'token.json'))
+    store.save('abc', time.time() + 60)
+    assert stat.S_IMODE(os.stat(tmp_path / 'private').st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(store.path).st_mode) == 0o600
+    with open(store.path, encoding='utf-8') as f:
+        assert json.load(f)['access_token'] == 'abc'
+
+
+def test_cancelled_acquire_closes_lock_fd(tmp_path):
+    store = FileTokenStore(str(tmp_path / 'token.json'))
+
+    async def main():
+        held = await store.acquire()
+        waiter = asyncio.ensure_future(store.acquire())
+        await asyncio.sleep(0.1)
+        open_fds = len(os.listdir('/proc/self/fd'))
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        closed = open_fds - len(os.listdir('/proc/self/fd'))
+        store.release(held)
+        return closed
+
+    if not os.path.isdir('/proc/self/fd'):
+        pytest.skip('нужен /proc/self/fd')
+    assert asyncio.run(main()) == 1
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import signal
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import tracing
+from profiler import SamplingProfiler
+from tracing import FileExporter, Tracer
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as source:
+        return [json.loads(line) for line in source]
+
+
+def run_traced(tracer, handler_name='handler.start', fail=False, sleep=0.0):
+    async def main():
+        with tracer.trace(handler_name, user_id=7):
+            with tracing.span('db.query', rows=1):
+                tracing.annotate(cached=False)
+            await asyncio.sleep(sleep)
+            if fail:
+                raise RuntimeError('boom')
+        return await tracer.flush()
+
+    return asyncio.run(main())
+
+
+def test_sampled_trace_is_written_as_jsonl_with_parent_links(tmp_path):
+    path = str(tmp_path / 'traces.jsonl')
+    tracer = Tracer(sample_rate=1.0, exporter=FileExporter(path))
+    with pytest.raises(RuntimeError):
+        run_traced(tracer, fail=True)
+    asyncio.run(tracer.flush())
+
+    root, child = sorted(read_lines(path), key=lambda record: record['parent_id'] is not None)
+    assert (root['name'], root['parent_id'], root['attributes'], root['error']) == (
+        'handler.start', None, {'user_id': 7}, 'RuntimeError: boom'
+    )
+    assert child['name'] == 'db.query' and child['parent_id'] == root['span_id']
+    assert child['trace_id'] == root['trace_id'] and child['attributes'] == {'rows': 1, 'cached': False}
+    assert child['duration_ms'] <= root['duration_ms']
+
+
+def test_only_slow_traces_are_kept_without_sampling(tmp_path):
+    exporter = FileExporter(str(tmp_path / 'traces.jsonl'))
+    tracer = Tracer(sample_rate=0.0, slow_threshold=0.05, exporter=exporter)
+    assert run_traced(tracer) == 0
+    assert run_traced(tracer, sleep=0.06) == 1
+
+
+def test_disabled_tracer_and_spans_outside_a_trace_are_noops():
+    tracer = Tracer(sample_rate=0.0, slow_threshold=0.0)
+    assert not tracer.enabled
+    with tracer.trace('handler.start') as root, tracing.span('db.query') as child:
+        assert root is None and child is None
+    assert tracer.exporter is None
+
+
+def test_otlp_export_and_pending_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, 'TRACE_MAX_SPANS', 2)
+    path = str(tmp_path / 'traces.otlp.jsonl')
+    exporter = FileExporter(path, format='otlp', max_pending=1)
+    tracer = Tracer(sample_rate=1.0, exporter=exporter)
+    for _ in range(2):
+        with tracer.trace('handler.handle_question'):
+            for _ in range(3):
+                with tracing.span('telegram.request'):
+                    pass
+    assert exporter.dropped == 1
+    assert exporter.flush() == 1
+
+    [request] = read_lines(path)
+    spans = request['resourceSpans'][0]['scopeSpans'][0]['spans']
+    # Корневой спан и один этап: остальные этапы не поместились в TRACE_MAX_SPANS
+    assert [(span['name'], span['kind']) for span in spans] == [('handler.handle_question', 2), ('telegram.request', 1)]
+    assert spans[1]['parentSpanId'] == spans[0]['spanId']
+    with pytest.raises(ValueError):
+        FileExporter(path, format='xml')
+
+
+def test_engine_queries_become_spans(tmp_path, monkeypatch):
+    exporter = FileExporter(str(tmp_path / 'traces.jsonl'))
+    monkeypatch.setattr(tracing, 'tracer', Tracer(sample_rate=1.0, exporter=exporter))
+    engine = create_engine('sqlite://')
+    tracing.instrument_engine(engine)
+    with tracing.tracer.trace('handler.get_resources'), engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+        with pytest.raises(Exception):
+            connection.execute(text('SELECT * FROM missing'))
+    exporter.flush()
+    queries = [record for record in read_lines(exporter.path) if record['name'] == 'db.query']
+    assert [query['attributes']['statement'] for query in queries] == ['SELECT 1', 'SELECT * FROM missing']
+    assert queries[0]['error'] is None and 'no such table' in queries[1]['error']
+
+
+def busy_profiled_function(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler_writes_folded_stacks(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_profiled_function, args=(stop,), name='busy-worker')
+    worker.start()
+    profiler = SamplingProfiler(interval=0.001, output_dir=str(tmp_path))
+
+    async def main():
+        profile = asyncio.create_task(profiler.run(0.1))
+        await asyncio.sleep(0.01)
+        # Пока снимается профиль, второй не запускается, а цикл событий не блокируется
+        with pytest.raises(RuntimeError):
+            await profiler.run(0.1)
+        return await profile
+
+    try:
+        path = asyncio.run(main())
+    finally:
+        stop.set()
+        worker.join()
+    with open(path, encoding='utf-8') as source:
+        lines = source.read().splitlines()
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
+    assert any(line.startswith('busy-worker;') and 'busy_profiled_function (test_tracing.py:' in line for line in lines)
+    assert 'sampling-profiler' not in ''.join(lines)
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR2'), reason='нет SIGUSR2')
+def test_signal_starts_a_profile(tmp_path):
+    profiler = SamplingProfiler(interval=0.001, output_dir=str(tmp_path))
+
+    async def main():
+        assert profiler.install_signal_handler(signal.SIGUSR2, seconds=0.05)
+        try:
+            os.kill(os.getpid(), signal.SIGUSR2)
+            deadline = time.monotonic() + 5
+            while profiler.profiles == 0 or profiler.running:
+                assert time.monotonic() < deadline
+                await asyncio.sleep(0.01)
+        finally:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR2)
+
+    asyncio.run(main())
+    assert len(os.listdir(tmp_path)) == 1
@@ -0,0 +1,85 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import HEALTH_PATH, SECRET_TOKEN_HEADER, Overloaded, RecentUpdateIds, create_webhook_app
+
+
+def test_recent_update_ids_is_bounded():
+    recent = RecentUpdateIds(maxsize=2)
+    assert recent.add(1) and recent.add(2)
+    assert not recent.add(1)
+    assert recent.add(3)
+    # Самый старый id вытеснен и снова принимается
+    assert recent.add(1)
+    recent.discard(3)
+    assert recent.add(3)
+
+
+def post_updates(updates, process=None, secret_token=None, headers=None):
+    received = []
+
+    async def default_process(data):
+        received.append(data['update_id'])
+
+    async def main():
+        app = create_webhook_app(process or default_process, path='/telegram', secret_token=secret_token)
+        async with TestClient(TestServer(app)) as client:
+            statuses = []
+            for update in updates:
+                response = await client.post('/telegram', json=update, headers=headers)
+                statuses.append(response.status)
+            health = await (await client.get(HEALTH_PATH)).json()
+        return statuses, health
+
+    statuses, health = asyncio.run(main())
+    return statuses, health, received
+
+
+def test_duplicate_updates_are_processed_once():
+    statuses, health, received = post_updates([{'update_id': 1}, {'update_id': 2}, {'update_id': 1}])
+    assert statuses == [200, 200, 200]
+    assert received == [1, 2]
+    assert health['received'] == 2 and health['duplicates'] == 1
+
+
+def test_invalid_updates_are_rejected():
+    statuses, health, received = post_updates([{'update_id': 'x'}, ['not', 'a', 'dict']])
+    assert statuses == [400, 400]
+    assert received == [] and health['rejected'] == 2
+
+
+def test_secret_token_is_checked():
+    statuses, _, received = post_updates([{'update_id': 1}], secret_token='secret', headers={SECRET_TOKEN_HEADER: 'wrong'})
+    assert statuses == [403] and received == []
+    statuses, _, received = post_updates([{'update_id': 1}], secret_token='secret', headers={SECRET_TOKEN_HEADER: 'secret'})
+    assert statuses == [200] and received == [1]
+
+
+def test_overloaded_update_is_not_remembered_as_duplicate():
+    attempts = []
+
+    async def process(data):
+        attempts.append(data['update_id'])
+        if len(attempts) == 1:
+            raise Overloaded('queue is full')
+
+    statuses, health, _ = post_updates([{'update_id': 1}, {'update_id': 1}], process=process)
+    # Telegram повторит обновление после 503, и повтор будет принят
+    assert statuses == [503, 200]
+    assert attempts == [1, 1]
+    assert health['overloaded'] == 1 and health['received'] == 1 and health['duplicates'] == 0
+
+
+def test_failed_update_is_processed_on_retry():
+    attempts = []
+
+    async def process(data):
+        attempts.append(data['update_id'])
+        if len(attempts) == 1:
+            raise ValueError('cannot parse update')
+
+    statuses, health, _ = post_updates([{'update_id': 7}, {'update_id': 7}, {'update_id': 7}], process=process)
+    assert statuses == [500, 200, 200]
+    assert attempts == [7, 7]
+    assert health['failed'] == 1 and health['received'] == 1 and health['duplicates'] == 1
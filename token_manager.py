@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+# Токен хранится в личном каталоге пользователя, а не в общем /tmp, где имя файла
+# можно угадать и подложить свой файл или символическую ссылку заранее
+GIGACHAT_TOKEN_STORE = os.getenv(
+    'GIGACHAT_TOKEN_STORE',
+    os.path.join(
+        os.getenv('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.cache'),
+        'studyhomie',
+        'gigachat_token.json'
+    )
+)
+# За сколько секунд до истечения токен обновляется в фоне
+GIGACHAT_TOKEN_REFRESH_MARGIN = float(os.getenv('GIGACHAT_TOKEN_REFRESH_MARGIN', '300'))
+# Пауза перед повторной попыткой, если обновление не удалось
+GIGACHAT_TOKEN_RETRY_INTERVAL = float(os.getenv('GIGACHAT_TOKEN_RETRY_INTERVAL', '5'))
+
+logger = logging.getLogger(__name__)
+
+
+class FileTokenStore:
+    """
+    Хранит токен в локальном файле, общем для всех процессов бота.
+
+    Запись атомарна (временный файл + os.replace), а обновление токена
+    сериализуется через flock на отдельном файле блокировки. Каталог файла
+    создаётся с правами 0700. Повреждённый или неполный файл считается
+    отсутствующим: токен просто запрашивается заново.
+    """
+
+    def __init__(self, path=GIGACHAT_TOKEN_STORE):
+        self.path = path
+        self.lock_path = f'{path}.lock'
+
+    def _ensure_directory(self):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        return directory
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            access_token, expires_at = data['access_token'], float(data['expires_at'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Файл токена {self.path} повреждён, токен будет запрошен заново: {e!r}")
+            return None
+        if not isinstance(access_token, str) or not access_token or not math.isfinite(expires_at):
+            logger.warning(f"Файл токена {self.path} содержит некорректные данные, токен будет запрошен заново")
+            return None
+        return access_token, expires_at
+
+    def save(self, access_token, expires_at):
+        directory = self._ensure_directory()
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.token-')
+        try:
+            # Токен — секрет, поэтому файл доступен только владельцу
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'access_token': access_token, 'expires_at': expires_at}, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    async def acquire(self):
+        """Захватывает межпроцессную блокировку, не блокируя цикл событий."""
+        self._ensure_directory()
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is None:
+            return fd
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    await asyncio.sleep(0.05)
+        except BaseException:
+            # В том числе отмена во время ожидания блокировки: дескриптор не должен утечь
+            os.close(fd)
+            raise
+
+    def release(self, fd):
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+class TokenManager:
+    """
+    Управляет OAuth-токеном GigaChat.
+
+    Токен обновляется фоновой задачей заранее, за refresh_margin секунд до
+    истечения. Внутри процесса одновременно выполняется не более одного
+    обновления, а между процессами токен делится через store, поэтому
+    oauth-эндпоинт вызывает только тот воркер, который первым захватил блокировку.
+    """
+
+    def __init__(
+        self,
+        fetch_token,
+        store=None,
+        refresh_margin=GIGACHAT_TOKEN_REFRESH_MARGIN,
+        retry_interval=GIGACHAT_TOKEN_RETRY_INTERVAL
+    ):
+        # fetch_token — корутина без аргументов, возвращающая (access_token, expires_at в секундах)
+        self._fetch_token = fetch_token
+        self.store = store if store is not None else FileTokenStore()
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.access_token = None
+        self.expires_at = 0.0
+        self.refresh_count = 0
+        self._refresh_task = None
+        self._background_task = None
+
+    def _is_valid(self, expires_at, margin=0.0):
+        return time.time() < expires_at - margin
+
+    async def get_token(self):
+        # Быстрый путь: токен в памяти ещё действует (фоновая задача обновит его заранее)
+        if self.access_token is not None and self._is_valid(self.expires_at):
+            return self.access_token
+        return await self.refresh()
+
+    async def refresh(self):
+        # Single-flight: все ожидающие присоединяются к уже идущему обновлению
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        await asyncio.shield(self._refresh_task)
+        return self.access_token
+
+    def _adopt(self, cached):
+        if cached is None or not self._is_valid(cached[1], self.refresh_margin):
+            return False
+        self.access_token, self.expires_at = cached
+        return True
+
+    async def _refresh(self):
+        # Возможно, токен уже обновил другой процесс
+        if self._adopt(self.store.load()):
+            return
+        try:
+            fd = await self.store.acquire()
+        except OSError as e:
+            # Без общего хранилища токен запрашивается этим процессом сам
+            logger.warning(f"Не удалось захватить блокировку токена {self.store.lock_path}: {e}")
+            fd = None
+        try:
+            if self._adopt(self.store.load()):
+                return
+            access_token, expires_at = await self._fetch_token()
+            self.access_token, self.expires_at = access_token, expires_at
+            self.refresh_count += 1
+            try:
+                self.store.save(access_token, expires_at)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить токен в {self.store.path}: {e}")
+        finally:
+            if fd is not None:
+                self.store.release(fd)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+                # Просыпаемся за refresh_margin до истечения; небольшой разброс
+                # разводит воркеры, стартовавшие одновременно
+                delay = self.expires_at - self.refresh_margin - time.time()
+                delay = max(delay, self.retry_interval) + random.uniform(0, self.retry_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при фоновом обновлении Access Token: {e}")
+                delay = self.retry_interval
+            await asyncio.sleep(delay)
+
+    def start(self):
+        if self._background_task is None or self._background_task.done():
+            self._background_task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._background_task is not None:
+            self._background_task.cancel()
+            try:
+                await self._background_task
+            except asyncio.CancelledError:
+                pass
+            self._background_task = None
@@ -0,0 +1,362 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+# Доля обновлений, которые трассируются целиком (0 — только медленные, см. ниже)
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+# Обработчики дольше этого порога (в секундах) записываются всегда; 0 — отключено
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', '0'))
+# Файл трасс и его формат: jsonl (спан на строку) или otlp (OTLP/JSON, запрос на строку)
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_FORMAT = os.getenv('TRACE_FORMAT', 'jsonl')
+# Как часто дописывать трассы в файл (в секундах)
+TRACE_FLUSH_INTERVAL = float(os.getenv('TRACE_FLUSH_INTERVAL', '1'))
+# Сколько трасс может ждать записи; лишние отбрасываются
+TRACE_MAX_PENDING = int(os.getenv('TRACE_MAX_PENDING', '10000'))
+# Предел спанов в одной трассе (длинный потоковый ответ порождает много правок сообщения)
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '256'))
+
+SERVICE_NAME = 'studyhomie'
+
+logger = logging.getLogger(__name__)
+
+# Текущий спан задачи; asyncio копирует контекст в дочерние задачи, поэтому
+# хеджированные запросы и обработчики block=False попадают в свою трассу
+_current_span = ContextVar('studyhomie_current_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start_ns', 'started_at', 'duration', 'attributes', 'error')
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.started_at = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        self.duration = time.perf_counter() - self.started_at
+        if error is not None:
+            self.error = 'cancelled' if isinstance(error, asyncio.CancelledError) else f'{type(error).__name__}: {error}'
+
+
+class Trace:
+    __slots__ = ('trace_id', 'sampled', 'spans')
+
+    def __init__(self, sampled):
+        self.trace_id = random.getrandbits(128)
+        self.sampled = sampled
+        self.spans = []
+
+
+class _SpanScope:
+    """Контекстный менеджер спана: делает спан текущим и закрывает его на выходе."""
+
+    __slots__ = ('span', '_token')
+
+    def __init__(self, span):
+        self.span = span
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.span.end(exc)
+        return False
+
+
+class _RootScope(_SpanScope):
+    __slots__ = ('tracer',)
+
+    def __init__(self, tracer, root):
+        super().__init__(root)
+        self.tracer = tracer
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        self.tracer.finish(self.span)
+        return False
+
+
+class _NoopScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopScope()
+
+
+def start_span(name, **attributes):
+    """Дочерний спан текущего, не становящийся текущим (для обработчиков событий); None вне трассы."""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    trace = parent.trace
+    if len(trace.spans) >= TRACE_MAX_SPANS:
+        return None
+    span = Span(trace, name, parent.span_id, attributes)
+    trace.spans.append(span)
+    return span
+
+
+def span(name, **attributes):
+    """
+    Этап обработки: with tracing.span('db.query'): ...
+
+    Вне трассы (обновление не попало в выборку или трассировка отключена)
+    возвращает пустой контекстный менеджер без выделения памяти.
+    """
+    child = start_span(name, **attributes)
+    if child is None:
+        return _NOOP
+    return _SpanScope(child)
+
+
+def annotate(**attributes):
+    """Добавляет атрибуты к текущему спану, если он есть."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def _span_record(span):
+    return {
+        'trace_id': f'{span.trace.trace_id:032x}',
+        'span_id': f'{span.span_id:016x}',
+        'parent_id': f'{span.parent_id:016x}' if span.parent_id else None,
+        'name': span.name,
+        'start': span.start_ns / 1e9,
+        'duration_ms': round(span.duration * 1000, 3) if span.duration is not None else None,
+        'attributes': span.attributes,
+        'error': span.error,
+    }
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_span(span):
+    record = {
+        'traceId': f'{span.trace.trace_id:032x}',
+        'spanId': f'{span.span_id:016x}',
+        'name': span.name,
+        'kind': 1 if span.parent_id else 2,  # INTERNAL для этапов, SERVER для обработчика
+        'startTimeUnixNano': str(span.start_ns),
+        'endTimeUnixNano': str(span.start_ns + int((span.duration or 0) * 1e9)),
+        'attributes': [
+            {'key': key, 'value': _otlp_value(value)} for key, value in span.attributes.items() if value is not None
+        ],
+        'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+    }
+    if span.parent_id:
+        record['parentSpanId'] = f'{span.parent_id:016x}'
+    return record
+
+
+class FileExporter:
+    """
+    Дописывает завершённые трассы в локальный файл.
+
+    Формат jsonl — спан на строку; otlp — по строке ExportTraceServiceRequest
+    в OTLP/JSON на трассу (формат файлового экспортёра OpenTelemetry Collector).
+    export() только ставит трассу в очередь, сериализация и запись выполняются
+    в flush() вне цикла событий.
+    """
+
+    def __init__(self, path=TRACE_FILE, format=TRACE_FORMAT, max_pending=TRACE_MAX_PENDING):
+        if format not in ('jsonl', 'otlp'):
+            raise ValueError(f"Неизвестный формат трасс: {format}")
+        self.path = path
+        self.format = format
+        self._pending = deque(maxlen=max(max_pending, 1))
+        self.exported = 0
+        self.dropped = 0
+
+    def export(self, trace):
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self._pending.append(trace)
+
+    def _lines(self, trace):
+        if self.format == 'otlp':
+            yield json.dumps({
+                'resourceSpans': [{
+                    'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+                    'scopeSpans': [{'scope': {'name': __name__}, 'spans': [_otlp_span(span) for span in trace.spans]}],
+                }]
+            }, ensure_ascii=False)
+            return
+        for span in trace.spans:
+            yield json.dumps(_span_record(span), ensure_ascii=False, default=str)
+
+    def flush(self):
+        """Записывает накопленные трассы; возвращает их число."""
+        traces = []
+        while self._pending:
+            traces.append(self._pending.popleft())
+        if not traces:
+            return 0
+        with open(self.path, 'a', encoding='utf-8') as output:
+            for trace in traces:
+                for line in self._lines(trace):
+                    output.write(line + '\n')
+        self.exported += len(traces)
+        return len(traces)
+
+
+class Tracer:
+    """
+    Трассировка обработчиков: корневой спан на вызов обработчика и дочерние
+    спаны этапов (ожидание пула, SQL, токен и запросы GigaChat, Bot API).
+
+    Решение о записи принимается в начале (доля sample_rate) или в конце
+    трассы, если она дольше slow_threshold; во втором случае спаны собираются
+    для каждого обновления и отбрасываются, если обработчик оказался быстрым.
+    При sample_rate = slow_threshold = 0 трассировка полностью отключена.
+    """
+
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, slow_threshold=TRACE_SLOW_THRESHOLD, exporter=None):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.enabled = sample_rate > 0 or slow_threshold > 0
+        self.exporter = exporter
+        self._task = None
+
+    def trace(self, name, **attributes):
+        """Корневой спан; вне выборки возвращает пустой контекстный менеджер."""
+        sampled = random.random() < self.sample_rate
+        if not sampled and not self.slow_threshold:
+            return _NOOP
+        trace = Trace(sampled)
+        root = Span(trace, name, None, attributes)
+        trace.spans.append(root)
+        return _RootScope(self, root)
+
+    def finish(self, root):
+        trace = root.trace
+        if trace.sampled or (self.slow_threshold and root.duration >= self.slow_threshold):
+            if self.exporter is None:
+                self.exporter = FileExporter()
+            self.exporter.export(trace)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        if self.exporter is None:
+            return 0
+        try:
+            return await asyncio.to_thread(self.exporter.flush)
+        except Exception as e:
+            logger.error(f"Ошибка при записи трасс: {e}")
+            return 0
+
+    def start(self):
+        if self.enabled and self._task is None:
+            logger.info(
+                f"Трассировка включена: выборка {self.sample_rate:.0%}, медленные от {self.slow_threshold} с, "
+                f"файл {self.exporter.path if self.exporter else TRACE_FILE}"
+            )
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# Общий трассировщик процесса
+tracer = Tracer()
+
+
+def traced_handler(callback):
+    """Оборачивает обработчик PTB корневым спаном handler.<имя>."""
+    name = f'handler.{callback.__name__}'
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user = getattr(update, 'effective_user', None)
+        with tracer.trace(name, update_id=getattr(update, 'update_id', None), user_id=user.id if user else None):
+            return await callback(update, context)
+
+    return wrapper
+
+
+def instrument_handlers(application):
+    if not tracer.enabled:
+        return
+    for group, handlers in application.handlers.items():
+        # Служебные обработчики отрицательных групп (учёт активности) трассы не интересуют
+        if group < 0:
+            continue
+        for handler in handlers:
+            handler.callback = traced_handler(handler.callback)
+
+
+def instrument_engine(engine):
+    """Спан db.query на каждый SQL-запрос движка (синхронного или AsyncEngine) внутри трассы."""
+    if not tracer.enabled:
+        return
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    if getattr(sync_engine, '_tracing_instrumented', False):
+        return
+    sync_engine._tracing_instrumented = True
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._trace_span = start_span('db.query', statement=statement[:200])
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        query_span = getattr(context, '_trace_span', None)
+        if query_span is not None:
+            query_span.end()
+
+    def handle_error(exception_context):
+        query_span = getattr(exception_context.execution_context, '_trace_span', None)
+        if query_span is not None:
+            query_span.end(exception_context.original_exception)
+
+    event.listen(sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(sync_engine, 'handle_error', handle_error)
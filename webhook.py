@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import signal
+from collections import OrderedDict
+
+from aiohttp import web
+from dotenv import load_dotenv
+from telegram import Update
+
+# Загрузка переменных окружения
+load_dotenv()
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Публичный адрес бота (https://example.com); если не задан, setWebhook не вызывается
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+# Сколько последних update_id помнить для отбрасывания повторов
+WEBHOOK_DEDUP_SIZE = int(os.getenv('WEBHOOK_DEDUP_SIZE', '10000'))
+
+HEALTH_PATH = '/healthz'
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Обновление не может быть принято сейчас; Telegram получит 503 и повторит его позже."""
+
+
+class RecentUpdateIds:
+    """Ограниченное множество недавно принятых update_id."""
+
+    def __init__(self, maxsize=WEBHOOK_DEDUP_SIZE):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+
+    def add(self, update_id):
+        """Запоминает update_id; возвращает False, если он уже встречался."""
+        if update_id in self._ids:
+            return False
+        self._ids[update_id] = None
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+        return True
+
+    def discard(self, update_id):
+        """Забывает update_id, чтобы повтор непринятого обновления не считался дубликатом."""
+        self._ids.pop(update_id, None)
+
+
+def create_webhook_app(
+    process_update_data,
+    path=WEBHOOK_PATH,
+    secret_token=WEBHOOK_SECRET_TOKEN,
+    dedup_size=WEBHOOK_DEDUP_SIZE
+):
+    """
+    Создаёт aiohttp-приложение, принимающее обновления Telegram.
+
+    process_update_data — корутина, получающая JSON обновления. Она должна
+    быстро поставить обновление в очередь: Telegram повторяет запрос, если
+    не получил ответ вовремя. Повторы с уже принятым update_id отбрасываются.
+    Если очередь заполнена, корутина бросает Overloaded и Telegram получает 503.
+    """
+    recent_ids = RecentUpdateIds(dedup_size)
+    counters = {'received': 0, 'duplicates': 0, 'rejected': 0, 'overloaded': 0, 'failed': 0}
+
+    async def handle_update(request):
+        if secret_token and request.headers.get(SECRET_TOKEN_HEADER) != secret_token:
+            counters['rejected'] += 1
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            counters['rejected'] += 1
+            return web.Response(status=400, text='invalid json')
+        update_id = data.get('update_id') if isinstance(data, dict) else None
+        if not isinstance(update_id, int):
+            counters['rejected'] += 1
+            return web.Response(status=400, text='missing update_id')
+        if not recent_ids.add(update_id):
+            counters['duplicates'] += 1
+            return web.json_response({'ok': True, 'duplicate': True})
+        try:
+            await process_update_data(data)
+        except Overloaded as e:
+            recent_ids.discard(update_id)
+            counters['overloaded'] += 1
+            logger.warning(f"Обновление {update_id} не принято: {e}")
+            return web.Response(status=503, headers={'Retry-After': '1'}, text='overloaded')
+        except Exception:
+            # Telegram повторит обновление после 500, и повтор не должен считаться дубликатом
+            recent_ids.discard(update_id)
+            counters['failed'] += 1
+            raise
+        counters['received'] += 1
+        return web.json_response({'ok': True})
+
+    async def handle_health(request):
+        return web.json_response({'status': 'ok', **counters})
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get(HEALTH_PATH, handle_health)
+    return app
+
+
+async def wait_for_stop_signal():
+    """Ждёт SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop_event.wait()
+
+
+async def serve_until_stopped(web_app, host, port):
+    """Запускает HTTP-сервер и ждёт SIGINT/SIGTERM."""
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {host}:{port}")
+    try:
+        await wait_for_stop_signal()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(application, host=WEBHOOK_HOST, port=WEBHOOK_PORT, url=WEBHOOK_URL):
+    """
+    Запускает бота в режиме webhook на встроенном aiohttp-сервере.
+
+    Если url не задан, вебхук в Telegram не регистрируется: так сервер можно
+    проверить локально, отправляя записанные обновления POST-запросом на WEBHOOK_PATH.
+    """
+    async def enqueue(data):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    web_app = create_webhook_app(enqueue)
+    async with application:
+        # В отличие от run_polling, ручной запуск не вызывает post_init/post_shutdown сам
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+        if url:
+            await application.bot.set_webhook(
+                url=f"{url.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info("Webhook зарегистрирован в Telegram.")
+        try:
+            await serve_until_stopped(web_app, host, port)
+        finally:
+            await application.stop()
+    if application.post_shutdown is not None:
+        await application.post_shutdown(application)